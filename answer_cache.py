@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+from metrics import metrics
+
+def normalize_question(question):
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?!. ")
+
+def _serialize(response):
+    return json.dumps({
+        "answer": response["answer"],
+        "sources": [{"page_content": d.page_content, "metadata": d.metadata} for d in response["sources"]],
+    })
+
+def _deserialize(payload):
+    data = json.loads(payload)
+    return {
+        "answer": data["answer"],
+        "sources": [Document(page_content=s["page_content"], metadata=s["metadata"]) for s in data["sources"]],
+    }
+
+# Two-level cache in front of MdRag.query. Exact hits match on the normalized
+# question text; semantic hits reuse the answer of the closest cached
+# question when its embedding is within `threshold` cosine similarity.
+# Entries are persisted in SQLite, expire after `ttl` seconds, are evicted
+# least recently used past `max_entries`, and are dropped as soon as any
+# chunk they cited is removed from the index.
+class AnswerCache:
+    def __init__(self, path="cache/answers.sqlite", threshold=0.95, ttl=86400, max_entries=1000):
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, embedding BLOB, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answer_sources (key TEXT NOT NULL, chunk_id TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answer_sources_chunk ON answer_sources(chunk_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answer_sources_key ON answer_sources(key)")
+        self._conn.commit()
+
+        self._expire()
+        self._load_embeddings()
+
+    def _load_embeddings(self):
+        keys, vectors = [], []
+        for key, blob in self._conn.execute("SELECT key, embedding FROM answers WHERE embedding IS NOT NULL"):
+            keys.append(key)
+            vectors.append(np.frombuffer(blob, dtype=np.float32))
+        self._keys = keys
+        self._matrix = np.vstack(vectors) if vectors else None
+
+    def _delete_keys(self, keys):
+        if not keys:
+            return
+        self._conn.executemany("DELETE FROM answers WHERE key = ?", [(k,) for k in keys])
+        self._conn.executemany("DELETE FROM answer_sources WHERE key = ?", [(k,) for k in keys])
+        self._conn.commit()
+        self._load_embeddings()
+
+    def _expire(self):
+        if not self.ttl:
+            return
+        cutoff = time.time() - self.ttl
+        expired = [row[0] for row in self._conn.execute("SELECT key FROM answers WHERE created < ?", (cutoff,))]
+        self._delete_keys(expired)
+
+    def _fetch(self, key):
+        row = self._conn.execute("SELECT response, created FROM answers WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if self.ttl and row[1] < time.time() - self.ttl:
+            self._delete_keys([key])
+            return None
+        self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return _deserialize(row[0])
+
+    def get_exact(self, question):
+        with self._lock:
+            response = self._fetch(normalize_question(question))
+            if response is not None:
+                self.exact_hits += 1
+                metrics.incr("cache_lookups", cache="answer", result="exact")
+                response["cached"] = "exact"
+            return response
+
+    def get_semantic(self, embedding):
+        with self._lock:
+            if self._matrix is not None:
+                query = np.asarray(embedding, dtype=np.float32)
+                query = query / (np.linalg.norm(query) or 1.0)
+                scores = self._matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    response = self._fetch(self._keys[best])
+                    if response is not None:
+                        self.semantic_hits += 1
+                        metrics.incr("cache_lookups", cache="answer", result="semantic")
+                        response["cached"] = "semantic"
+                        return response
+            self.misses += 1
+            metrics.incr("cache_lookups", cache="answer", result="miss")
+            return None
+
+    def put(self, question, embedding, response):
+        key = normalize_question(question)
+        blob = None
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            blob = (vector / (np.linalg.norm(vector) or 1.0)).tobytes()
+        now = time.time()
+        chunk_ids = {d.metadata.get("chunk_id") for d in response["sources"]} - {None}
+
+        with self._lock:
+            self._conn.execute("DELETE FROM answer_sources WHERE key = ?", (key,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, response, embedding, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, _serialize(response), blob, now, now)
+            )
+            self._conn.executemany(
+                "INSERT INTO answer_sources (key, chunk_id) VALUES (?, ?)", [(key, c) for c in chunk_ids]
+            )
+            self._conn.commit()
+
+            count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if self.max_entries and count > self.max_entries:
+                evicted = [row[0] for row in self._conn.execute(
+                    "SELECT key FROM answers ORDER BY last_used ASC LIMIT ?", (count - self.max_entries,)
+                )]
+                self._delete_keys(evicted)
+            else:
+                self._load_embeddings()
+
+    def invalidate_chunks(self, chunk_ids):
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return 0
+        with self._lock:
+            keys = set()
+            for i in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                keys.update(row[0] for row in self._conn.execute(
+                    f"SELECT DISTINCT key FROM answer_sources WHERE chunk_id IN ({placeholders})", batch
+                ))
+            self._delete_keys(list(keys))
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.execute("DELETE FROM answer_sources")
+            self._conn.commit()
+            self._load_embeddings()
+
+    def stats(self):
+        total = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._keys),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / total if total else 0.0,
+        }
@@ -164,11 +164,13 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-SOURCE_DIR = "llm_sources"
-
 @st.cache_resource
 def get_rag_system():
-    return MdRag(temperature=0.3)
+    rag = MdRag(temperature=0.3, background_sync=True)
+    if os.getenv("WATCH_SOURCES", "").lower() in ("1", "true", "yes"):
+        from watcher import SourceWatcher
+        SourceWatcher(rag, debounce=float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2"))).start()
+    return rag
 
 def log_feedback(question, answer, rating):
     feedback_dir = "feedback"
@@ -185,7 +187,54 @@ def log_feedback(question, answer, rating):
         
         writer.writerow([datetime.datetime.now(), question, answer, rating])
 
+@st.fragment(run_every=2)
+def sync_status_panel(rag):
+    status = rag.sync_status
+    if status["running"]:
+        total = status["files_total"]
+        if total:
+            st.progress(
+                status["files_done"] / total,
+                text=f"Syncing: {status['files_done']}/{total} files, {status['chunks_indexed']} chunks indexed"
+            )
+        else:
+            st.caption(f"Syncing: {status['phase']}...")
+    elif status["error"]:
+        st.error(f"Last sync failed: {status['error']}")
+    elif status["finished_at"]:
+        finished = datetime.datetime.fromtimestamp(status["finished_at"]).strftime("%H:%M:%S")
+        st.caption(f"Knowledge base up to date (synced {finished}).")
+
+@st.fragment(run_every=5)
+def metrics_panel(rag):
+    snapshot = rag.metrics.snapshot()
+    if not snapshot["spans"] and not snapshot["counters"]:
+        st.caption("No metrics recorded yet.")
+        return
+    st.dataframe(
+        [
+            {
+                "stage": span["name"] + "".join(f" {v}" for v in span["labels"].values()),
+                "count": span["count"],
+                "total s": round(span["total_s"], 2),
+                "p50 ms": round(span["p50_ms"], 1),
+                "p95 ms": round(span["p95_ms"], 1),
+            }
+            for span in snapshot["spans"]
+        ],
+        hide_index=True
+    )
+    for counter in snapshot["counters"]:
+        labels = ", ".join(f"{k}={v}" for k, v in counter["labels"].items())
+        st.caption(f"{counter['name']}{f' ({labels})' if labels else ''}: {counter['value']}")
+
 def main():
+    try:
+        rag = get_rag_system()
+    except Exception as e:
+        st.error(f"Failed to initialize RAG system: {e}")
+        return
+
     with st.sidebar:
         if os.getenv("GOOGLE_API_KEY"):
             st.success("Using Gemini")
@@ -194,13 +243,21 @@ def main():
         
         st.divider()
         st.header("Knowledge Base")
-        st.write(f"Source: `{SOURCE_DIR}`")
+        st.write("Source: " + ", ".join(f"`{root}`" for root in rag.scanner.roots))
         
-        if st.button("Sync Knowledge Base"):
-            with st.spinner("Syncing database..."):
-                st.cache_resource.clear()
-                st.success("Database synced.")
-                st.rerun()
+        # Syncs run in the background on the same MdRag instance, so loaded
+        # models are reused and questions are answered from the current index.
+        if st.button("Sync Knowledge Base", disabled=rag.is_syncing()):
+            rag.start_sync()
+            st.rerun()
+        sync_status_panel(rag)
+
+        cache_stats = rag.answer_cache.stats()
+        st.caption(
+            f"Answer cache: {cache_stats['hit_rate']:.0%} hit rate, {cache_stats['entries']} cached answers"
+        )
+        with st.expander("Metrics"):
+            metrics_panel(rag)
         st.divider()
         if st.button("Clear Chat History"):
             st.session_state.messages = []
@@ -208,12 +265,6 @@ def main():
 
     st.title("Chat with your Knowledge Base ")
 
-    try:
-        rag = get_rag_system()
-    except Exception as e:
-        st.error(f"Failed to initialize RAG system: {e}")
-        return
-
     if "messages" not in st.session_state:
         st.session_state.messages = []
 
@@ -262,21 +313,25 @@ def main():
 
     if st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
         with st.chat_message("assistant"):
+            prompt = st.session_state.messages[-1]["content"]
+            stream = rag.stream_query(prompt)
+
             with st.spinner("Thinking..."):
-                prompt = st.session_state.messages[-1]["content"]
-                response = rag.query(prompt)
-                
-                sources_text = []
-                if isinstance(response, dict):
-                    answer = response["answer"]
-                    sources = response["sources"]
-                else:
-                    answer = response
-                    sources = []
-
-                for doc in sources:
-                    content = doc.metadata.get("original_content", doc.page_content)
-                    sources_text.append(content)
+                kind, payload = next(stream)
+
+            sources = []
+            if kind == "sources":
+                sources = payload
+                # Remaining events are answer tokens, or a final error message.
+                answer = st.write_stream(text for _, text in stream)
+            else:
+                answer = payload
+                st.markdown(answer)
+
+            sources_text = []
+            for doc in sources:
+                content = doc.metadata.get("original_content", doc.page_content)
+                sources_text.append(content)
         
         st.session_state.messages.append({"role": "assistant", "content": answer, "sources": sources_text})
         st.rerun()
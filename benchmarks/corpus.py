@@ -0,0 +1,60 @@
+import os
+import random
+
+# Seeded generator of markdown source trees with a controllable shape, so
+# benchmark runs are comparable across machines and commits.
+
+def _vocabulary(rng, size=3000):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(size)]
+
+def _paragraph(rng, vocabulary, words):
+    sentences = []
+    while words > 0:
+        n = min(words, rng.randint(8, 20))
+        sentence = " ".join(rng.choice(vocabulary) for _ in range(n))
+        sentences.append(sentence.capitalize() + ".")
+        words -= n
+    return " ".join(sentences)
+
+def _sections(rng, vocabulary, depth, max_depth, fanout, section_words, lines):
+    for i in range(fanout):
+        title = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 4))).title()
+        lines.append(f"{'#' * depth} {title}\n")
+        words = max(10, int(rng.gauss(section_words, section_words / 3)))
+        # Split long sections into paragraphs of roughly 120 words.
+        while words > 0:
+            n = min(words, 120)
+            lines.append(_paragraph(rng, vocabulary, n) + "\n")
+            words -= n
+        if depth < max_depth:
+            _sections(rng, vocabulary, depth + 1, max_depth, rng.randint(1, fanout), section_words, lines)
+
+def generate_document(rng, vocabulary, header_depth=3, sections=4, section_words=200):
+    lines = []
+    _sections(rng, vocabulary, 1, header_depth, sections, section_words, lines)
+    return "\n".join(lines)
+
+def generate_corpus(root, files=50, header_depth=3, sections=4, section_words=200, dirs=5, seed=0):
+    # Writes `files` markdown files spread over `dirs` subdirectories of
+    # `root`. Each file has `sections` top-level sections nested up to
+    # `header_depth` levels, with about `section_words` words per section.
+    # Returns the list of written paths and the vocabulary they draw from.
+    rng = random.Random(seed)
+    vocabulary = _vocabulary(rng)
+    paths = []
+    for i in range(files):
+        directory = os.path.join(root, f"section_{i % dirs:02d}") if dirs > 1 else root
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"doc_{i:05d}.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(generate_document(rng, vocabulary, header_depth, sections, section_words))
+        paths.append(path)
+    return paths, vocabulary
+
+def generate_questions(n, vocabulary, seed=0):
+    rng = random.Random(seed + 1)
+    return [
+        f"What does the documentation say about {' '.join(rng.sample(vocabulary, 3))}? (#{i})"
+        for i in range(n)
+    ]
@@ -0,0 +1,232 @@
+import re
+import time
+import json
+import asyncio
+import hashlib
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Deterministic stand-ins for the LLM, the embedding model and Chroma, so
+# the pipeline can be timed without a model download or a live endpoint.
+
+def _seed(text):
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+
+# Tracks how many calls are in flight over time, so a run can report how
+# well it used the concurrency it was given.
+class _Occupancy:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = 0
+        self._busy = 0.0
+        self._last = None
+        self._start = None
+
+    def _advance(self, now):
+        if self._last is not None:
+            self._busy += self.in_flight * (now - self._last)
+        self._last = now
+
+    def enter(self):
+        with self._lock:
+            now = time.perf_counter()
+            if self._start is None:
+                self._start = now
+            self._advance(now)
+            self.in_flight += 1
+            self.calls += 1
+            self.peak = max(self.peak, self.in_flight)
+
+    def exit(self):
+        with self._lock:
+            self._advance(time.perf_counter())
+            self.in_flight -= 1
+
+    def reset(self):
+        with self._lock:
+            self.peak = self.in_flight
+            self.calls = 0
+            self._busy = 0.0
+            self._last = self._start = None
+
+    def stats(self, limit=None):
+        with self._lock:
+            self._advance(time.perf_counter())
+            elapsed = (self._last - self._start) if self._start is not None else 0.0
+            mean = self._busy / elapsed if elapsed else 0.0
+            stats = {"calls": self.calls, "peak_in_flight": self.peak, "mean_in_flight": mean}
+            if limit:
+                stats["utilization"] = mean / limit
+            return stats
+
+class FakeChatModel(BaseChatModel):
+    # Answers every prompt after `latency` seconds (plus `per_token` per
+    # generated word) with `words` pseudo-random words derived from the prompt.
+    model: str = "fake-chat"
+    latency: float = 0.05
+    per_token: float = 0.0
+    words: int = 40
+    occupancy: _Occupancy = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.occupancy is None:
+            self.occupancy = _Occupancy()
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _reply(self, messages):
+        prompt = "\n".join(str(m.content) for m in messages)
+        rng = np.random.default_rng(_seed(prompt))
+        words = " ".join(f"w{n}" for n in rng.integers(0, 5000, self.words))
+        chunk_ids = re.findall(r'<chunk id="(\d+)"', prompt)
+        if chunk_ids:
+            # Batched enrichment expects a JSON array with one entry per chunk.
+            words = json.dumps([
+                {"id": int(chunk_id), "context": words, "questions": [words]} for chunk_id in chunk_ids
+            ])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=words))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.occupancy.enter()
+        try:
+            time.sleep(self.latency + self.per_token * self.words)
+            return self._reply(messages)
+        finally:
+            self.occupancy.exit()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.occupancy.enter()
+        try:
+            await asyncio.sleep(self.latency + self.per_token * self.words)
+            return self._reply(messages)
+        finally:
+            self.occupancy.exit()
+
+class FakeEmbeddings(Embeddings):
+    # Bag-of-words hashing vectors: texts sharing words get similar vectors,
+    # so retrieval behaves plausibly. Each call costs `latency` seconds plus
+    # `per_char` seconds per character, like a CPU-bound model.
+    def __init__(self, dim=768, latency=0.0, per_char=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.per_char = per_char
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            vector[_seed(word) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.latency + self.per_char * sum(len(t) for t in texts))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+class _Collection:
+    def __init__(self, store):
+        self._store = store
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        with self._store._lock:
+            for vector_id, vector, text, metadata in zip(ids, embeddings, documents, metadatas):
+                self._store._rows[vector_id] = (np.asarray(vector, dtype=np.float32), text, dict(metadata or {}))
+            self._store._matrix = None
+
+    def count(self):
+        return len(self._store._rows)
+
+def _matches(metadata, where):
+    # The subset of Chroma's `where` syntax that scope filters use.
+    if not where:
+        return True
+    if "$and" in where:
+        return all(_matches(metadata, clause) for clause in where["$and"])
+    (field, condition), = where.items()
+    value = metadata.get(field)
+    if not isinstance(condition, dict):
+        return value == condition
+    (op, operand), = condition.items()
+    if op == "$in":
+        return value in operand
+    if op == "$lte":
+        return value is not None and value <= operand
+    if op == "$eq":
+        return value == operand
+    raise ValueError(f"Unsupported operator {op}")
+
+# Brute-force in-memory replacement for the parts of langchain_chroma.Chroma
+# that MdRag uses.
+class InMemoryVectorStore:
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.RLock()
+        self._matrix = None
+        self._collection = _Collection(self)
+
+    def get(self, ids=None, limit=None, include=None, where=None):
+        with self._lock:
+            keys = list(self._rows) if ids is None else [i for i in ids if i in self._rows]
+            keys = [k for k in keys if _matches(self._rows[k][2], where)]
+            if limit:
+                keys = keys[:limit]
+            rows = [self._rows[k] for k in keys]
+        return {
+            "ids": keys,
+            "embeddings": [r[0] for r in rows],
+            "documents": [r[1] for r in rows],
+            "metadatas": [r[2] for r in rows],
+        }
+
+    def delete(self, ids=None):
+        with self._lock:
+            for vector_id in ids or []:
+                self._rows.pop(vector_id, None)
+            self._matrix = None
+
+    def reset_collection(self):
+        with self._lock:
+            self._rows.clear()
+            self._matrix = None
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None):
+        # Scores are cosine distances, lower is closer, as Chroma returns them.
+        with self._lock:
+            if self._matrix is None:
+                self._keys = list(self._rows)
+                self._matrix = (
+                    np.vstack([self._rows[key][0] for key in self._keys])
+                    if self._keys else np.zeros((0, len(embedding)), dtype=np.float32)
+                )
+            keys, matrix = self._keys, self._matrix
+            if not keys:
+                return []
+            scores = matrix @ np.asarray(embedding, dtype=np.float32)
+            if filter:
+                scores[[not _matches(self._rows[key][2], filter) for key in keys]] = -np.inf
+            top = [i for i in np.argsort(-scores)[:k] if np.isfinite(scores[i])]
+            return [
+                (Document(page_content=self._rows[keys[i]][1], metadata=self._rows[keys[i]][2], id=keys[i]),
+                 1.0 - float(scores[i]))
+                for i in top
+            ]
@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bm25_index import BM25Index
+
+# Latency of BM25 queries over a synthetic corpus whose word frequencies
+# follow Zipf's law, with and without pruning. Queries mix rare
+# words (identifiers, error codes) with common ones, which is where
+# scoring every posting of the common words used to dominate.
+#
+#   python benchmarks/lexical_search.py --chunks 100000
+
+QUERY_SHAPES = {
+    "rare": (3, 0),
+    "mixed": (1, 3),
+    "mostly-common": (1, 5),
+    "common": (0, 3),
+}
+
+def synthetic_chunks(n, words_per_chunk, vocabulary, rng):
+    # Word i is drawn with probability proportional to 1 / (i + 1).
+    weights = 1.0 / np.arange(1, vocabulary + 1)
+    draws = rng.choice(vocabulary, size=(n, words_per_chunk), p=weights / weights.sum())
+    return [" ".join(f"w{w}" for w in row) for row in draws]
+
+def make_queries(shape, count, vocabulary, rng):
+    rare, common = QUERY_SHAPES[shape]
+    queries = []
+    for _ in range(count):
+        words = list(rng.integers(vocabulary // 10, vocabulary, rare)) + list(rng.integers(0, 50, common))
+        queries.append(" ".join(f"w{w}" for w in words))
+    return queries
+
+def evaluate(index, queries, k, truth=None):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = index.search(query, k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(hits)
+    stats = {"p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95))}
+    if truth is not None:
+        # Same top-k scores, up to float32 rounding; tied chunks may differ.
+        stats["identical"] = float(np.mean([
+            len(a) == len(b) and np.allclose(sorted(s for _, s in a), sorted(s for _, s in b), rtol=1e-5, atol=1e-5)
+            for a, b in zip(results, truth)
+        ]))
+    return stats, results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark BM25 query latency with and without pruning.")
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--words", type=int, default=150, help="Words per chunk.")
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200, help="Queries per shape.")
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    index = BM25Index()
+    start = time.perf_counter()
+    for i, text in enumerate(synthetic_chunks(args.chunks, args.words, args.vocabulary, rng)):
+        index.add(str(i), text)
+    index.merge()
+    print(f"{args.chunks} chunks x {args.words} words indexed in {time.perf_counter() - start:.1f}s, k={args.k}")
+
+    results = []
+    for shape in QUERY_SHAPES:
+        queries = make_queries(shape, args.queries, args.vocabulary, rng)
+        index.prune = False
+        exhaustive, truth = evaluate(index, queries, args.k)
+        index.prune = True
+        pruned, _ = evaluate(index, queries, args.k, truth)
+        results.append(dict(queries=shape, pruning=False, **exhaustive))
+        results.append(dict(queries=shape, pruning=True, **pruned))
+
+    print(f"{'queries':<15}{'pruning':>9}{'p50 ms':>9}{'p95 ms':>9}{'identical':>11}")
+    for r in results:
+        identical = f"{r['identical']:.2f}" if "identical" in r else "-"
+        print(f"{r['queries']:<15}{'on' if r['pruning'] else 'off':>9}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{identical:>11}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"chunks": args.chunks, "k": args.k, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
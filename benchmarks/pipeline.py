@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import contextlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import generate_corpus, generate_questions
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings, InMemoryVectorStore
+from metrics import metrics
+
+# Offline, deterministic benchmark of the ingestion and query paths. The LLM,
+# the embedding model and the vector store are replaced by in-process fakes
+# with configurable latency, and the sources are a seeded synthetic markdown
+# corpus, so runs on different commits measure the pipeline itself rather
+# than a model server or the network.
+#
+#   python benchmarks/pipeline.py --files 200 --llm-latency 0.2 --output results.json
+
+@contextlib.contextmanager
+def _quiet():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def _percentiles(samples_ms):
+    if not samples_ms:
+        return {}
+    return {
+        "count": len(samples_ms),
+        "mean_ms": float(np.mean(samples_ms)),
+        "p50_ms": float(np.percentile(samples_ms, 50)),
+        "p95_ms": float(np.percentile(samples_ms, 95)),
+        "p99_ms": float(np.percentile(samples_ms, 99)),
+    }
+
+def _throughput(elapsed, files, chunks, corpus_bytes):
+    return {
+        "seconds": elapsed,
+        "files_per_s": files / elapsed if elapsed else None,
+        "chunks_per_s": chunks / elapsed if elapsed else None,
+        "mb_per_s": corpus_bytes / 1e6 / elapsed if elapsed else None,
+    }
+
+def bench_split(paths, corpus_bytes):
+    # Chunking alone: each file's registered loader, in this process.
+    from loaders import load_file
+
+    start = time.perf_counter()
+    chunks = sum(len(load_file(path)) for path in paths)
+    return dict(_throughput(time.perf_counter() - start, len(paths), chunks, corpus_bytes), chunks=chunks)
+
+def bench_process(paths, corpus_bytes, llm, max_concurrency, enrich_batch=None):
+    # Chunking plus enrichment of every file through one shared scheduler,
+    # as a sync does, but without embedding or indexing.
+    from preprocess import process_document
+    from llm_scheduler import LLMScheduler
+
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=max_concurrency)
+        results = await asyncio.gather(*(
+            process_document(p, llm=llm, scheduler=scheduler, enrich_batch=enrich_batch) for p in paths
+        ))
+        return sum(len(docs) for docs in results), scheduler.stats()
+
+    llm.occupancy.reset()
+    start = time.perf_counter()
+    chunks, scheduler_stats = asyncio.run(run())
+    result = _throughput(time.perf_counter() - start, len(paths), chunks, corpus_bytes)
+    result.update(chunks=chunks, llm=llm.occupancy.stats(max_concurrency), scheduler=scheduler_stats)
+    return result
+
+def bench_ingest(rag, paths, corpus_bytes, llm, embeddings):
+    # A full sync from an empty index: scan, hash, chunk, enrich, embed, index.
+    llm.occupancy.reset()
+    embedding_calls = embeddings.calls
+    start = time.perf_counter()
+    asyncio.run(rag._ingest_and_index_async())
+    elapsed = time.perf_counter() - start
+    chunks = len(rag.lexical_index)
+    result = _throughput(elapsed, len(paths), chunks, corpus_bytes)
+    result.update(
+        chunks=chunks,
+        llm=llm.occupancy.stats(rag.max_concurrency),
+        embedding_calls=embeddings.calls - embedding_calls
+    )
+    return result
+
+def bench_resync(rag):
+    # A sync with nothing changed, which should only stat the sources.
+    start = time.perf_counter()
+    asyncio.run(rag._ingest_and_index_async())
+    return {"seconds": time.perf_counter() - start}
+
+def bench_queries(rag, questions):
+    latencies = []
+    rag.chain
+    for question in questions:
+        start = time.perf_counter()
+        rag.query(question)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return _percentiles(latencies)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and query latency offline against fakes.")
+    parser.add_argument("--files", type=int, default=50, help="Markdown files in the synthetic corpus.")
+    parser.add_argument("--header-depth", type=int, default=3, help="Deepest header level in each file.")
+    parser.add_argument("--sections", type=int, default=4, help="Top-level sections per file.")
+    parser.add_argument("--section-words", type=int, default=200, help="Average words per section.")
+    parser.add_argument("--dirs", type=int, default=5, help="Subdirectories to spread the files over.")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per fake LLM call.")
+    parser.add_argument("--llm-words", type=int, default=40, help="Words in each fake LLM reply.")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds per fake embedding call.")
+    parser.add_argument("--embed-per-char", type=float, default=0.0, help="Extra seconds per embedded character.")
+    parser.add_argument("--dim", type=int, default=768, help="Dimensions of the fake embeddings.")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Concurrent LLM calls during ingestion.")
+    parser.add_argument("--enrich-batch", type=int, default=0, help="Chunks per batched enrichment call (0: off).")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--vector-mode", default="chroma", help="Dense search: chroma (the fake store) or int8/binary.")
+    parser.add_argument("--stages", default="split,process,ingest,resync,query")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    args = parser.parse_args(argv)
+    stages = set(args.stages.split(","))
+
+    with tempfile.TemporaryDirectory(prefix="mdrag-bench-") as workdir:
+        # Keep every cache inside the scratch directory, and never let the
+        # answer cache serve a query, so each run starts cold.
+        os.environ.update({
+            "EMBEDDING_CACHE_PATH": os.path.join(workdir, "cache", "embeddings"),
+            "ENRICHMENT_CACHE_PATH": os.path.join(workdir, "cache", "enrichment.sqlite"),
+            "ANSWER_CACHE_PATH": os.path.join(workdir, "cache", "answers.sqlite"),
+            "ANSWER_CACHE_THRESHOLD": "2",
+            "EMBED_WORKERS": "0",
+            "ENRICH_BATCH_SIZE": str(args.enrich_batch),
+        })
+        source_dir = os.path.join(workdir, "sources")
+        os.makedirs(source_dir)
+        llm = FakeChatModel(latency=args.llm_latency, words=args.llm_words)
+        embeddings = FakeEmbeddings(dim=args.dim, latency=args.embed_latency, per_char=args.embed_per_char)
+
+        rag = None
+        if stages & {"ingest", "resync", "query"}:
+            from rag_engine import MdRag
+            # Construction syncs; doing it before the corpus exists keeps
+            # that sync empty, so the ingest stage below starts cold.
+            with _quiet():
+                rag = MdRag(
+                    source_dir=source_dir,
+                    persist_dir=os.path.join(workdir, "index"),
+                    max_concurrency=args.max_concurrency,
+                    extra_source_dirs=[],
+                    vector_mode=args.vector_mode,
+                    llm=llm,
+                    embeddings=embeddings,
+                    vectorstore=InMemoryVectorStore()
+                )
+
+        paths, vocabulary = generate_corpus(
+            source_dir, files=args.files, header_depth=args.header_depth, sections=args.sections,
+            section_words=args.section_words, dirs=args.dirs, seed=args.seed
+        )
+        corpus_bytes = sum(os.path.getsize(p) for p in paths)
+        print(f"Corpus: {len(paths)} files, {corpus_bytes / 1e6:.1f} MB")
+        results = {"config": vars(args), "corpus": {"files": len(paths), "bytes": corpus_bytes}}
+
+        # The pipeline's progress output would drown the report.
+        if "split" in stages:
+            with _quiet():
+                results["split"] = bench_split(paths, corpus_bytes)
+            print(f"split:   {results['split']['seconds']:.2f}s, {results['split']['chunks']} chunks")
+        if "process" in stages:
+            with _quiet():
+                results["process"] = bench_process(paths, corpus_bytes, llm, args.max_concurrency, args.enrich_batch)
+            print(
+                f"process: {results['process']['seconds']:.2f}s, "
+                f"LLM utilization {results['process']['llm'].get('utilization', 0):.0%}"
+            )
+
+        if rag is not None:
+            # Resync and queries need an index, so ingestion always runs.
+            with _quiet():
+                results["ingest"] = bench_ingest(rag, paths, corpus_bytes, llm, embeddings)
+            print(
+                f"ingest:  {results['ingest']['seconds']:.2f}s, {results['ingest']['chunks']} chunks, "
+                f"LLM utilization {results['ingest']['llm'].get('utilization', 0):.0%}"
+            )
+            if "resync" in stages:
+                with _quiet():
+                    results["resync"] = bench_resync(rag)
+                print(f"resync:  {results['resync']['seconds']:.2f}s")
+            if "query" in stages:
+                with _quiet():
+                    results["query"] = bench_queries(rag, generate_questions(args.queries, vocabulary, args.seed))
+                q = results["query"]
+                print(f"query:   p50 {q['p50_ms']:.1f} ms, p95 {q['p95_ms']:.1f} ms, p99 {q['p99_ms']:.1f} ms")
+
+    # Per-stage spans and counters recorded across all stages above.
+    results["metrics"] = metrics.snapshot()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
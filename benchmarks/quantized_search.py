@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quantized_index import QuantizedIndex, MODES
+
+# Recall-versus-latency comparison of the dense search options: exact
+# full-precision search (the ground truth), Chroma's HNSW index and the
+# quantized first pass + float rescoring of QuantizedIndex for every
+# combination of mode, truncated dimensions and rescore factor.
+#
+#   python benchmarks/quantized_search.py --persist-dir ./chroma_db --questions questions.txt
+#   python benchmarks/quantized_search.py --synthetic 100000
+
+def load_chroma_vectors(persist_dir):
+    from langchain_chroma import Chroma
+    collection = Chroma(persist_directory=persist_dir)._collection
+    data = collection.get(include=["embeddings"])
+    return collection, data["ids"], np.asarray(data["embeddings"], dtype=np.float32)
+
+def synthetic_vectors(n, dim, rng):
+    # Variance decays along the dimensions, as it does for Matryoshka
+    # embeddings, so truncation behaves roughly like on real vectors.
+    decay = (1 + np.arange(dim)) ** -0.5
+    return (rng.standard_normal((n, dim)) * decay).astype(np.float32)
+
+def make_queries(args, vectors, rng):
+    if args.questions:
+        from embedding_workers import create_embeddings
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        embeddings = create_embeddings()
+        return np.asarray([embeddings.embed_query(q) for q in questions], dtype=np.float32)
+    # Without real questions, perturb stored vectors so the nearest
+    # neighbour is not trivially the vector itself.
+    picks = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    noise = rng.standard_normal(picks.shape).astype(np.float32) * picks.std(axis=0)
+    return picks + args.noise * noise
+
+def _normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+def evaluate(search, queries, truth, k):
+    recalls, latencies = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(expected & set(found[:k])) / k)
+    return {
+        "recall": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark quantized dense search against exact and Chroma search.")
+    parser.add_argument("--persist-dir", help="Read vectors from this Chroma directory.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of Chroma.")
+    parser.add_argument("--dim", type=int, default=768, help="Dimensions of synthetic vectors.")
+    parser.add_argument("--questions", help="File with one question per line to embed as queries.")
+    parser.add_argument("--queries", type=int, default=200, help="Perturbed stored vectors to use as queries.")
+    parser.add_argument("--noise", type=float, default=0.3)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dims", default="128,256,512")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--rescore", default="4,10")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    collection = None
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, args.dim, rng)
+        ids = [str(i) for i in range(len(vectors))]
+    elif args.persist_dir:
+        collection, ids, vectors = load_chroma_vectors(args.persist_dir)
+    else:
+        parser.error("Pass --persist-dir or --synthetic.")
+    if not len(ids):
+        parser.error("No vectors to benchmark.")
+
+    queries = make_queries(args, vectors, rng)
+    k = args.k
+    print(f"{len(ids)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, k={k}")
+
+    normalized = _normalize(vectors)
+    truth = [{ids[i] for i in np.argsort(-(normalized @ q))[:k]} for q in _normalize(queries)]
+
+    results = []
+    exact = evaluate(lambda q: [ids[i] for i in np.argsort(-(normalized @ _normalize(q)))[:k]], queries, truth, k)
+    results.append(dict(store="exact", dims=vectors.shape[1], rescore=None, index_bytes=normalized.nbytes, **exact))
+
+    if collection is not None:
+        chroma = evaluate(
+            lambda q: collection.query(query_embeddings=[q.tolist()], n_results=k)["ids"][0], queries, truth, k
+        )
+        results.append(dict(store="chroma", dims=vectors.shape[1], rescore=None, index_bytes=normalized.nbytes, **chroma))
+
+    for mode in args.modes.split(","):
+        for dims in (int(d) for d in args.dims.split(",")):
+            index = QuantizedIndex(dims=dims, mode=mode)
+            index.add(ids, vectors)
+            index.merge()
+            for rescore in (int(r) for r in args.rescore.split(",")):
+                index.rescore = rescore
+                stats = evaluate(lambda q: [vector_id for vector_id, _ in index.search(q, k)], queries, truth, k)
+                results.append(dict(store=mode, dims=dims, rescore=rescore, index_bytes=index.nbytes(), **stats))
+
+    print(f"{'store':<8}{'dims':>6}{'rescore':>9}{'recall':>8}{'p50 ms':>9}{'p95 ms':>9}{'MB':>9}")
+    for r in results:
+        print(
+            f"{r['store']:<8}{r['dims']:>6}{r['rescore'] or '-':>9}{r['recall']:>8.3f}"
+            f"{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['index_bytes'] / 1e6:>9.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"vectors": len(ids), "queries": len(queries), "k": k, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
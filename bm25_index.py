@@ -0,0 +1,504 @@
+import os
+import re
+import json
+import math
+import threading
+import functools
+from array import array
+from collections import Counter
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+(?:[.\-/:][a-z0-9_]+)*")
+SUB_TOKEN_PATTERN = re.compile(r"[.\-/:_]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it its of on or that the this to was what when "
+    "where which who why will with you your".split()
+)
+# Queries with fewer postings left than this are scored in full.
+PRUNE_MIN_POSTINGS = 4096
+# Terms in at least this share of the documents (and in PRUNE_MIN_POSTINGS
+# or more) are "common": they also get a dense term-frequency column and
+# their postings in impact order, up to the largest IMPACT_STEPS prefix.
+COMMON_DF_FRACTION = 1 / 8
+IMPACT_STEPS = (256, 512, 1024, 2048, 4096, 8192, 16384)
+# ...and their largest term frequency per block of this many documents.
+BLOCK_SIZE = 64
+
+def tokenize(text):
+    # Identifiers such as ERR_CONN_RESET, --max-tokens or server.port are kept
+    # whole and also indexed by their parts, so both spellings match.
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        parts = SUB_TOKEN_PATTERN.split(token)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p and p not in STOPWORDS)
+    return tokens
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+# Okapi BM25 over compact CSR postings. The merged segment stores each term's
+# postings as a slice of two flat numpy arrays (doc index, term frequency),
+# so a query is a handful of vectorised gathers. Recent additions live in a
+# small in-memory delta segment and deletions are tombstones; both are
+# folded into the arrays by merge(), which save() always runs first.
+# Common terms are indexed a second way at every merge and load (see
+# _score_common), so queries never have to read their full posting lists.
+class BM25Index:
+    def __init__(self, path=None, k1=1.2, b=0.75, merge_threshold=5000, prune=True):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.merge_threshold = merge_threshold
+        # Skip postings that cannot change the top k (see _score_main).
+        self.prune = prune
+        # Queries may run while a background sync is updating the index.
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.vocab = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.post_docs = np.zeros(0, dtype=np.int32)
+        self.post_tf = np.zeros(0, dtype=np.float32)
+        self.doc_len = np.zeros(0, dtype=np.float32)
+        self.doc_ids = []
+        self.alive = np.zeros(0, dtype=bool)
+        # term id -> (tf column, impact-ordered docs, remainder tf, remainder
+        # min length, max tf per block), for the common terms of the merged
+        # segment, and the min document length per block.
+        self.common = {}
+        self.block_len = np.zeros(0, dtype=np.float32)
+
+        self.delta_ids = []
+        self.delta_len = []
+        self.delta_alive = []
+        self.delta_postings = {}
+        self.delta_triples = (array("i"), array("i"), array("f"))
+
+        self.locations = {}
+        self.total_len = 0.0
+        self.dirty = False
+
+    @classmethod
+    def load(cls, persist_dir, **kwargs):
+        index = cls(os.path.join(persist_dir, "bm25"), **kwargs)
+        arrays_file = index.path + ".npz"
+        meta_file = index.path + ".json"
+        if not (os.path.exists(arrays_file) and os.path.exists(meta_file)):
+            return index
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+            arrays = np.load(arrays_file)
+            index.vocab = {term: i for i, term in enumerate(meta["terms"])}
+            index.doc_ids = meta["doc_ids"]
+            index.offsets = arrays["offsets"]
+            index.post_docs = arrays["post_docs"]
+            index.post_tf = arrays["post_tf"]
+            index.doc_len = arrays["doc_len"]
+        except Exception as e:
+            print(f"Could not load lexical index ({e}). Rebuilding.")
+            return cls(index.path, **kwargs)
+
+        index.alive = np.ones(len(index.doc_ids), dtype=bool)
+        index.locations = {chunk_id: ("main", i) for i, chunk_id in enumerate(index.doc_ids)}
+        index.total_len = float(index.doc_len.sum())
+        index._index_common_terms()
+        return index
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self.locations
+
+    @_locked
+    def chunk_ids(self):
+        return set(self.locations)
+
+    @_locked
+    def add(self, chunk_id, text):
+        if chunk_id in self.locations:
+            self.remove(chunk_id)
+
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        local = len(self.delta_ids)
+        self.delta_ids.append(chunk_id)
+        self.delta_len.append(length)
+        self.delta_alive.append(True)
+        delta_terms, delta_docs, delta_tfs = self.delta_triples
+        for term, tf in terms.items():
+            self.delta_postings.setdefault(term, []).append((local, tf))
+            delta_terms.append(self.vocab.setdefault(term, len(self.vocab)))
+            delta_docs.append(local)
+            delta_tfs.append(tf)
+
+        self.locations[chunk_id] = ("delta", local)
+        self.total_len += length
+        self.dirty = True
+
+        # Merge geometrically so a bulk load costs O(log n) rebuilds.
+        if len(self.delta_ids) >= max(self.merge_threshold, len(self.doc_ids) // 4):
+            self.merge()
+
+    @_locked
+    def remove(self, chunk_id):
+        location = self.locations.pop(chunk_id, None)
+        if location is None:
+            return
+        segment, i = location
+        if segment == "main":
+            self.alive[i] = False
+            self.total_len -= float(self.doc_len[i])
+        else:
+            self.delta_alive[i] = False
+            self.total_len -= self.delta_len[i]
+        self.dirty = True
+
+    @_locked
+    def clear(self):
+        self._reset()
+        self.dirty = True
+
+    @_locked
+    def merge(self):
+        if not self.delta_ids and self.alive.all():
+            return
+
+        # Explode the merged segment back into (term, doc, tf) triples, drop
+        # tombstoned docs, append the delta and rebuild the CSR arrays.
+        term_of_posting = np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int32), np.diff(self.offsets))
+        keep = self.alive[self.post_docs] if len(self.post_docs) else np.zeros(0, dtype=bool)
+        new_index = np.cumsum(self.alive) - 1
+
+        terms = [term_of_posting[keep]]
+        docs = [new_index[self.post_docs[keep]].astype(np.int32)]
+        tfs = [self.post_tf[keep]]
+
+        doc_ids = [d for d, a in zip(self.doc_ids, self.alive) if a]
+        doc_len = [self.doc_len[self.alive]]
+
+        delta_alive = np.array(self.delta_alive, dtype=bool)
+        delta_new_index = len(doc_ids) + np.cumsum(delta_alive) - 1
+        doc_ids.extend(chunk_id for chunk_id, alive in zip(self.delta_ids, self.delta_alive) if alive)
+        doc_len.append(np.array(self.delta_len, dtype=np.float32)[delta_alive])
+
+        delta_terms, delta_docs, delta_tfs = (np.frombuffer(a, dtype=a.typecode) for a in self.delta_triples)
+        delta_docs = delta_docs.astype(np.int64)
+        delta_keep = delta_alive[delta_docs] if len(delta_docs) else np.zeros(0, dtype=bool)
+        terms.append(delta_terms[delta_keep].astype(np.int32))
+        docs.append(delta_new_index[delta_docs[delta_keep]].astype(np.int32))
+        tfs.append(delta_tfs[delta_keep].astype(np.float32))
+
+        terms = np.concatenate(terms)
+        order = np.argsort(terms, kind="stable")
+        self.post_docs = np.concatenate(docs)[order]
+        self.post_tf = np.concatenate(tfs)[order]
+        counts = np.bincount(terms, minlength=len(self.vocab))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        self.doc_ids = doc_ids
+        self.doc_len = np.concatenate(doc_len).astype(np.float32)
+        self.alive = np.ones(len(doc_ids), dtype=bool)
+        self.locations = {chunk_id: ("main", i) for i, chunk_id in enumerate(doc_ids)}
+
+        self.delta_ids = []
+        self.delta_len = []
+        self.delta_alive = []
+        self.delta_postings = {}
+        self.delta_triples = (array("i"), array("i"), array("f"))
+        self._index_common_terms()
+
+    def _index_common_terms(self):
+        # For each common term: its term frequencies as a dense column over
+        # the merged documents, so looking a document up is a gather, and
+        # its postings ordered by decreasing contribution (tf descending,
+        # then length ascending) up to the largest impact step. For every
+        # step, the largest tf and the smallest length after that prefix
+        # bound what the rest of the list can add.
+        self.common = {}
+        n = len(self.doc_ids)
+        blocks = np.arange(0, n, BLOCK_SIZE)
+        self.block_len = np.minimum.reduceat(self.doc_len, blocks) if n else np.zeros(0, dtype=np.float32)
+        df = np.diff(self.offsets)
+        for term_id in np.flatnonzero(df >= max(n * COMMON_DF_FRACTION, PRUNE_MIN_POSTINGS)):
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs, tf = self.post_docs[start:end], self.post_tf[start:end]
+            if tf.max() > np.iinfo(np.uint16).max:
+                continue
+            column = np.zeros(n, dtype=np.uint16)
+            column[docs] = tf
+            lengths = self.doc_len[docs]
+            order = np.lexsort((lengths, -tf))
+            rest_tf = np.zeros(len(IMPACT_STEPS), dtype=np.float32)
+            rest_len = np.zeros(len(IMPACT_STEPS), dtype=np.float32)
+            for i, step in enumerate(IMPACT_STEPS):
+                if step < len(order):
+                    rest_tf[i] = tf[order[step]]
+                    rest_len[i] = lengths[order[step:]].min()
+            block_tf = np.maximum.reduceat(column, blocks).astype(np.float32)
+            self.common[int(term_id)] = (column, docs[order[:IMPACT_STEPS[-1]]], rest_tf, rest_len, block_tf)
+
+    @_locked
+    def save(self):
+        if not self.dirty or not self.path:
+            return
+        self.merge()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_arrays = self.path + ".tmp.npz"
+        np.savez(
+            tmp_arrays,
+            offsets=self.offsets,
+            post_docs=self.post_docs,
+            post_tf=self.post_tf,
+            doc_len=self.doc_len
+        )
+        terms = [None] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            terms[term_id] = term
+        tmp_meta = self.path + ".tmp.json"
+        with open(tmp_meta, "w") as f:
+            json.dump({"terms": terms, "doc_ids": self.doc_ids}, f)
+        os.replace(tmp_arrays, self.path + ".npz")
+        os.replace(tmp_meta, self.path + ".json")
+        self.dirty = False
+
+    @_locked
+    def search(self, query, k=20, allowed=None):
+        # `allowed`, a set of chunk ids, restricts the results to them before
+        # the top k are taken. Collection statistics stay corpus-wide.
+        n_docs = len(self.locations)
+        if not n_docs:
+            return []
+        avgdl = max(self.total_len / n_docs, 1.0)
+        k1, b = self.k1, self.b
+
+        terms = []
+        delta_scores = {}
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            start = end = 0
+            if term_id is not None and term_id < len(self.offsets) - 1:
+                start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            delta_postings = self.delta_postings.get(term, ())
+            df = (end - start) + len(delta_postings)
+            if not df:
+                continue
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            if end > start:
+                terms.append((idf, start, end, term_id))
+
+            for local, tf in delta_postings:
+                norm = k1 * (1 - b + b * self.delta_len[local] / avgdl)
+                delta_scores[local] = delta_scores.get(local, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+        allowed_main = None
+        if allowed is not None:
+            allowed_main = np.zeros(len(self.doc_ids), dtype=bool)
+            for chunk_id in allowed:
+                location = self.locations.get(chunk_id)
+                if location is not None and location[0] == "main":
+                    allowed_main[location[1]] = True
+
+        results = []
+        if terms:
+            docs, scores = self._score_main(terms, k, avgdl, allowed_main)
+            top = min(k, len(docs))
+            if top:
+                candidates = np.argpartition(-scores, top - 1)[:top]
+                results.extend((self.doc_ids[docs[i]], float(scores[i])) for i in candidates)
+        results.extend(
+            (self.delta_ids[local], score) for local, score in delta_scores.items()
+            if self.delta_alive[local] and (allowed is None or self.delta_ids[local] in allowed)
+        )
+        results.sort(key=lambda r: r[1], reverse=True)
+        return results[:k]
+
+    def _saturation(self, tf, lengths, avgdl):
+        return tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * lengths / avgdl))
+
+    def _contrib(self, idf, tf, docs, avgdl):
+        return idf * self._saturation(tf, self.doc_len[docs], avgdl)
+
+    def _score_main(self, terms, k, avgdl, allowed_main):
+        if self.prune and any(term_id in self.common for *_, term_id in terms):
+            return self._score_common(terms, k, avgdl, allowed_main)
+        return self._max_score([term[:3] for term in terms], k, avgdl, allowed_main)
+
+    def _score_common(self, terms, k, avgdl, allowed_main):
+        # Threshold algorithm over the common terms' impact order. The other
+        # terms are scored in full, and every document they match is a
+        # candidate, as are the first `step` documents of each common term's
+        # impact order. Candidates are scored exactly, common terms through
+        # their columns. Any other document matches only common terms, each
+        # adding at most what its remainder bound allows; once the k-th
+        # candidate score beats the sum of those bounds, the top k is final.
+        # Otherwise the next, larger step is tried. Past the last one, the
+        # documents left are scored only in blocks whose per-block bound
+        # reaches the k-th score. Results are the same as full scoring.
+        n = len(self.doc_ids)
+        k1, b = self.k1, self.b
+        base = None
+        matched = []
+        common = []
+        for idf, start, end, term_id in terms:
+            if term_id in self.common:
+                common.append((idf, *self.common[term_id]))
+                continue
+            docs = self.post_docs[start:end]
+            if base is None:
+                base = np.zeros(n, dtype=np.float32)
+            base[docs] += self._contrib(idf, self.post_tf[start:end], docs, avgdl)
+            matched.append(docs)
+
+        # Each step scores only the documents no earlier step reached, and
+        # only the best k so far are kept. Tombstoned and disallowed
+        # documents start out as already reached.
+        skip = ~self.alive if allowed_main is None else ~(self.alive & allowed_main)
+        docs = np.zeros(0, dtype=np.int32)
+        scores = np.zeros(0, dtype=np.float32)
+        previous = 0
+        for i, step in enumerate(IMPACT_STEPS + (None,)):
+            if step is not None:
+                # A few thousand documents: sorting them is cheaper than a
+                # pass over a mask of every document.
+                new = np.sort(np.concatenate(matched + [impact[previous:step] for _, _, impact, *_ in common]))
+                new = new[np.concatenate(([True], new[1:] != new[:-1]))]
+                new = new[~skip[new]]
+                skip[new] = True
+                matched, previous = [], step
+            elif len(docs) < k:
+                mask = np.zeros(n, dtype=bool)
+                for _, column, *_ in common:
+                    mask |= column > 0
+                new = np.flatnonzero(mask & ~skip)
+            else:
+                bound = sum(
+                    max(idf, 0.0) * self._saturation(block_tf, self.block_len, avgdl)
+                    for idf, *_, block_tf in common
+                )
+                blocks = np.flatnonzero(bound > scores.min())
+                new = (blocks[:, None] * BLOCK_SIZE + np.arange(BLOCK_SIZE)).ravel()
+                new = new[new < n]
+                new = new[~skip[new]]
+            new_scores = base[new] if base is not None else np.zeros(len(new), dtype=np.float32)
+            norm = k1 * (1 - b + b * self.doc_len[new] / avgdl)
+            hit = np.zeros(len(new), dtype=bool) if step is None else None
+            for idf, column, *_ in common:
+                tf = column[new].astype(np.float32)
+                new_scores += idf * tf * (k1 + 1) / (tf + norm)
+                if hit is not None:
+                    hit |= tf > 0
+            if hit is not None:
+                new, new_scores = new[hit], new_scores[hit]
+            docs = np.concatenate((docs, new))
+            scores = np.concatenate((scores, new_scores))
+            if len(docs) > k:
+                best = np.argpartition(-scores, k - 1)[:k]
+                docs, scores = docs[best], scores[best]
+            if step is None or len(docs) < k:
+                continue
+            bound = sum(
+                max(idf, 0.0) * float(self._saturation(rest_tf[i], rest_len[i], avgdl) if rest_tf[i] else 0.0)
+                for idf, _, _, rest_tf, rest_len, _ in common
+            )
+            if scores.min() > bound:
+                break
+        return docs, scores
+
+    def _max_score(self, terms, k, avgdl, allowed_main):
+        # MaxScore: terms are scored rarest first. A term adds at most
+        # idf * (k1 + 1) to any document, so once the k-th best score so far
+        # beats that bound summed over the terms left, no document outside
+        # the current candidates can reach the top k. The remaining (common,
+        # long) postings are then only probed for the candidates, by binary
+        # search: postings are sorted by document within each term. Results
+        # are the same as scoring every posting. A term whose idf is negative
+        # (tombstoned postings still count towards df) can only lower
+        # scores, so the k-th score is discounted by it instead.
+        terms.sort(key=lambda t: t[0], reverse=True)
+        bounds = np.cumsum([max(idf, 0.0) * (self.k1 + 1) for idf, _, _ in terms][::-1])[::-1]
+        floors = np.cumsum([min(idf, 0.0) * (self.k1 + 1) for idf, _, _ in terms][::-1])[::-1]
+        postings_left = np.cumsum([end - start for _, start, end in terms][::-1])[::-1]
+
+        doc_arrays, score_arrays = [], []
+        scored = 0
+        rest = []
+        for i, (idf, start, end) in enumerate(terms):
+            # Taking the k-th score costs about as much as the postings read
+            # so far; only try it when it can save well over that, and when
+            # the terms read so far are worth more than the terms left.
+            if (doc_arrays and self.prune and postings_left[i] > max(2 * scored, PRUNE_MIN_POSTINGS)
+                    and bounds[0] - bounds[i] > bounds[i]):
+                docs, scores = self._accumulate(doc_arrays, score_arrays)
+                doc_arrays, score_arrays = [docs], [scores]
+                eligible = self._eligible(docs, allowed_main)
+                if eligible.sum() >= k:
+                    threshold = np.partition(scores[eligible], -k)[-k] + floors[i]
+                    if threshold > bounds[i]:
+                        rest = terms[i:]
+                        break
+            docs = self.post_docs[start:end]
+            tf = self.post_tf[start:end]
+            doc_arrays.append(docs)
+            score_arrays.append(self._contrib(idf, tf, docs, avgdl))
+            scored += end - start
+
+        docs, scores = self._accumulate(doc_arrays, score_arrays)
+        keep = self._eligible(docs, allowed_main)
+        docs, scores = docs[keep], scores[keep].astype(np.float32)
+        first = len(terms) - len(rest)
+        for j, (idf, start, end) in enumerate(rest):
+            # Drop candidates that can no longer reach the k-th score.
+            keep = scores + bounds[first + j] >= threshold
+            docs, scores = docs[keep], scores[keep]
+            postings = self.post_docs[start:end]
+            if len(docs) * 16 < len(postings):
+                positions = np.minimum(np.searchsorted(postings, docs), len(postings) - 1)
+                hit = postings[positions] == docs
+                tf = self.post_tf[start:end][positions[hit]]
+                scores[hit] += self._contrib(idf, tf, docs[hit], avgdl)
+            else:
+                dense = np.zeros(len(self.doc_ids), dtype=np.float32)
+                dense[postings] = self._contrib(idf, self.post_tf[start:end], postings, avgdl)
+                scores += dense[docs]
+        return docs, scores
+
+    def _eligible(self, docs, allowed_main):
+        return self.alive[docs] if allowed_main is None else self.alive[docs] & allowed_main[docs]
+
+    def _accumulate(self, doc_arrays, score_arrays):
+        docs = np.concatenate(doc_arrays)
+        contrib = np.concatenate(score_arrays)
+        if len(doc_arrays) == 1:
+            return docs, contrib
+        # Sum per-term contributions sparsely unless the matches cover a
+        # large share of the corpus, where a dense accumulator is cheaper.
+        if len(docs) * 8 < len(self.doc_ids):
+            unique_docs, inverse = np.unique(docs, return_inverse=True)
+            return unique_docs, np.bincount(inverse, weights=contrib).astype(np.float32)
+        dense = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for doc_array, score_array in zip(doc_arrays, score_arrays):
+            np.add.at(dense, doc_array, score_array)
+        matched = np.flatnonzero(dense)
+        return matched, dense[matched]
+
+def reciprocal_rank_fusion(rankings, k=60, with_scores=False):
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    fused = sorted(scores, key=scores.get, reverse=True)
+    if with_scores:
+        return [(chunk_id, scores[chunk_id]) for chunk_id in fused]
+    return fused
@@ -0,0 +1,77 @@
+import re
+
+from llm_scheduler import estimate_tokens
+from md_chunker import HEADERS
+
+# Chunks indexed before parts were stored in metadata only carry this marker.
+_PART_RE = re.compile(r"\[Section split: Part (\d+) of \d+\]")
+
+# Overlaps shorter than this are treated as coincidence, not splitter overlap.
+MIN_OVERLAP = 20
+MAX_OVERLAP = 400
+
+# A truncated passage shorter than this is not worth its breadcrumb.
+MIN_PARTIAL_TOKENS = 50
+
+def _part(doc):
+    part = doc.metadata.get("part")
+    if part is None:
+        match = _PART_RE.search(doc.page_content.split("---CONTENT---", 1)[0])
+        part = int(match.group(1)) if match else None
+    return part
+
+def _breadcrumb(doc):
+    parts = [doc.metadata.get("source") or "Unknown source"]
+    parts.extend(doc.metadata[h] for h in HEADERS if h in doc.metadata)
+    return " / ".join(parts)
+
+def merge_overlap(first, second):
+    # Joins two consecutive parts of a section, dropping the text the
+    # splitter repeated at the start of the second one.
+    limit = min(len(first), len(second), MAX_OVERLAP)
+    for size in range(limit, MIN_OVERLAP - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first}\n{second}"
+
+# Turns retrieved chunks into the prompt context. Chunks are grouped by
+# section in rank order, consecutive parts of a section are stitched back
+# together without their overlap, and each group is sent as its clean
+# original text under a one-line breadcrumb. Groups are added until
+# `max_tokens` is reached; the first group that does not fit is truncated.
+def build_context(docs, max_tokens=3000):
+    sections = {}
+    seen = set()
+    for doc in docs:
+        text = doc.metadata.get("original_content", doc.page_content).strip()
+        if not text or text in seen:
+            continue
+        seen.add(text)
+        key = _breadcrumb(doc)
+        sections.setdefault(key, []).append((_part(doc), text))
+
+    blocks = []
+    for breadcrumb, parts in sections.items():
+        parts.sort(key=lambda p: p[0] or 0)
+        pieces = []
+        previous = None
+        for part, text in parts:
+            if pieces and part is not None and previous is not None and part == previous + 1:
+                pieces[-1] = merge_overlap(pieces[-1], text)
+            else:
+                pieces.append(text)
+            previous = part
+        blocks.append(f"[{breadcrumb}]\n" + "\n[...]\n".join(pieces))
+
+    context = []
+    used = 0
+    for block in blocks:
+        tokens = estimate_tokens(block)
+        if used + tokens > max_tokens:
+            remaining = max_tokens - used
+            if remaining >= MIN_PARTIAL_TOKENS or not context:
+                context.append(block[:remaining * 4].rstrip() + " [...]")
+            break
+        context.append(block)
+        used += tokens
+    return "\n\n".join(context)
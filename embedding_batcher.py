@@ -0,0 +1,59 @@
+import asyncio
+
+# Coalesces concurrent embed requests into one embed_documents call. The
+# first request in a batch waits at most `max_wait_ms` for others to arrive,
+# so a lone request pays a few milliseconds while a burst shares one forward
+# pass of the embedding model.
+class EmbeddingBatcher:
+    def __init__(self, embeddings, max_batch=32, max_wait_ms=5):
+        self.embeddings = embeddings
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.requests = 0
+        self._queue = None
+        self._worker = None
+
+    async def embed(self, text):
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.batches += 1
+            self.requests += len(batch)
+            try:
+                vectors = await asyncio.to_thread(self.embeddings.embed_documents, [text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
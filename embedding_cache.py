@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import hashlib
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:
+    # Without flock (Windows), only appends within one process are safe.
+    fcntl = None
+
+from metrics import metrics
+
+EMBEDDING_MODEL = "nomic-ai/nomic-embed-text-v1.5"
+
+def embedding_key(namespace, text):
+    return hashlib.sha256(f"{namespace}\x1f{text}".encode("utf-8")).hexdigest()
+
+def cache_namespace(embeddings):
+    # Keys are prefixed with the class and model name of the embeddings that
+    # produced them, so a different model never gets another model's
+    # vectors. The default model keeps the bare name its entries were
+    # first stored under.
+    name = type(embeddings).__name__
+    model = getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None)
+    if name == "HuggingFaceEmbeddings" and model == EMBEDDING_MODEL:
+        return EMBEDDING_MODEL
+    return f"{name}:{model}" if model else name
+
+# Content-addressed store of document embeddings. Vectors are appended to
+# one flat float32 file that is read through a memory map; a small SQLite
+# table maps each key (namespace + text hash) to its row. Vectors are written
+# before their rows are committed, so a crash can only leave unused rows
+# at the end of the file, never a key pointing at a missing vector. The app,
+# the server, evaluate.py and the watcher may share one cache directory, so
+# appends hold an exclusive lock on the vectors file and take their row
+# numbers from its size, not from a count kept in this process.
+class EmbeddingCache:
+    def __init__(self, path="cache/embeddings"):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self._conn = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        self.dim = int(row[0]) if row else None
+        self._rows = 0
+        self._map = None
+        self._refresh_rows()
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _refresh_rows(self):
+        # Rows other processes appended since the last look. A torn
+        # trailing row is left alone here; the next append drops it.
+        if self.dim and os.path.exists(self.vectors_path):
+            self._rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+
+    def _vectors(self):
+        if self._map is None or len(self._map) < self._rows:
+            self._map = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self._rows, self.dim))
+        return self._map
+
+    def get_many(self, keys):
+        # Returns {key: vector} for the keys that are cached.
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                found.update(self._conn.execute(
+                    f"SELECT key, row FROM embeddings WHERE key IN ({placeholders})", batch
+                ))
+            if found and max(found.values()) >= self._rows:
+                if self.dim is None:
+                    row = self._conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+                    self.dim = int(row[0]) if row else None
+                self._refresh_rows()
+            # A row past the end of the file is treated as a miss.
+            found = {key: row for key, row in found.items() if row < self._rows}
+            vectors = self._vectors() if found else None
+            result = {key: np.array(vectors[row]) for key, row in found.items()}
+            self.hits += len(result)
+            self.misses += len(keys) - len(result)
+        metrics.incr("cache_lookups", len(result), cache="embedding", result="hit")
+        metrics.incr("cache_lookups", len(keys) - len(result), cache="embedding", result="miss")
+        return result
+
+    def put_many(self, keys, vectors):
+        if not keys:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, open(self.vectors_path, "ab") as f:
+            if fcntl is not None:
+                # Released when the file is closed.
+                fcntl.flock(f, fcntl.LOCK_EX)
+            row = self._conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+            self.dim = int(row[0]) if row else None
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dim', ?)", (str(self.dim),))
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding cache holds {self.dim}-d vectors, got {vectors.shape[1]}-d.")
+            row_bytes = self.dim * 4
+            size = os.fstat(f.fileno()).st_size
+            if size % row_bytes:
+                # Drop a torn trailing row so appends stay aligned.
+                f.truncate(size - size % row_bytes)
+            first = size // row_bytes
+            f.write(vectors.tobytes())
+            f.flush()
+            self._rows = first + len(keys)
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, row) VALUES (?, ?)",
+                [(key, first + i) for i, key in enumerate(keys)]
+            )
+            self._conn.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+    def close(self):
+        with self._lock:
+            self._map = None
+            self._conn.close()
+
+# Serves embed_documents from the cache and embeds only texts it has not
+# seen, each distinct text once per call. Queries are passed through.
+# `namespace` defaults to cache_namespace(embeddings).
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings, cache, namespace=None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.namespace = namespace or cache_namespace(embeddings)
+
+    def embed_documents(self, texts):
+        keys = [embedding_key(self.namespace, text) for text in texts]
+        cached = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self.cache.put_many(list(missing), vectors)
+            cached.update(zip(missing, (np.asarray(v, dtype=np.float32) for v in vectors)))
+        return [cached[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,79 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import EMBEDDING_MODEL
+
+def create_embeddings():
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL,
+        model_kwargs={
+            'device': 'cpu',
+            'trust_remote_code': True
+        }
+    )
+
+_worker_embeddings = None
+
+def _init_worker(threads):
+    global _worker_embeddings
+    import torch
+    torch.set_num_threads(threads)
+    _worker_embeddings = create_embeddings()
+
+def _embed_shard(texts):
+    return _worker_embeddings.embed_documents(texts)
+
+# Spreads embed_documents over worker processes, each with its own copy of
+# the model and a fixed torch thread count so the workers do not
+# oversubscribe the cores. Texts are sorted by length and cut into shards
+# of `shard_size`, so every shard batches texts of similar length and
+# wastes little padding; the longest shards are submitted first to keep
+# the workers evenly loaded. Small calls, which would not amortize the
+# inter-process round trip, are embedded by `local` in this process.
+# Workers start on first use and stop on close(), so the model copies only
+# live for the duration of a sync.
+class EmbeddingPool(Embeddings):
+    def __init__(self, local, workers=2, threads_per_worker=None, shard_size=32):
+        self.local = local
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        self.shard_size = shard_size
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            print(f"Starting {self.workers} embedding workers ({self.threads_per_worker} threads each)...")
+            # Forking a process that already loaded torch is unsafe.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.threads_per_worker,)
+            )
+        return self._executor
+
+    def embed_documents(self, texts):
+        if len(texts) < 2 * self.shard_size:
+            return self.local().embed_documents(texts)
+
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        shards = [order[i:i + self.shard_size] for i in range(0, len(order), self.shard_size)]
+        futures = [self._pool().submit(_embed_shard, [texts[i] for i in shard]) for shard in shards]
+
+        vectors = [None] * len(texts)
+        for shard, future in zip(shards, futures):
+            for i, vector in zip(shard, future.result()):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text):
+        return self.local().embed_query(text)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from metrics import metrics
+
+# Bump whenever the enrichment or summary prompts change so stale
+# entries stop matching instead of being served for the new prompt.
+PROMPT_VERSION = "1"
+
+def text_hash(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+def llm_model_name(llm):
+    return getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+
+# Hits only record their last-use time in memory; the times are written in
+# the same transaction as the next put, before an eviction, and on flush()
+# or close(), so a run of hits costs no writes or commits.
+class EnrichmentCache:
+    def __init__(self, path="cache/enrichment.sqlite", max_entries=200000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS enrichments ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON enrichments(last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM enrichments").fetchone()[0]
+
+    @staticmethod
+    def make_key(kind, model, content, summary=""):
+        parts = [kind, model, PROMPT_VERSION, text_hash(content), text_hash(summary)]
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM enrichments WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.incr("cache_lookups", cache="enrichment", result="miss")
+                return None
+            self.hits += 1
+            metrics.incr("cache_lookups", cache="enrichment", result="hit")
+            self._touched[key] = time.time()
+        return json.loads(row[0])
+
+    def get_many(self, keys):
+        # One value (or None) per key, for a batch of lookups.
+        return [self.get(key) for key in keys]
+
+    def put(self, key, value):
+        with self._lock:
+            self._write_touched()
+            payload = json.dumps(value)
+            now = time.time()
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO enrichments (key, value, last_used) VALUES (?, ?, ?)",
+                (key, payload, now)
+            )
+            if cursor.rowcount:
+                self._count += 1
+                self._evict()
+            else:
+                self._conn.execute(
+                    "UPDATE enrichments SET value = ?, last_used = ? WHERE key = ?",
+                    (payload, now, key)
+                )
+            self._conn.commit()
+
+    def _write_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE enrichments SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()]
+            )
+            self._touched = {}
+
+    def flush(self):
+        with self._lock:
+            if self._touched:
+                self._write_touched()
+                self._conn.commit()
+
+    def _evict(self):
+        # Evict in slices of 10% so eviction is not paid on every insert.
+        if not self.max_entries or self._count <= self.max_entries:
+            return
+        excess = self._count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM enrichments WHERE key IN "
+            "(SELECT key FROM enrichments ORDER BY last_used ASC LIMIT ?)",
+            (excess,)
+        )
+        self._count -= excess
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
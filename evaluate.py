@@ -0,0 +1,205 @@
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import argparse
+
+import numpy as np
+
+from rag_engine import MdRag
+from embedding_batcher import EmbeddingBatcher
+
+QUESTION_FIELDS = ("question", "Question")
+EXPECTED_FIELDS = ("expected_sources", "expected", "sources")
+
+def _expected(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = [v.strip() for v in value.replace("|", ";").split(";")]
+    return [str(v) for v in value if str(v).strip()]
+
+def _scope(value):
+    # CSV cells hold the scope as JSON ({"subtree": "billing"}) or as
+    # key=value pairs separated by ";", with several values separated by
+    # "|" or "," (subtree=billing;file_type=md|rst;max_depth=2).
+    if not value:
+        return None
+    if not isinstance(value, str):
+        return value
+    value = value.strip()
+    if value.startswith("{"):
+        return json.loads(value)
+    scope = {}
+    for pair in filter(None, (p.strip() for p in value.split(";"))):
+        key, sep, values = pair.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid scope {value!r}; expected JSON or key=value pairs separated by ';'.")
+        values = [v.strip() for v in values.replace("|", ",").split(",") if v.strip()]
+        scope[key.strip()] = values[0] if len(values) == 1 else values
+    return scope or None
+
+def load_questions(path):
+    # Reads {"question": ..., "expected_sources": [...], "scope": {...}}
+    # lines from JSONL, or rows from CSV (e.g. feedback/feedback.csv) with a
+    # "question" or "Question" column and optional ";"-separated expected
+    # sources. Expected sources are chunk ids or source paths; the optional
+    # scope restricts retrieval (see scope.py and _scope for CSV).
+    if path.endswith(".csv"):
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    items = []
+    for i, row in enumerate(rows):
+        question = next((row[k] for k in QUESTION_FIELDS if row.get(k)), "").strip()
+        if not question:
+            continue
+        items.append({
+            "id": row.get("id", i),
+            "question": question,
+            "expected": _expected(next((row[k] for k in EXPECTED_FIELDS if row.get(k)), None)),
+            "scope": _scope(row.get("scope")),
+        })
+    return items
+
+def _matches(doc, label):
+    if doc.metadata.get("chunk_id") == label:
+        return True
+    source = os.path.normpath(doc.metadata.get("source") or "")
+    label = os.path.normpath(label)
+    return source == label or source.endswith(os.sep + label)
+
+def first_hit_rank(docs, expected):
+    for rank, doc in enumerate(docs, start=1):
+        if any(_matches(doc, label) for label in expected):
+            return rank
+    return None
+
+def summarize(records, hit_at):
+    latencies = [r["latency_ms"] for r in records if "error" not in r]
+    summary = {"questions": len(records), "errors": sum("error" in r for r in records)}
+    if latencies:
+        summary.update({
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+        })
+    labeled = [r for r in records if "rank" in r]
+    if labeled:
+        summary["labeled"] = len(labeled)
+        for n in hit_at:
+            summary[f"hit@{n}"] = sum(1 for r in labeled if r["rank"] and r["rank"] <= n) / len(labeled)
+        summary["mrr"] = sum(1 / r["rank"] for r in labeled if r["rank"]) / len(labeled)
+    return summary
+
+# Runs every question against one MdRag with at most `concurrency` in
+# flight; query embeddings are coalesced by an EmbeddingBatcher as in
+# serve.py. With `retrieval_only`, no answer is generated. The answer
+# cache is bypassed unless `use_cache` is set, so every run measures the
+# current index and model.
+async def run(rag, items, concurrency=8, retrieval_only=False, use_cache=False, output=None):
+    batcher = EmbeddingBatcher(rag.embeddings, max_batch=32, max_wait_ms=5)
+    slots = asyncio.Semaphore(concurrency)
+    records = []
+
+    async def answer(index, item):
+        async with slots:
+            record = {"id": item["id"], "question": item["question"]}
+            start = time.perf_counter()
+            try:
+                if use_cache and not retrieval_only:
+                    response = await rag.aquery(item["question"], embed=batcher.embed, scope=item["scope"])
+                    if not isinstance(response, dict):
+                        raise RuntimeError(response)
+                    docs = response["sources"]
+                    record["answer"] = response["answer"]
+                    record["cached"] = response.get("cached")
+                else:
+                    embedding = await batcher.embed(item["question"])
+                    if retrieval_only:
+                        retrieval = await asyncio.to_thread(rag._retrieve, item["question"], embedding, item["scope"])
+                        docs = retrieval["docs"]
+                        record["timings"] = retrieval["timings"]
+                    else:
+                        response = await rag.chain.ainvoke(
+                            {"input": item["question"], "embedding": embedding, "scope": item["scope"]}
+                        )
+                        docs = response["sources"]
+                        record["answer"] = response["answer"]
+                        record["timings"] = response["timings"]
+                record["chunk_ids"] = [doc.metadata.get("chunk_id") for doc in docs]
+                record["sources"] = [doc.metadata.get("source") for doc in docs]
+                if item["expected"]:
+                    record["rank"] = first_hit_rank(docs, item["expected"])
+            except Exception as e:
+                record["error"] = str(e)
+            record["latency_ms"] = (time.perf_counter() - start) * 1000
+
+            records.append((index, record))
+            if output:
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+            if len(records) % 50 == 0:
+                print(f"{len(records)}/{len(items)} questions done")
+
+    try:
+        await asyncio.gather(*(answer(i, item) for i, item in enumerate(items)))
+    finally:
+        await batcher.close()
+    return [record for _, record in sorted(records, key=lambda r: r[0])]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer or retrieve for a file of questions and score the results.")
+    parser.add_argument("input", help="JSONL or CSV file of questions.")
+    parser.add_argument("--output", default="eval_results.jsonl", help="JSONL file for per-question results.")
+    parser.add_argument("--summary", help="Also write the summary as JSON to this file.")
+    parser.add_argument("--retrieval-only", action="store_true", help="Skip answer generation.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Questions in flight at once.")
+    parser.add_argument("--k", type=int, help="Chunks retrieved per question (default: the engine's k).")
+    parser.add_argument("--fetch-k", type=int, help="Candidates per search before fusion.")
+    parser.add_argument("--hit-at", default="1,3,5", help="Ranks at which to report hit rates.")
+    parser.add_argument("--use-answer-cache", action="store_true", help="Serve repeated questions from the cache.")
+    parser.add_argument("--limit", type=int, help="Only run the first N questions.")
+    parser.add_argument("--source-dir", default="llm_sources")
+    parser.add_argument("--persist-dir", default="./chroma_db")
+    parser.add_argument("--temperature", type=float, default=0.3)
+    args = parser.parse_args(argv)
+
+    items = load_questions(args.input)[:args.limit]
+    if not items:
+        parser.error(f"No questions found in {args.input}.")
+
+    kwargs = {"source_dir": args.source_dir, "persist_dir": args.persist_dir, "temperature": args.temperature}
+    if args.k:
+        kwargs["k"] = args.k
+    if args.fetch_k:
+        kwargs["fetch_k"] = args.fetch_k
+    rag = MdRag(**kwargs)
+
+    print(f"Running {len(items)} questions ({'retrieval only' if args.retrieval_only else 'full answers'}, "
+          f"concurrency {args.concurrency})...")
+    start = time.perf_counter()
+    with open(args.output, "w", encoding="utf-8") as output:
+        records = asyncio.run(run(
+            rag, items,
+            concurrency=args.concurrency,
+            retrieval_only=args.retrieval_only,
+            use_cache=args.use_answer_cache,
+            output=output
+        ))
+    summary = summarize(records, [int(n) for n in args.hit_at.split(",")])
+    summary["seconds"] = time.perf_counter() - start
+
+    print(json.dumps(summary, indent=2))
+    print(f"Per-question results written to {args.output}")
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
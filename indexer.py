@@ -0,0 +1,244 @@
+import os
+import json
+
+from metrics import metrics
+from scope import SCOPE_FIELDS
+
+# Besides its own vector (breadcrumb + text), every chunk can have one
+# vector per enrichment field. These child vectors carry the chunk id as
+# "parent_id" and are collapsed back to the chunk at query time.
+CHILD_VECTORS = {"questions": "questions", "context": "situating_context"}
+
+def child_id(chunk_id, kind):
+    return f"{chunk_id}#{kind}"
+
+def parent_id(vector_id):
+    return vector_id.split("#", 1)[0]
+
+def vector_ids(chunk_ids):
+    ids = list(chunk_ids)
+    for kind in CHILD_VECTORS:
+        ids.extend(child_id(chunk_id, kind) for chunk_id in chunk_ids)
+    return ids
+
+def chunk_vectors(doc):
+    # (id, text, metadata) for every vector stored for a chunk.
+    chunk_id = doc.metadata["chunk_id"]
+    vectors = [(chunk_id, doc.page_content, doc.metadata)]
+    for kind, field in CHILD_VECTORS.items():
+        text = doc.metadata.get(field)
+        if text:
+            metadata = {"parent_id": chunk_id, "kind": kind}
+            metadata.update((field, doc.metadata[field]) for field in SCOPE_FIELDS if field in doc.metadata)
+            vectors.append((child_id(chunk_id, kind), text, metadata))
+    return vectors
+
+# Per-file record of the chunk ids stored in the vector index. A fully
+# indexed file maps to {"hash": ..., "chunks": [...], "stat": [size,
+# mtime_ns, inode]}; the stat lets unchanged files be skipped unread.
+# While a file is being written its hash is None and "pending" lists ids
+# that may or may not have reached the index, so an interrupted sync can
+# clean them up next run.
+# Updates are appended to a journal and folded into manifest.json by
+# compact(), so checkpointing a file costs one small append; ids that join
+# "pending" while a file streams in are appended on their own. The names of
+# one-time index migrations that have run are kept alongside the entries.
+MIGRATIONS_KEY = "__migrations__"
+
+class IndexManifest:
+    def __init__(self, persist_dir):
+        self.path = os.path.join(persist_dir, "manifest.json")
+        self.journal_path = os.path.join(persist_dir, "manifest.journal")
+        self.entries = {}
+        self.migrations = set()
+
+    def load(self):
+        found = False
+        if os.path.exists(self.path):
+            found = True
+            try:
+                with open(self.path, "r") as f:
+                    self.entries = json.load(f)
+                self.migrations = set(self.entries.pop(MIGRATIONS_KEY, []))
+            except Exception:
+                print("Could not load index manifest. Re-indexing all.")
+                self.entries = {}
+
+        if os.path.exists(self.journal_path):
+            found = True
+            with open(self.journal_path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final line from an interrupted write.
+                        break
+                    if "migration" in record:
+                        self.migrations.add(record["migration"])
+                    elif "add_pending" in record:
+                        self._add_pending(record["file"], record["add_pending"])
+                    else:
+                        self._apply(record["file"], record["entry"])
+        return found
+
+    def _apply(self, filename, entry):
+        if entry is None:
+            self.entries.pop(filename, None)
+        else:
+            self.entries[filename] = entry
+
+    def _add_pending(self, filename, ids):
+        entry = self.entries.get(filename)
+        if entry is not None:
+            entry.setdefault("pending", []).extend(ids)
+
+    def _append(self, record):
+        os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def record(self, filename, entry):
+        self._apply(filename, entry)
+        self._append({"file": filename, "entry": entry})
+
+    def add_pending(self, filename, ids):
+        self._add_pending(filename, ids)
+        self._append({"file": filename, "add_pending": ids})
+
+    def mark_migrated(self, name):
+        if name not in self.migrations:
+            self.migrations.add(name)
+            self._append({"migration": name})
+
+    def compact(self):
+        if not os.path.exists(self.journal_path) and os.path.exists(self.path):
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_file = self.path + ".tmp"
+        data = dict(self.entries)
+        if self.migrations:
+            data[MIGRATIONS_KEY] = sorted(self.migrations)
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+# Embeds and upserts chunks (with their child vectors) in fixed-size
+# batches as files arrive. Only the current partial batch is buffered, and
+# each file is checkpointed in the manifest as soon as its last chunk is
+# written. A file can arrive whole (add_file) or in batches between
+# begin_file and end_file, so a large file is never held in memory.
+class StreamingIndexer:
+    def __init__(self, vectorstore, embeddings, manifest, batch_size=64, lexical_index=None, on_delete=None,
+                 dense_index=None):
+        self.vectorstore = vectorstore
+        self.lexical_index = lexical_index
+        self.dense_index = dense_index
+        self.on_delete = on_delete
+        self.embeddings = embeddings
+        self.manifest = manifest
+        self.batch_size = batch_size
+        self.added = 0
+        self.deleted = 0
+        self._buffer = []
+        self._open_files = []
+
+    def add_file(self, filename, file_hash, docs, old_ids, pending_ids=(), stat=None):
+        file_state = self.begin_file(filename, old_ids, pending_ids, stat)
+        self.add_docs(file_state, docs)
+        self.end_file(file_state, file_hash)
+
+    def begin_file(self, filename, old_ids, pending_ids=(), stat=None):
+        self.manifest.record(filename, {"hash": None, "chunks": sorted(old_ids), "pending": list(pending_ids)})
+        file_state = {
+            "filename": filename,
+            "hash": None,
+            "stat": stat,
+            "old": set(old_ids),
+            "pending": set(pending_ids),
+            "chunks": [],
+            "remaining": 0,
+            "open": True,
+            "complete": True
+        }
+        self._open_files.append(file_state)
+        return file_state
+
+    def add_docs(self, file_state, docs):
+        new_docs = [doc for doc in docs if doc.metadata["chunk_id"] not in file_state["old"]]
+        file_state["chunks"].extend(doc.metadata["chunk_id"] for doc in docs)
+        if new_docs:
+            new_ids = [doc.metadata["chunk_id"] for doc in new_docs]
+            self.manifest.add_pending(file_state["filename"], new_ids)
+            file_state["pending"].update(new_ids)
+        file_state["remaining"] += len(new_docs)
+        self._buffer.extend((doc, file_state) for doc in new_docs)
+
+        while len(self._buffer) >= self.batch_size:
+            self._flush_batch()
+        self._finish_ready_files()
+
+    def end_file(self, file_state, file_hash, complete=True):
+        # An incomplete file (its chunks stopped arriving part way) keeps its
+        # old chunks and leaves everything written for it pending, so the
+        # next sync processes it again and cleans up.
+        file_state.update(hash=file_hash, open=False, complete=complete)
+        self._finish_ready_files()
+
+    def flush(self):
+        while self._buffer:
+            self._flush_batch()
+        self._finish_ready_files()
+
+    def _flush_batch(self):
+        batch = self._buffer[:self.batch_size]
+        del self._buffer[:self.batch_size]
+
+        docs = [doc for doc, _ in batch]
+        rows = [row for doc in docs for row in chunk_vectors(doc)]
+        ids = [vector_id for vector_id, _, _ in rows]
+        texts = [text for _, text, _ in rows]
+        with metrics.span("embed_batch"):
+            vectors = self.embeddings.embed_documents(texts)
+        with metrics.span("vector_upsert"):
+            self.vectorstore._collection.upsert(
+                ids=ids,
+                embeddings=vectors,
+                documents=texts,
+                metadatas=[metadata for _, _, metadata in rows]
+            )
+            if self.dense_index is not None:
+                self.dense_index.add(ids, vectors)
+        metrics.incr("vectors_indexed", len(ids))
+        self.added += len(docs)
+
+        if self.lexical_index is not None:
+            for doc in docs:
+                self.lexical_index.add(doc.metadata["chunk_id"], doc.metadata.get("original_content", doc.page_content))
+
+        for _, file_state in batch:
+            file_state["remaining"] -= 1
+
+    def _finish_ready_files(self):
+        ready = [f for f in self._open_files if not f["open"] and f["remaining"] == 0]
+        if ready:
+            self._open_files = [f for f in self._open_files if f["open"] or f["remaining"]]
+        for file_state in ready:
+            if not file_state["complete"]:
+                self.manifest.record(file_state["filename"], {
+                    "hash": None,
+                    "chunks": sorted(file_state["old"]),
+                    "pending": sorted(file_state["pending"] - file_state["old"])
+                })
+                continue
+            stale_ids = list((file_state["old"] | file_state["pending"]) - set(file_state["chunks"]))
+            if stale_ids:
+                self.vectorstore.delete(ids=vector_ids(stale_ids))
+                self.deleted += len(stale_ids)
+                if self.on_delete:
+                    self.on_delete(stale_ids)
+            entry = {"hash": file_state["hash"], "chunks": file_state["chunks"]}
+            if file_state["stat"] is not None:
+                entry["stat"] = file_state["stat"]
+            self.manifest.record(file_state["filename"], entry)
@@ -0,0 +1,135 @@
+import time
+import random
+import asyncio
+
+from metrics import metrics
+
+THROTTLE_MARKERS = (
+    "429", "rate limit", "ratelimit", "resource exhausted", "resourceexhausted", "quota",
+    "503", "overloaded", "unavailable", "timed out", "timeout",
+)
+
+def is_throttle_error(error):
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    message = f"{type(error).__name__} {error}".lower()
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+def estimate_tokens(text):
+    # Rough 4 chars/token estimate; only used to pace requests.
+    return max(1, len(text) // 4)
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        amount = min(float(amount), self.capacity)
+        # Holding the lock while sleeping keeps waiters in FIFO order.
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+# Shared gate for every LLM call made during ingestion. Requests are paced by
+# optional requests/tokens-per-minute buckets, and the number of calls in
+# flight adapts AIMD-style: it halves on throttling or timeouts and grows
+# back by roughly one slot per window of successful calls. Failed calls are
+# retried with full-jitter exponential backoff. Callers record chunks that
+# still fail with dead_letter() so they can be retried on the next sync.
+class LLMScheduler:
+    def __init__(self, max_concurrency=5, requests_per_minute=None, tokens_per_minute=None,
+                 max_retries=4, base_delay=1.0, max_delay=30.0, request_timeout=120.0):
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.request_timeout = request_timeout
+
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.dead_letters = []
+
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def _acquire_slot(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < max(1, int(self.limit)))
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+    async def _release_slot(self, throttled):
+        async with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / max(1.0, self.limit))
+            self._condition.notify_all()
+
+    async def invoke(self, llm, prompt):
+        attempt = 0
+        while True:
+            with metrics.span("llm_queue_wait"):
+                if self.request_bucket:
+                    await self.request_bucket.acquire(1)
+                if self.token_bucket:
+                    await self.token_bucket.acquire(estimate_tokens(prompt))
+                await self._acquire_slot()
+            throttled = False
+            try:
+                self.calls += 1
+                return await asyncio.wait_for(llm.ainvoke(prompt), timeout=self.request_timeout)
+            except Exception as e:
+                throttled = is_throttle_error(e)
+                if throttled:
+                    self.throttled += 1
+                    metrics.incr("llm_throttled")
+                if attempt >= self.max_retries:
+                    self.failures += 1
+                    metrics.incr("llm_failures")
+                    raise
+                error = e
+            finally:
+                await self._release_slot(throttled)
+
+            attempt += 1
+            self.retries += 1
+            metrics.incr("llm_retries")
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+            print(f"LLM call failed ({error}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def dead_letter(self, source, chunk_id, error):
+        self.dead_letters.append({"source": source, "chunk_id": chunk_id, "error": str(error)})
+
+    def dead_letters_for(self, source):
+        return [d for d in self.dead_letters if d["source"] == source]
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failures": self.failures,
+            "dead_letters": len(self.dead_letters),
+            "concurrency_limit": int(self.limit),
+            "peak_in_flight": self._peak_in_flight,
+        }
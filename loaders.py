@@ -0,0 +1,209 @@
+import os
+import re
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+from md_chunker import HEADERS, iter_markdown_chunks
+
+# Markdown files at least this large are chunked while being read instead
+# of being loaded whole (see md_chunker.py). Smaller files keep the
+# LangChain splitters, so their chunk ids and cached enrichments stay valid.
+STREAM_THRESHOLD = int(os.getenv("MARKDOWN_STREAM_THRESHOLD", str(32 * 1024 * 1024)))
+# Files smaller than this are parsed in a thread; shipping them to a worker
+# process would cost more than the parse.
+INLINE_BYTES = 256 * 1024
+
+# A loader takes a file path and returns its chunks as compact records,
+# (header_path, text, metadata), where metadata holds only the "Header N"
+# fields and, for sections split into several chunks, "part" and "parts".
+# Records are plain tuples so they cross process boundaries cheaply; chunk
+# ids, breadcrumbs and enrichment are added by preprocess.process_document
+# the same way for every file type.
+LOADERS = {}
+
+def register_loader(*extensions):
+    # Loaders run in worker processes, which import them by name, so they
+    # must be module-level functions.
+    def decorator(loader):
+        for extension in extensions:
+            LOADERS[extension.lower()] = loader
+        return loader
+    return decorator
+
+def loader_for(file_path):
+    return LOADERS.get(os.path.splitext(file_path)[1].lower())
+
+def get_loader(file_path):
+    loader = loader_for(file_path)
+    if loader is None:
+        raise ValueError(
+            f"Unsupported file type: {os.path.splitext(file_path)[1].lower()}. "
+            f"Supported: {', '.join(sorted(LOADERS))}."
+        )
+    return loader
+
+def load_file(file_path):
+    return get_loader(file_path)(file_path)
+
+def _read_text(file_path, limit=-1):
+    with open(file_path, "r", encoding="utf-8") as f:
+        return f.read(limit)
+
+def _number_parts(docs):
+    # (header_path, doc) pairs, with the parts of every section that was
+    # split numbered in one pass.
+    sections = {}
+    chunks = []
+    for doc in docs:
+        headers = [doc.metadata[h] for h in HEADERS if h in doc.metadata]
+        sections.setdefault(tuple(headers), []).append(doc)
+        chunks.append((" / ".join(headers), doc))
+    for section in sections.values():
+        if len(section) > 1:
+            for i, doc in enumerate(section):
+                doc.metadata["part"] = i + 1
+                doc.metadata["parts"] = len(section)
+    return chunks
+
+def _records(chunks):
+    return [(header_path, doc.page_content, doc.metadata) for header_path, doc in chunks]
+
+def _split_sections(sections):
+    char_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
+    return _number_parts(char_splitter.split_documents(sections))
+
+def chunk_markdown(text):
+    headers_to_split_on = [
+        ("#", "Header 1"),
+        ("##", "Header 2"),
+        ("###", "Header 3"),
+        ("####", "Header 4"),
+        ("#####", "Header 5"),
+        ("######", "Header 6"),
+    ]
+    md_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on)
+    return _split_sections(md_splitter.split_text(text))
+
+def streams(file_path):
+    # Whether the file is consumed through iter_markdown_records, in
+    # batches, rather than loaded as one list of records.
+    return os.path.splitext(file_path)[1].lower() == ".md" and os.path.getsize(file_path) >= STREAM_THRESHOLD
+
+def iter_markdown_records(file_path):
+    # Records of a markdown file, produced while it is read. The metadata
+    # of a section's chunks gets its "parts" when the section ends, so it
+    # is only complete once the records after it have been read.
+    with open(file_path, "r", encoding="utf-8") as f:
+        for header_path, doc in iter_markdown_chunks(f):
+            yield header_path, doc.page_content, doc.metadata
+
+@register_loader(".md")
+def load_markdown(file_path):
+    if os.path.getsize(file_path) >= STREAM_THRESHOLD:
+        return list(iter_markdown_records(file_path))
+    return _records(chunk_markdown(_read_text(file_path)))
+
+@register_loader(".txt")
+def load_text(file_path):
+    char_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        separators=["\n\n", "\n", " ", ""]
+    )
+    docs = char_splitter.create_documents([_read_text(file_path)])
+    return [("", doc.page_content, {"part": i + 1, "parts": len(docs)}) for i, doc in enumerate(docs)]
+
+# A line of one repeated punctuation character, as used to underline (and
+# optionally overline) reStructuredText section titles.
+ADORNMENT_RE = re.compile(r"^([!-/:-@\[-`{-~])\1+\s*$")
+
+def _adornment(line):
+    match = ADORNMENT_RE.match(line)
+    return match.group(1) if match else None
+
+def rst_sections(text):
+    # Splits reStructuredText-style text into Documents with "Header N"
+    # metadata, as MarkdownHeaderTextSplitter does for markdown. Title
+    # levels follow the order in which adornment styles first appear.
+    lines = text.splitlines()
+    styles = []
+    headers = [None] * len(HEADERS)
+    sections = []
+    body = []
+
+    def close_section():
+        content = "\n".join(body).strip()
+        if content:
+            metadata = {name: value for name, value in zip(HEADERS, headers) if value}
+            sections.append(Document(page_content=content, metadata=metadata))
+        body.clear()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        char = _adornment(line)
+        title = style = None
+        if (char and i + 2 < len(lines) and lines[i + 1].strip() and _adornment(lines[i + 2]) == char
+                and len(lines[i + 2].rstrip()) >= len(lines[i + 1].strip())):
+            title, style, step = lines[i + 1].strip(), (char, True), 3
+        elif (line.strip() and not char and i + 1 < len(lines) and (i == 0 or not lines[i - 1].strip())
+              and _adornment(lines[i + 1]) and len(lines[i + 1].rstrip()) >= len(line.rstrip())):
+            title, style, step = line.strip(), (_adornment(lines[i + 1]), False), 2
+
+        if title is None:
+            body.append(line)
+            i += 1
+            continue
+
+        close_section()
+        if style not in styles:
+            styles.append(style)
+        level = min(styles.index(style), len(HEADERS) - 1)
+        headers[level] = title
+        for deeper in range(level + 1, len(headers)):
+            headers[deeper] = None
+        i += step
+    close_section()
+    return sections
+
+@register_loader(".rst")
+def load_rst(file_path):
+    return _records(_split_sections(rst_sections(_read_text(file_path))))
+
+# Runs loaders in worker processes, so splitting large files uses other
+# cores and never holds the event loop's thread. Small files are parsed in
+# a thread instead, and so are files of STREAM_THRESHOLD or more: their
+# records would exist in the worker and again, as one pickle, in this
+# process. Workers start on first use and stop on close(), so they only
+# live for the duration of a sync.
+class ParsePool:
+    def __init__(self, workers=0, inline_bytes=INLINE_BYTES):
+        self.workers = workers
+        self.inline_bytes = inline_bytes
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            print(f"Starting {self.workers} parse workers...")
+            # Forking a process that already loaded torch is unsafe.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def load(self, file_path):
+        loader = get_loader(file_path)
+        size = os.path.getsize(file_path)
+        if not self.workers or size < self.inline_bytes or size >= STREAM_THRESHOLD:
+            return await asyncio.to_thread(loader, file_path)
+        return await asyncio.wrap_future(self._pool().submit(loader, file_path))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,174 @@
+import re
+
+from langchain_core.documents import Document
+
+HEADERS = ["Header 1", "Header 2", "Header 3", "Header 4", "Header 5", "Header 6"]
+
+HEADER_RE = re.compile(r"^(#{1,6})[ \t]+(.*?)(?:[ \t]+#+)?[ \t]*$")
+FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+TABLE_SEPARATOR_RE = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+
+# Builds the chunks of one file line by line. Only the lines of the chunk
+# being filled are held, so memory follows the chunk size, not the file.
+class _ChunkWriter:
+    def __init__(self, chunk_size, chunk_overlap):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.headers = [None] * len(HEADERS)
+        self.metadata = {}
+        self.breadcrumb = ""
+        # Metadata of the chunks already emitted for the current section;
+        # their "parts" is filled in when the section ends.
+        self.section = []
+
+        self.lines = []
+        self.size = 0
+        # Index in `lines` of the last block boundary (a blank line or the
+        # start/end of a code fence or table), the preferred place to cut.
+        self.boundary = 0
+        self.fence = None
+        self.table = None
+
+    def _append(self, line):
+        self.lines.append(line)
+        self.size += len(line) + 1
+
+    def _chunk(self, lines):
+        text = "\n".join(lines).strip()
+        if not text:
+            return None
+        doc = Document(page_content=text, metadata=dict(self.metadata, part=len(self.section) + 1))
+        # Document copies the dict it is given; keep the one it holds.
+        self.section.append(doc.metadata)
+        return self.breadcrumb, doc
+
+    def _cut(self, incoming):
+        # Emits the current chunk and starts the next one. A cut at a block
+        # boundary in the second half of the chunk keeps the block whole;
+        # otherwise the chunk is cut at this line, the last lines are
+        # repeated as overlap, and an open code fence or table is closed and
+        # re-opened (with its header rows) so both chunks stay valid markdown.
+        if self.boundary and sum(len(l) + 1 for l in self.lines[:self.boundary]) >= self.chunk_size // 2:
+            emitted, carried = self.lines[:self.boundary], self.lines[self.boundary:]
+            while carried and not carried[0].strip():
+                carried = carried[1:]
+        else:
+            emitted = self.lines
+            if self.fence:
+                emitted = emitted + [self.fence[0] * self.fence[1]]
+            reopen = [self.fence[2]] if self.fence else list(self.table or [])
+            overlap = []
+            # Leave room for the line that did not fit.
+            budget = min(self.chunk_overlap, self.chunk_size - incoming - sum(len(l) + 1 for l in reopen))
+            for line in reversed(self.lines):
+                if line in reopen or len(line) + 1 > budget or not line.strip():
+                    break
+                overlap.insert(0, line)
+                budget -= len(line) + 1
+            carried = reopen + overlap
+
+        chunk = self._chunk(emitted)
+        self.lines = []
+        self.size = 0
+        self.boundary = 0
+        for line in carried:
+            self._append(line)
+        return chunk
+
+    def add(self, line):
+        # Yields the chunks completed by adding `line`.
+        if self.fence is None:
+            header = HEADER_RE.match(line)
+            if header:
+                yield from self.end_section()
+                level = len(header.group(1))
+                self.headers[level - 1] = header.group(2).strip()
+                for i in range(level, len(self.headers)):
+                    self.headers[i] = None
+                self.metadata = {name: value for name, value in zip(HEADERS, self.headers) if value}
+                self.breadcrumb = " / ".join(self.metadata.values())
+                return
+
+        pieces = [line]
+        if len(line) >= self.chunk_size:
+            # Hard-wrap lines that cannot fit in any chunk at whitespace.
+            pieces = []
+            while len(line) >= self.chunk_size:
+                cut = line.rfind(" ", 0, self.chunk_size - 1)
+                cut = cut if cut > 0 else self.chunk_size - 1
+                pieces.append(line[:cut])
+                line = line[cut:].lstrip()
+            pieces.append(line)
+
+        for piece in pieces:
+            if self.size + len(piece) + 1 > self.chunk_size and self.lines:
+                chunk = self._cut(len(piece) + 1)
+                if chunk:
+                    yield chunk
+            self._track_blocks(piece)
+
+    def _track_blocks(self, line):
+        stripped = line.strip()
+        if self.fence is not None:
+            self._append(line)
+            marker = self.fence[0] * self.fence[1]
+            if stripped.startswith(marker) and not stripped.strip(self.fence[0]):
+                self.fence = None
+                self.boundary = len(self.lines)
+            return
+
+        fence = FENCE_RE.match(line)
+        if fence:
+            self.table = None
+            self.boundary = len(self.lines)
+            self.fence = (fence.group(1)[0], len(fence.group(1)), line)
+            self._append(line)
+        elif not stripped:
+            self.table = None
+            if self.lines:
+                self._append(line)
+                self.boundary = len(self.lines)
+        elif self.table is not None and "|" not in stripped:
+            self.table = None
+            self.boundary = len(self.lines)
+            self._append(line)
+        elif (self.table is None and TABLE_SEPARATOR_RE.match(line) and "-" in stripped
+              and self.lines and "|" in self.lines[-1]):
+            # A separator row under a row with pipes starts a table; the
+            # header and separator rows are repeated if the table is split.
+            self.table = [self.lines[-1], line]
+            self.boundary = len(self.lines) - 1
+            self._append(line)
+        else:
+            self._append(line)
+
+    def end_section(self):
+        if self.lines:
+            chunk = self._chunk(self.lines)
+            if chunk:
+                yield chunk
+        if len(self.section) == 1:
+            del self.section[0]["part"]
+        else:
+            for metadata in self.section:
+                metadata["parts"] = len(self.section)
+        self.section = []
+        self.lines = []
+        self.size = 0
+        self.boundary = 0
+        self.fence = None
+        self.table = None
+
+# Single-pass markdown chunker for files too large to split in memory.
+# Reads `lines` (e.g. an open file) once and yields (breadcrumb, Document)
+# pairs of at most about `chunk_size` characters. Header lines are tracked
+# as a stack and moved into "Header N" metadata, as MarkdownHeaderTextSplitter
+# does; chunks prefer to end at blank lines and never split a code fence or
+# table without closing and re-opening it. Chunks of a section that needed
+# several get "part" when emitted; "parts" is set on all of them once the
+# section ends, so it is complete by the time the generator is exhausted.
+def iter_markdown_chunks(lines, chunk_size=2000, chunk_overlap=200):
+    writer = _ChunkWriter(chunk_size, chunk_overlap)
+    for line in lines:
+        yield from writer.add(line.rstrip("\r\n"))
+    yield from writer.end_section()
@@ -0,0 +1,176 @@
+import sys
+import json
+import time
+import threading
+import contextlib
+from collections import deque
+
+import numpy as np
+
+WINDOW = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _prometheus_labels(labels, **extra):
+    items = list(labels) + [(k, str(v)) for k, v in extra.items()]
+    if not items:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+class _Timer:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=WINDOW)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def quantiles(self):
+        if not self.recent:
+            return {q: 0.0 for q in QUANTILES}
+        values = np.percentile(np.fromiter(self.recent, dtype=np.float64), [q * 100 for q in QUANTILES])
+        return dict(zip(QUANTILES, values.tolist()))
+
+# Writes every span and counter update as one JSON line, to a file path or
+# to stdout for "-".
+class JsonLogSink:
+    def __init__(self, path="-"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = sys.stdout if path == "-" else open(path, "a", encoding="utf-8")
+
+    def emit(self, event):
+        line = json.dumps(event)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
+
+# Process-wide timings and counters. span() times a block and observe()
+# records a duration measured elsewhere; both keep a count, total, max and a
+# window of recent samples per (name, labels) for percentiles. incr() bumps
+# a counter. Every update is also passed to the attached sinks, so the same
+# data can go to JSON logs while snapshot() feeds the UI and prometheus()
+# serves a scrape endpoint.
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._counters = {}
+        self.sinks = []
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def _emit(self, event):
+        for sink in self.sinks:
+            try:
+                sink.emit(event)
+            except Exception as e:
+                print(f"Metrics sink {type(sink).__name__} failed: {e}")
+
+    @contextlib.contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = _Timer()
+            timer.observe(seconds)
+        if self.sinks:
+            self._emit({"ts": time.time(), "type": "span", "name": name, "labels": labels, "ms": seconds * 1000})
+
+    def incr(self, name, value=1, **labels):
+        if not value:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        if self.sinks:
+            self._emit({"ts": time.time(), "type": "counter", "name": name, "labels": labels, "value": value})
+
+    def reset(self):
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        with self._lock:
+            timers = [(name, labels, timer, timer.quantiles()) for (name, labels), timer in self._timers.items()]
+            counters = list(self._counters.items())
+        return {
+            "spans": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": timer.count,
+                    "total_s": timer.total,
+                    "mean_ms": timer.total / timer.count * 1000,
+                    "p50_ms": quantiles[0.5] * 1000,
+                    "p95_ms": quantiles[0.95] * 1000,
+                    "p99_ms": quantiles[0.99] * 1000,
+                    "max_ms": timer.max * 1000,
+                }
+                for name, labels, timer, quantiles in sorted(timers, key=lambda t: -t[2].total)
+            ],
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(counters)
+            ],
+        }
+
+    def prometheus(self, prefix="mdrag"):
+        # Prometheus text exposition format: spans as summaries in seconds
+        # (quantiles over the recent window), counters as *_total.
+        with self._lock:
+            timers = sorted((key, timer, timer.quantiles()) for key, timer in self._timers.items())
+            counters = sorted(self._counters.items())
+
+        lines = []
+        declared = set()
+        for (name, labels), timer, quantiles in timers:
+            metric = f"{prefix}_{name}_seconds"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} summary")
+            for q, value in quantiles.items():
+                lines.append(f"{metric}{_prometheus_labels(labels, quantile=q)} {value:.6g}")
+            lines.append(f"{metric}_sum{_prometheus_labels(labels)} {timer.total:.6g}")
+            lines.append(f"{metric}_count{_prometheus_labels(labels)} {timer.count}")
+        for (name, labels), value in counters:
+            metric = f"{prefix}_{name}_total"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_prometheus_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+_log_sinks = {}
+
+def log_to(path):
+    # Attaches a JSON log sink for `path` to the shared registry, once per
+    # path however many engines ask for it.
+    if path not in _log_sinks:
+        _log_sinks[path] = metrics.add_sink(JsonLogSink(path))
+    return _log_sinks[path]
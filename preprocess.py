@@ -1,176 +1,690 @@
 import os
+import re
+import html
+import json
+import mmap
 import asyncio
 import hashlib
-from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
+import itertools
 from langchain_core.documents import Document
 
+from enrichment_cache import EnrichmentCache, llm_model_name
+from llm_scheduler import LLMScheduler, estimate_tokens
+from metrics import metrics
+from md_chunker import HEADERS
+from loaders import get_loader, streams, iter_markdown_records
+
+HASH_BLOCK_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 16 * 1024 * 1024
+SUMMARY_CHARS = 10000
+# Longest text sent to one section or reduce summary call.
+SECTION_CHARS = 12000
+# Most chunk text packed into one batched enrichment prompt.
+BATCH_CHARS = 8000
+# Chunks of a streamed file read, enriched and handed on at a time.
+STREAM_BATCH_CHUNKS = 256
+# Section summary windows of a streamed file in flight at a time.
+STREAM_WINDOWS = 32
+
 def calculate_file_hash(file_path):
+    # hashlib releases the GIL on large buffers, so this parallelizes well
+    # when called from a thread pool.
     hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
+    with metrics.span("hash"), open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hash_md5.update(mapped)
+        else:
+            for chunk in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
-async def process_document(file_path, llm=None):
+def compute_chunk_id(file_path, breadcrumb, text):
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    key = f"{file_path}\x1f{breadcrumb}\x1f{text_hash}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+def _unique_chunk_id(file_path, breadcrumb, text, seen_ids):
+    chunk_id = compute_chunk_id(file_path or "", breadcrumb, text)
+    # Identical text repeated under the same headers still needs distinct ids.
+    occurrence = seen_ids.get(chunk_id, 0)
+    seen_ids[chunk_id] = occurrence + 1
+    return f"{chunk_id}-{occurrence}" if occurrence else chunk_id
+
+def _assign_chunk_id(doc, file_path, breadcrumb, seen_ids, subtree=None):
+    chunk_id = _unique_chunk_id(file_path, breadcrumb, doc.page_content, seen_ids)
+    doc.metadata["chunk_id"] = chunk_id
+    # Scalar fields a query can be scoped by (see scope.py).
+    if file_path:
+        doc.metadata["source"] = file_path
+        doc.metadata["file_type"] = os.path.splitext(file_path)[1].lstrip(".").lower()
+    if subtree is not None:
+        doc.metadata["subtree"] = subtree
+    doc.metadata["depth"] = sum(1 for h in HEADERS if h in doc.metadata)
+    return chunk_id
+
+def _read_text(file_path, limit=-1):
+    with open(file_path, "r", encoding="utf-8") as f:
+        return f.read(limit)
+
+async def process_document(file_path, llm=None, existing_ids=None, cache=None, scheduler=None, enrich_batch=None,
+                           subtree=None, parse_pool=None):
+    docs = []
+    async for batch in iter_document(
+        file_path, llm, existing_ids, cache, scheduler, enrich_batch, subtree, parse_pool
+    ):
+        docs.extend(batch)
+    return docs
+
+# Yields the file's indexable docs. The file is split by the loader
+# registered for its extension (see loaders.py), in `parse_pool` when
+# given, and its chunks are enriched the same way whatever their format.
+# Most files come out as one batch; a markdown file large enough to be
+# streamed comes out in batches of STREAM_BATCH_CHUNKS, so memory follows
+# the batch size rather than the file. `enrich_batch` switches enrichment
+# to one JSON call for up to that many consecutive chunks of a section;
+# None makes two calls per chunk. `subtree` is recorded on every chunk so
+# queries can be scoped to it.
+async def iter_document(file_path, llm=None, existing_ids=None, cache=None, scheduler=None, enrich_batch=None,
+                        subtree=None, parse_pool=None):
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"The file {file_path} was not found.")
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        text = f.read()
+    loader = get_loader(file_path)
+    # A shared scheduler lets callers cap and pace LLM calls across many files.
+    if scheduler is None:
+        scheduler = LLMScheduler(max_concurrency=5)
 
-    file_extension = os.path.splitext(file_path)[1].lower()
+    if streams(file_path):
+        async for docs in _stream_document(file_path, llm, existing_ids, cache, scheduler, enrich_batch, subtree):
+            yield docs
+        return
 
-    if file_extension == ".md":
-        return await _split_markdown(text, llm, file_path)
-    
-    elif file_extension == ".txt":
-        return _split_text(text)
-    
-    else:
-        raise ValueError(f"Unsupported file type: {file_extension}. Only .md and .txt are supported.")
+    # Splitting is CPU-bound; keep it off the event loop so enrichment
+    # calls for other files keep flowing while a large file is chunked.
+    file_type = os.path.splitext(file_path)[1].lstrip(".").lower()
+    with metrics.span("split", format=file_type):
+        if parse_pool:
+            records = await parse_pool.load(file_path)
+        else:
+            records = await asyncio.to_thread(loader, file_path)
+    chunks = [
+        (header_path, Document(page_content=text, metadata=metadata))
+        for header_path, text, metadata in records
+    ]
+    yield await _enrich_chunks(chunks, llm, file_path, existing_ids, cache, scheduler, enrich_batch, subtree)
 
-async def _generate_global_summary(text, llm):
+async def _invoke(llm, prompt, scheduler=None, kind="llm"):
+    # The span includes time spent waiting for a scheduler slot.
+    with metrics.span("llm_call", kind=kind):
+        if scheduler:
+            response = await scheduler.invoke(llm, prompt)
+        else:
+            response = await llm.ainvoke(prompt)
+    usage = getattr(response, "usage_metadata", None) or {}
+    metrics.incr("llm_tokens", usage.get("input_tokens") or estimate_tokens(prompt), kind=kind, direction="prompt")
+    metrics.incr(
+        "llm_tokens", usage.get("output_tokens") or estimate_tokens(response.content), kind=kind, direction="completion"
+    )
+    return response
+
+async def _generate_global_summary(text, llm, cache=None, scheduler=None):
     if not llm:
         return ""
     
-    truncated_text = text[:10000]
+    truncated_text = text[:SUMMARY_CHARS]
+
+    cache_key = None
+    if cache:
+        cache_key = EnrichmentCache.make_key("summary", llm_model_name(llm), truncated_text)
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            return cached["summary"]
     
     prompt = (
         f"<document>\n{truncated_text}\n</document>\n"
         "Please provide a concise global summary (3-4 sentences) of this document. "
         "This summary will be used to provide context for individual chunks."
     )
+    response = await _invoke(llm, prompt, scheduler, kind="summary")
+    if cache_key:
+        await asyncio.to_thread(cache.put, cache_key, {"summary": response.content})
+    return response.content
+
+async def _summarize(kind, content, prompt, llm, cache=None, scheduler=None):
+    # One cached summary call; the key covers `content`, so unchanged text
+    # is never summarized twice.
+    cache_key = None
+    if cache:
+        cache_key = EnrichmentCache.make_key(kind, llm_model_name(llm), content)
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            return cached["summary"]
+    response = await _invoke(llm, prompt, scheduler, kind=kind)
+    if cache_key:
+        await asyncio.to_thread(cache.put, cache_key, {"summary": response.content})
+    return response.content
+
+def _pack(texts, limit):
+    # Groups consecutive texts into windows of at most about `limit` chars.
+    windows = [[]]
+    size = 0
+    for text in texts:
+        if windows[-1] and size + len(text) > limit:
+            windows.append([])
+            size = 0
+        windows[-1].append(text)
+        size += len(text) + 2
+    return ["\n\n".join(window) for window in windows]
+
+async def _summarize_section(title, texts, llm, cache, scheduler):
+    windows = _pack(texts, SECTION_CHARS)
+    if len(windows) > 1:
+        # Too long for one call: summarize windows, then combine them.
+        partials = await asyncio.gather(*(
+            _summarize_section(title, [window], llm, cache, scheduler) for window in windows
+        ))
+        return await _reduce_summaries(partials, llm, cache, scheduler, title)
+    prompt = (
+        f"<section title=\"{title}\">\n{windows[0]}\n</section>\n"
+        "Please provide a concise summary (2-3 sentences) of this section of a larger document."
+    )
+    return await _summarize("section_summary", f"{title}\x1f{windows[0]}", prompt, llm, cache, scheduler)
+
+async def _reduce_summaries(summaries, llm, cache, scheduler, title=None):
+    # Combines ordered summaries into one, in a tree of calls when they do
+    # not fit in a single prompt.
+    while True:
+        windows = _pack(summaries, SECTION_CHARS)
+        if len(windows) == 1:
+            break
+        summaries = await asyncio.gather(*(
+            _reduce_summaries([window], llm, cache, scheduler, title) for window in windows
+        ))
+    scope = f'the section "{title}"' if title else "the document"
+    prompt = (
+        f"<summaries>\n{windows[0]}\n</summaries>\n"
+        f"These are summaries of consecutive parts of {scope}, in order. "
+        f"Please combine them into a concise global summary (3-4 sentences) of {scope}. "
+        "This summary will be used to provide context for individual chunks."
+    )
+    return await _summarize("summary_reduce", f"{title or ''}\x1f{windows[0]}", prompt, llm, cache, scheduler)
+
+def _section_level(metadatas):
+    # The shallowest header level whose value changes between chunks.
+    for header in HEADERS:
+        values = [metadata.get(header) for metadata in metadatas]
+        if any(a != b for a, b in zip(values, values[1:])):
+            return header
+    return None
+
+def _top_level_sections(chunks):
+    # Splits the chunks into runs of consecutive chunks under the same
+    # heading, at the shallowest header level that has more than one.
+    level = _section_level([doc.metadata for _, doc in chunks])
+
+    sections = []
+    previous = object()
+    for header_path, doc in chunks:
+        value = doc.metadata.get(level) if level else None
+        if value != previous:
+            sections.append((value or "Introduction", []))
+            previous = value
+        sections[-1][1].append((header_path, doc))
+    return sections
+
+# Map-reduce summary for documents longer than one summary call can see:
+# every top-level section is summarized in parallel, and the section
+# summaries are reduced into the document summary. Both are cached by
+# content, so editing one section re-summarizes only that section and the
+# final reduce. Returns the document summary and {chunk_id: section summary}.
+async def _generate_hierarchical_summary(chunks, llm, cache=None, scheduler=None):
+    sections = _top_level_sections(chunks)
+    section_summaries = await asyncio.gather(*(
+        _summarize_section(
+            title,
+            [f"{header_path}\n{doc.page_content}" if header_path else doc.page_content for header_path, doc in members],
+            llm, cache, scheduler
+        )
+        for title, members in sections
+    ))
+    if len(sections) == 1:
+        # The only section summary already covers the whole document.
+        return section_summaries[0], {}
+
+    titled = [f"## {title}\n{summary}" for (title, _), summary in zip(sections, section_summaries)]
+    document_summary = await _reduce_summaries(titled, llm, cache, scheduler)
+    by_chunk = {}
+    for (_, members), summary in zip(sections, section_summaries):
+        for _, doc in members:
+            by_chunk[doc.metadata["chunk_id"]] = summary
+    return document_summary, by_chunk
+
+# Returns {"context": ..., "questions": ...} for the chunk, or None if the
+# LLM calls failed.
+async def _enrich_chunk(doc, global_summary, llm, scheduler, cache=None, section_summary=""):
+    if not llm:
+        return {}
+
+    cache_key = None
+    if cache:
+        summary_key = f"{global_summary}\x1f{section_summary}" if section_summary else global_summary
+        cache_key = EnrichmentCache.make_key("chunk", llm_model_name(llm), doc.page_content, summary_key)
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            return cached
+
     try:
-        response = await llm.ainvoke(prompt)
-        return response.content
+        section = f"Section Summary:\n{section_summary}\n\n" if section_summary else ""
+        context_prompt = (
+            f"Global Document Summary:\n{global_summary}\n\n"
+            f"{section}"
+            f"Chunk Content:\n{doc.page_content}\n\n"
+            f"Based on the {'summaries' if section_summary else 'global summary'}, "
+            "provide a short, succinct context to situate this chunk within the document. "
+            "Answer only with the succinct context."
+        )
+        
+        questions_prompt = (
+            f"Chunk Content:\n{doc.page_content}\n\n"
+            "What questions could a user ask to find this section? Return only the possible questions."
+        )
+
+        chunk_context_res, questions_res = await asyncio.gather(
+            _invoke(llm, context_prompt, scheduler, kind="context"),
+            _invoke(llm, questions_prompt, scheduler, kind="questions")
+        )
+        
+        chunk_context = chunk_context_res.content
+        questions = questions_res.content
+        
+        enrichment = {"context": chunk_context, "questions": questions}
+        if cache_key:
+            await asyncio.to_thread(cache.put, cache_key, enrichment)
+        return enrichment
+        
     except Exception as e:
-        print(f"Error generating global summary: {e}")
-        return ""
+        # Leave the chunk out of this sync; its file stays unindexed so the
+        # chunk is retried next time instead of being stored unenriched.
+        print(f"Error enriching chunk: {e}")
+        if scheduler:
+            scheduler.dead_letter(doc.metadata.get("source"), doc.metadata.get("chunk_id"), e)
+        return None
 
-async def _enrich_chunk(doc, global_summary, llm, semaphore):
-    if not llm:
-        return doc
+_JSON_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+_JSON_OBJECT_RE = re.compile(r"\{[^{}]*\}", re.DOTALL)
 
-    async with semaphore:
+def _as_enrichment(item):
+    if not isinstance(item, dict):
+        return None
+    context = item.get("context")
+    questions = item.get("questions")
+    if isinstance(questions, list):
+        questions = "\n".join(str(q).strip() for q in questions if str(q).strip())
+    if not isinstance(context, str) or not context.strip() or not isinstance(questions, str) or not questions.strip():
+        return None
+    return {"context": context.strip(), "questions": questions.strip()}
+
+def _parse_batch_enrichments(content, count):
+    # Returns {position: enrichment} for the chunks (numbered 1..count)
+    # whose entries could be read from the model's JSON answer. Tolerates
+    # code fences, text around the JSON, a wrapping object and a broken
+    # array whose individual objects are still valid.
+    content = _JSON_FENCE_RE.sub("", content.strip())
+    items = None
+    start = min((i for i in (content.find("["), content.find("{")) if i >= 0), default=-1)
+    if start >= 0:
+        end = max(content.rfind("]"), content.rfind("}"))
         try:
-            context_prompt = (
-                f"Global Document Summary:\n{global_summary}\n\n"
-                f"Chunk Content:\n{doc.page_content}\n\n"
-                "Based on the global summary, provide a short, succinct context to situate this chunk within the document. "
-                "Answer only with the succinct context."
-            )
-            
-            questions_prompt = (
-                f"Chunk Content:\n{doc.page_content}\n\n"
-                "What questions could a user ask to find this section? Return only the possible questions."
-            )
+            items = json.loads(content[start:end + 1])
+        except ValueError:
+            items = None
+    if isinstance(items, dict) and "context" not in items:
+        items = next((v for v in items.values() if isinstance(v, list)), None)
+    elif isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list):
+        items = []
+        for match in _JSON_OBJECT_RE.finditer(content):
+            try:
+                items.append(json.loads(match.group(0)))
+            except ValueError:
+                continue
 
-            chunk_context_res, questions_res = await asyncio.gather(
-                llm.ainvoke(context_prompt),
-                llm.ainvoke(questions_prompt)
-            )
-            
-            chunk_context = chunk_context_res.content
-            questions = questions_res.content
-            
-            enrichment = f"Context:\n{chunk_context}\n\nPotential Questions:\n{questions}\n\n"
-            return enrichment
-            
-        except Exception as e:
-            print(f"Error enriching chunk: {e}")
-            return ""
-
-async def _split_markdown(text, llm=None, file_path=None):
-  
-    headers_to_split_on = [
-        ("#", "Header 1"),
-        ("##", "Header 2"),
-        ("###", "Header 3"),
-        ("####", "Header 4"),
-        ("#####", "Header 5"),
-        ("######", "Header 6"),
-    ]
-    
-    md_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on)
-    md_splits = md_splitter.split_text(text)
+    results = {}
+    for position, item in enumerate(items, start=1):
+        enrichment = _as_enrichment(item)
+        if enrichment is None:
+            continue
+        try:
+            position = int(item.get("id", position))
+        except (TypeError, ValueError):
+            pass
+        if 1 <= position <= count and position not in results:
+            results[position] = enrichment
+    return results
 
-    char_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=2000,
-        chunk_overlap=200
+# Enriches consecutive chunks that share a section summary with one call that
+# sends the summaries once and returns context and questions for every
+# chunk as JSON; each chunk is tagged with its header path. Paths and text
+# are HTML-escaped so neither can open or close a <chunk> tag and shift the
+# ids answers are matched by. Results are cached under the same keys as
+# _enrich_chunk; chunks missing from a malformed answer fall back to
+# _enrich_chunk.
+# Returns one enrichment (or None on failure) per doc.
+async def _enrich_batch(docs, global_summary, llm, scheduler, cache=None, section_summary="", locations=None):
+    summary_key = f"{global_summary}\x1f{section_summary}" if section_summary else global_summary
+    results = [None] * len(docs)
+    keys = [None] * len(docs)
+    if cache:
+        keys = [EnrichmentCache.make_key("chunk", llm_model_name(llm), doc.page_content, summary_key) for doc in docs]
+        results = await asyncio.to_thread(cache.get_many, keys)
+    todo = [i for i, result in enumerate(results) if result is None]
+    if not todo:
+        return results
+
+    section = f"Section Summary:\n{section_summary}\n\n" if section_summary else ""
+    locations = locations or [""] * len(docs)
+    chunks = "\n".join(
+        f'<chunk id="{n}" location="{html.escape(locations[i], quote=True)}">\n'
+        f'{html.escape(docs[i].page_content, quote=True)}\n</chunk>'
+        for n, i in enumerate(todo, start=1)
     )
-    docs = char_splitter.split_documents(md_splits)
-
-    section_chunks = {}
-    for doc in docs:
-        section_key = tuple((k, v) for k, v in sorted(doc.metadata.items()) if k.startswith("Header"))
-        if section_key not in section_chunks:
-            section_chunks[section_key] = []
-        section_chunks[section_key].append(doc)
-    
+    prompt = (
+        f"Global Document Summary:\n{global_summary}\n\n"
+        f"{section}"
+        f"Chunks:\n{chunks}\n\n"
+        "For each chunk, write a short, succinct context that situates it within the document, "
+        "and the questions a user could ask to find it. "
+        "Answer only with a JSON array containing one object per chunk, in order, like "
+        '[{"id": 1, "context": "...", "questions": ["...", "..."]}].'
+    )
+    parsed = {}
+    try:
+        response = await _invoke(llm, prompt, scheduler, kind="batch")
+        parsed = _parse_batch_enrichments(response.content, len(todo))
+    except Exception as e:
+        print(f"Error enriching chunk batch: {e}")
+
+    fallback = []
+    for n, i in enumerate(todo, start=1):
+        if n in parsed:
+            results[i] = parsed[n]
+            if keys[i]:
+                await asyncio.to_thread(cache.put, keys[i], parsed[n])
+        else:
+            fallback.append(i)
+    if fallback:
+        metrics.incr("enrichment_fallbacks", len(fallback))
+        retried = await asyncio.gather(*(
+            _enrich_chunk(docs[i], global_summary, llm, scheduler, cache, section_summary) for i in fallback
+        ))
+        for i, enrichment in zip(fallback, retried):
+            results[i] = enrichment
+    return results
+
+def _batches(items, limit, max_chars):
+    # Splits (index, key, doc) items into runs of consecutive docs with the
+    # same key (their section summary), each at most `limit` docs and about `max_chars` of text.
+    # Returns the runs as lists of indexes.
+    batches = []
+    size = 0
+    previous = object()
+    for index, key, doc in items:
+        if (not batches or key != previous or len(batches[-1]) >= limit
+                or size + len(doc.page_content) > max_chars):
+            batches.append([])
+            size = 0
+        batches[-1].append(index)
+        size += len(doc.page_content)
+        previous = key
+    return batches
+
+# Turns a file's (header_path, doc) chunks into indexable docs: assigns
+# chunk ids and scope fields, drops chunks too short to be useful, and
+# enriches the ones not in `existing_ids`.
+async def _enrich_chunks(chunks, llm=None, file_path=None, existing_ids=None, cache=None, scheduler=None,
+                         enrich_batch=None, subtree=None):
+    docs = [doc for _, doc in chunks]
+    existing_ids = existing_ids or set()
+    seen_ids = {}
+    chunk_ids = []
+    for header_path, doc in chunks:
+        chunk_ids.append(_assign_chunk_id(doc, file_path, header_path, seen_ids, subtree))
+
+    needs_enrichment = any(
+        cid not in existing_ids
+        for doc, cid in zip(docs, chunk_ids)
+        if len(doc.page_content.strip()) >= 50
+    )
+
+    # A document longer than one summary call can see is summarized
+    # section by section, and each chunk is situated against its section.
     global_summary = ""
-    if llm:
+    section_summaries = {}
+    long_document = sum(len(doc.page_content) for doc in docs) > SUMMARY_CHARS
+    if llm and needs_enrichment:
         print("Generating global document summary...")
-        global_summary = await _generate_global_summary(text, llm)
+        try:
+            if long_document:
+                global_summary, section_summaries = await _generate_hierarchical_summary(
+                    chunks, llm, cache, scheduler
+                )
+            else:
+                # Only the head of the file is summarized.
+                text = await asyncio.to_thread(_read_text, file_path, SUMMARY_CHARS)
+                global_summary = await _generate_global_summary(text, llm, cache, scheduler)
+        except Exception as e:
+            scheduler.dead_letter(file_path, None, e)
+            raise RuntimeError(f"Global summary failed: {e}") from e
         print("Global summary generated.")
 
-    tasks = []
+    return await _enrich_docs(
+        chunks, global_summary, section_summaries, llm, file_path, existing_ids, cache, scheduler, enrich_batch
+    )
+
+# Enriches the (header_path, doc) chunks that already carry their ids,
+# given the document summary and {chunk_id: section summary}; chunks too
+# short to be useful are dropped.
+async def _enrich_docs(chunks, global_summary, section_summaries, llm, file_path, existing_ids, cache, scheduler,
+                       enrich_batch):
+    pending = []
     processed_docs = []
-    
-    semaphore = asyncio.Semaphore(5)
 
-    for doc in docs:
+    for header_path, doc in chunks:
         if len(doc.page_content.strip()) < 50:
             continue
-            
-        section_key = tuple((k, v) for k, v in sorted(doc.metadata.items()) if k.startswith("Header"))
-        chunks_in_section = section_chunks[section_key]
-        
-        location_parts = []
-        if file_path:
-            location_parts.append(file_path)
-        
-        for header_name in ["Header 1", "Header 2", "Header 3", "Header 4", "Header 5", "Header 6"]:
-            if header_name in doc.metadata:
-                location_parts.append(doc.metadata[header_name])
-        
-        structural_context = ""
-        if location_parts:
-            breadcrumb = " / ".join(location_parts)
-            structural_context += f"Location: {breadcrumb}\n\n"
-        
-        if len(chunks_in_section) > 1:
-            chunk_index = chunks_in_section.index(doc) + 1
-            total_chunks = len(chunks_in_section)
-            structural_context += f"[Section split: Part {chunk_index} of {total_chunks}]\n\n"
-        
+
+        breadcrumb = " / ".join(p for p in (file_path, header_path) if p)
+        structural_context = f"Location: {breadcrumb}\n\n" if breadcrumb else ""
+        if "parts" in doc.metadata:
+            structural_context += f"[Section split: Part {doc.metadata['part']} of {doc.metadata['parts']}]\n\n"
+
         doc.metadata["original_content"] = doc.page_content
         
-        if llm:
-            tasks.append(_enrich_chunk(doc, global_summary, llm, semaphore))
-        else:
-            tasks.append(asyncio.sleep(0))
-            
+        if llm and doc.metadata["chunk_id"] not in existing_ids:
+            pending.append((len(processed_docs), header_path, doc))
+
         processed_docs.append((doc, structural_context))
 
-    if llm and tasks:
-        print(f"Enriching {len(tasks)} chunks in parallel (max 5 concurrent)...")
-        enrichment_results = await asyncio.gather(*tasks)
-    else:
-        enrichment_results = [""] * len(processed_docs)
+    enrichment_results = [{}] * len(processed_docs)
+    if pending and enrich_batch:
+        batches = _batches(
+            [(i, section_summaries.get(doc.metadata["chunk_id"], ""), doc) for i, _, doc in pending],
+            enrich_batch, BATCH_CHARS
+        )
+        location_of = {i: header_path for i, header_path, _ in pending}
+        print(f"Enriching {len(pending)} chunks in {len(batches)} batched calls...")
+        results = await asyncio.gather(*(
+            _enrich_batch(
+                [processed_docs[i][0] for i in batch], global_summary, llm, scheduler, cache,
+                section_summaries.get(processed_docs[batch[0]][0].metadata["chunk_id"], ""),
+                [location_of[i] for i in batch]
+            )
+            for batch in batches
+        ))
+        for batch, batch_results in zip(batches, results):
+            for i, result in zip(batch, batch_results):
+                enrichment_results[i] = result
+    elif pending:
+        print(f"Enriching {len(pending)} chunks in parallel...")
+        results = await asyncio.gather(*(
+            _enrich_chunk(doc, global_summary, llm, scheduler, cache, section_summaries.get(doc.metadata["chunk_id"], ""))
+            for _, _, doc in pending
+        ))
+        for (i, _, _), result in zip(pending, results):
+            enrichment_results[i] = result
 
+    # The enrichment is kept out of page_content: the indexer embeds the
+    # situating context and the questions as separate vectors of the chunk.
     final_docs = []
     for (doc, structural_context), enrichment in zip(processed_docs, enrichment_results):
-        full_header = structural_context + enrichment
-        if full_header:
-            doc.page_content = f"{full_header}---CONTENT---\n\n{doc.page_content}"
+        if enrichment is None:
+            continue
+        if enrichment:
+            doc.metadata["situating_context"] = enrichment["context"]
+            doc.metadata["questions"] = enrichment["questions"]
+        doc.page_content = structural_context + doc.page_content
         final_docs.append(doc)
             
     return final_docs
 
-def _split_text(text):
-    char_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        separators=["\n\n", "\n", " ", ""] 
-    )
-    return char_splitter.create_documents([text])
\ No newline at end of file
+def _take(records, n):
+    return list(itertools.islice(records, n))
+
+async def _read_batches(records, n=STREAM_BATCH_CHUNKS):
+    # Reads a record generator (holding an open file) n records at a time
+    # in a thread, and closes it when done.
+    try:
+        while True:
+            batch = await asyncio.to_thread(_take, records, n)
+            if not batch:
+                return
+            yield batch
+    finally:
+        records.close()
+
+def _scan_stream(file_path, existing_ids):
+    # First pass over a streamed file. Keeps each chunk's small metadata
+    # dict (headers, part and parts), never its text.
+    seen_ids = {}
+    metadatas = []
+    needs_enrichment = False
+    size = 0
+    for header_path, text, metadata in iter_markdown_records(file_path):
+        chunk_id = _unique_chunk_id(file_path, header_path, text, seen_ids)
+        metadatas.append(metadata)
+        if chunk_id not in existing_ids and len(text.strip()) >= 50:
+            needs_enrichment = True
+        size += len(text)
+    return metadatas, needs_enrichment, size
+
+# The section summaries of _generate_hierarchical_summary, from a second
+# pass over a streamed file: each section is packed into windows as it is
+# read, and at most STREAM_WINDOWS windows wait for the LLM at a time. The
+# windows, and so the cached summaries, are the ones _pack would produce.
+async def _stream_section_summaries(file_path, titles, section_of, llm, cache, scheduler):
+    slots = asyncio.Semaphore(STREAM_WINDOWS)
+    windows = [[] for _ in titles]
+
+    async def summarize(section, text):
+        try:
+            return await _summarize_section(titles[section], [text], llm, cache, scheduler)
+        finally:
+            slots.release()
+
+    async def submit(section, texts):
+        await slots.acquire()
+        windows[section].append(asyncio.create_task(summarize(section, "\n\n".join(texts))))
+
+    async def finish(section):
+        partials = await asyncio.gather(*windows[section])
+        if len(partials) == 1:
+            return partials[0]
+        return await _reduce_summaries(partials, llm, cache, scheduler, titles[section])
+
+    try:
+        position = 0
+        section, texts, size = 0, [], 0
+        async for batch in _read_batches(iter_markdown_records(file_path)):
+            for header_path, text, _ in batch:
+                if section_of[position] != section:
+                    await submit(section, texts)
+                    section, texts, size = section_of[position], [], 0
+                position += 1
+                piece = f"{header_path}\n{text}" if header_path else text
+                if texts and size + len(piece) > SECTION_CHARS:
+                    await submit(section, texts)
+                    texts, size = [], 0
+                texts.append(piece)
+                size += len(piece) + 2
+        if texts:
+            await submit(section, texts)
+        return await asyncio.gather(*(finish(section) for section in range(len(titles))))
+    except BaseException:
+        for task in itertools.chain.from_iterable(windows):
+            task.cancel()
+        raise
+
+# A streamed markdown file (see loaders.streams) is read three times so
+# that no pass holds more than a batch of its text: once for the chunk ids
+# and section structure, once for the section summaries (only when some
+# chunk needs enriching), and once to enrich the chunks and yield them
+# STREAM_BATCH_CHUNKS at a time. Ids, summaries and enrichments are the
+# same as the in-memory path would produce for these chunks.
+async def _stream_document(file_path, llm, existing_ids, cache, scheduler, enrich_batch, subtree):
+    existing_ids = existing_ids or set()
+    with metrics.span("split", format="md"):
+        metadatas, needs_enrichment, size = await asyncio.to_thread(
+            _scan_stream, file_path, existing_ids
+        )
+
+    level = _section_level(metadatas)
+    titles = []
+    section_of = []
+    previous = object()
+    for metadata in metadatas:
+        value = metadata.get(level) if level else None
+        if value != previous:
+            titles.append(value or "Introduction")
+            previous = value
+        section_of.append(len(titles) - 1)
+
+    global_summary = ""
+    section_summaries = None
+    if llm and needs_enrichment:
+        print("Generating global document summary...")
+        try:
+            if size > SUMMARY_CHARS:
+                summaries = await _stream_section_summaries(file_path, titles, section_of, llm, cache, scheduler)
+                if len(summaries) == 1:
+                    global_summary = summaries[0]
+                else:
+                    titled = [f"## {title}\n{summary}" for title, summary in zip(titles, summaries)]
+                    global_summary = await _reduce_summaries(titled, llm, cache, scheduler)
+                    section_summaries = summaries
+            else:
+                text = await asyncio.to_thread(_read_text, file_path, SUMMARY_CHARS)
+                global_summary = await _generate_global_summary(text, llm, cache, scheduler)
+        except Exception as e:
+            scheduler.dead_letter(file_path, None, e)
+            raise RuntimeError(f"Global summary failed: {e}") from e
+        print("Global summary generated.")
+
+    position = 0
+    seen_ids = {}
+    async for batch in _read_batches(iter_markdown_records(file_path)):
+        chunks = []
+        by_chunk = {}
+        for header_path, text, _ in batch:
+            # Only the first pass saw every section end, so its metadata
+            # has the final part counts.
+            doc = Document(page_content=text, metadata=dict(metadatas[position]))
+            chunk_id = _assign_chunk_id(doc, file_path, header_path, seen_ids, subtree)
+            if section_summaries:
+                by_chunk[chunk_id] = section_summaries[section_of[position]]
+            chunks.append((header_path, doc))
+            position += 1
+        yield await _enrich_docs(
+            chunks, global_summary, by_chunk, llm, file_path, existing_ids, cache, scheduler, enrich_batch
+        )
@@ -0,0 +1,352 @@
+import os
+import json
+import threading
+import functools
+
+import numpy as np
+
+MODES = ("int8", "binary")
+SCAN_BLOCK = 2048
+# Most rows the int8 scale is estimated from.
+CALIBRATION_ROWS = 20000
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+def truncate(vectors, dims):
+    # Matryoshka embeddings (nomic-embed-text-v1.5) keep most of their
+    # quality when cut to a prefix of their dimensions and re-normalized.
+    return _normalize(np.asarray(vectors, dtype=np.float32)[..., :dims])
+
+# Dense index for a two-pass search: a first pass over Matryoshka-truncated,
+# quantized codes (int8, or 1 bit per dimension for "binary") picks
+# `rescore` * k candidates, which are then rescored with their full-precision
+# vectors. Codes and full vectors are saved as .npy files and memory-mapped
+# on load, so only the compact codes are scanned per query and the full
+# vectors are paged in for the few rows being rescored. Additions are kept
+# in a pending segment and removals are tombstones until merge(). The int8
+# scale is recomputed from all stored vectors at every merge and whenever
+# the index has doubled since it was last calibrated, so it never rests on
+# the first small batch that happened to arrive.
+class QuantizedIndex:
+    def __init__(self, path=None, dims=256, mode="int8", rescore=10, merge_threshold=5000):
+        if mode not in MODES:
+            raise ValueError(f"Unknown quantization mode {mode!r}; expected one of {MODES}.")
+        self.path = path
+        self.dims = dims
+        self.mode = mode
+        self.rescore = rescore
+        self.merge_threshold = merge_threshold
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.ids = []
+        self.codes = None
+        self.full = None
+        self.alive = np.zeros(0, dtype=bool)
+        self.scale = None
+        self.calibrated_rows = 0
+
+        self.pending_ids = []
+        self.pending_alive = []
+        self.pending_codes = []
+        self.pending_full = []
+
+        self.locations = {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, persist_dir, **kwargs):
+        index = cls(os.path.join(persist_dir, "dense"), **kwargs)
+        meta_file = index.path + ".json"
+        if not os.path.exists(meta_file):
+            return index
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+            if meta["mode"] != index.mode or meta["dims"] != index.dims:
+                print(f"Dense index was built as {meta['mode']}/{meta['dims']}d. Rebuilding.")
+                return cls(index.path, **kwargs)
+            index.ids = meta["ids"]
+            index.scale = meta["scale"]
+            # Indexes saved before recalibration existed have no count.
+            index.calibrated_rows = meta.get("calibrated_rows", 0)
+            if index.ids:
+                index.codes = np.load(index.path + ".codes.npy", mmap_mode="r")
+                index.full = np.load(index.path + ".full.npy", mmap_mode="r")
+        except Exception as e:
+            print(f"Could not load dense index ({e}). Rebuilding.")
+            return cls(index.path, **kwargs)
+
+        index.alive = np.ones(len(index.ids), dtype=bool)
+        index.locations = {vector_id: ("main", i) for i, vector_id in enumerate(index.ids)}
+        if index.mode == "int8" and len(index.ids) >= 2 * index.calibrated_rows:
+            index.recalibrate()
+        return index
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, vector_id):
+        return vector_id in self.locations
+
+    def nbytes(self):
+        # Bytes scanned by the first pass.
+        return (0 if self.codes is None else self.codes.nbytes) + sum(c.nbytes for c in self.pending_codes)
+
+    @_locked
+    def vector_ids(self):
+        return set(self.locations)
+
+    @_locked
+    def vectors(self, vector_ids):
+        # Normalized full-precision vectors by id, for the ids present.
+        found = {}
+        for vector_id in vector_ids:
+            location = self.locations.get(vector_id)
+            if location is None:
+                continue
+            segment, i = location
+            if segment == "main":
+                found[vector_id] = np.asarray(self.full[i])
+            else:
+                found[vector_id] = self._pending_vector(i)
+        return found
+
+    def _pending_vector(self, i):
+        for block in self.pending_full:
+            if i < len(block):
+                return block[i]
+            i -= len(block)
+
+    def _calibrate(self, truncated):
+        # Scale each dimension so that nearly all of its values fit in int8;
+        # Matryoshka dimensions differ a lot in magnitude. An evenly spaced
+        # sample of the rows estimates the quantile well enough.
+        sample = truncated[::max(1, len(truncated) // CALIBRATION_ROWS)]
+        limits = np.quantile(np.abs(sample), 0.999, axis=0)
+        self.scale = (127.0 / np.maximum(limits, 1e-6)).astype(np.float32).tolist()
+        self.calibrated_rows = len(truncated)
+
+    def _quantize(self, truncated):
+        return np.clip(np.rint(truncated * np.asarray(self.scale, dtype=np.float32)), -127, 127).astype(np.int8)
+
+    def _encode(self, vectors):
+        truncated = truncate(vectors, self.dims)
+        if self.mode == "binary":
+            return np.packbits(truncated > 0, axis=-1)
+        if self.scale is None:
+            self._calibrate(truncated)
+        return self._quantize(truncated)
+
+    @_locked
+    def recalibrate(self):
+        # Recomputes the int8 scale from every live vector and re-encodes
+        # all codes with it.
+        if self.mode != "int8":
+            return
+        live = []
+        if self.full is not None:
+            live.append(np.asarray(self.full)[self.alive])
+        if self.pending_full:
+            live.append(np.concatenate(self.pending_full)[np.array(self.pending_alive, dtype=bool)])
+        live = np.concatenate(live) if live else np.zeros((0, 0), dtype=np.float32)
+        if not len(live):
+            return
+        self._calibrate(truncate(live, self.dims))
+        if self.full is not None:
+            self.codes = self._quantize(truncate(self.full, self.dims))
+        self.pending_codes = [self._quantize(truncate(block, self.dims)) for block in self.pending_full]
+        self.dirty = True
+
+    @_locked
+    def add(self, vector_ids, vectors):
+        if not len(vector_ids):
+            return
+        for vector_id in vector_ids:
+            if vector_id in self.locations:
+                self.remove(vector_id)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        start = len(self.pending_ids)
+        self.pending_codes.append(self._encode(vectors))
+        self.pending_full.append(_normalize(vectors))
+        for offset, vector_id in enumerate(vector_ids):
+            self.pending_ids.append(vector_id)
+            self.pending_alive.append(True)
+            self.locations[vector_id] = ("pending", start + offset)
+        self.dirty = True
+
+        if len(self.pending_ids) >= max(self.merge_threshold, len(self.ids) // 4):
+            self.merge()
+        elif self.mode == "int8" and len(self.locations) >= 2 * self.calibrated_rows:
+            self.recalibrate()
+
+    @_locked
+    def remove(self, vector_id):
+        location = self.locations.pop(vector_id, None)
+        if location is None:
+            return
+        segment, i = location
+        if segment == "main":
+            self.alive[i] = False
+        else:
+            self.pending_alive[i] = False
+        self.dirty = True
+
+    @_locked
+    def clear(self):
+        self._reset()
+        self.dirty = True
+
+    @_locked
+    def merge(self):
+        if not self.pending_ids and self.alive.all():
+            return
+        # int8 codes are re-encoded below with a fresh scale.
+        binary = self.mode == "binary"
+        codes, full, ids = [], [], []
+        if self.codes is not None:
+            if binary:
+                codes.append(np.asarray(self.codes[self.alive]))
+            full.append(np.asarray(self.full[self.alive]))
+            ids.extend(v for v, a in zip(self.ids, self.alive) if a)
+        if self.pending_ids:
+            keep = np.array(self.pending_alive, dtype=bool)
+            if binary:
+                codes.append(np.concatenate(self.pending_codes)[keep])
+            full.append(np.concatenate(self.pending_full)[keep])
+            ids.extend(v for v, a in zip(self.pending_ids, self.pending_alive) if a)
+
+        self.ids = ids
+        self.full = np.concatenate(full) if ids else None
+        if binary or not ids:
+            self.codes = np.concatenate(codes) if ids else None
+        else:
+            truncated = truncate(self.full, self.dims)
+            self._calibrate(truncated)
+            self.codes = self._quantize(truncated)
+        self.alive = np.ones(len(ids), dtype=bool)
+        self.locations = {vector_id: ("main", i) for i, vector_id in enumerate(ids)}
+        self.pending_ids = []
+        self.pending_alive = []
+        self.pending_codes = []
+        self.pending_full = []
+
+    @_locked
+    def save(self):
+        if not self.dirty or not self.path:
+            return
+        self.merge()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.ids:
+            for name, array in (("codes", self.codes), ("full", self.full)):
+                tmp_file = f"{self.path}.{name}.tmp.npy"
+                np.save(tmp_file, array)
+                os.replace(tmp_file, f"{self.path}.{name}.npy")
+        tmp_meta = self.path + ".tmp.json"
+        with open(tmp_meta, "w") as f:
+            json.dump({
+                "mode": self.mode, "dims": self.dims, "scale": self.scale, "calibrated_rows": self.calibrated_rows,
+                "ids": self.ids
+            }, f)
+        os.replace(tmp_meta, self.path + ".json")
+        # Swap the in-memory copies for memory maps of what was just written.
+        if self.ids:
+            self.codes = np.load(self.path + ".codes.npy", mmap_mode="r")
+            self.full = np.load(self.path + ".full.npy", mmap_mode="r")
+        self.dirty = False
+
+    def _first_pass(self, codes, query):
+        if self.mode == "binary":
+            # Hamming distance, turned into a similarity.
+            if hasattr(np, "bitwise_count") and codes.shape[1] % 8 == 0:
+                words = np.asarray(codes).view(np.uint64)
+                hamming = np.bitwise_count(np.bitwise_xor(words, query.view(np.uint64))).sum(axis=1, dtype=np.int32)
+            else:
+                hamming = _POPCOUNT[np.bitwise_xor(codes, query)].sum(axis=1, dtype=np.int32)
+            return -hamming.astype(np.float32)
+
+        # int8 codes are widened in small cache-sized blocks into one reused
+        # buffer, which is much cheaper than converting the whole matrix.
+        scores = np.empty(len(codes), dtype=np.float32)
+        buffer = np.empty((min(SCAN_BLOCK, len(codes)), codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_BLOCK):
+            block = codes[start:start + SCAN_BLOCK]
+            widened = buffer[:len(block)]
+            np.copyto(widened, block, casting="unsafe")
+            np.dot(widened, query, out=scores[start:start + len(block)])
+        return scores
+
+    def _allowed_segments(self, allowed):
+        # Only the rows of `allowed` ids, so a scoped query scans a fraction
+        # of the codes instead of masking the full matrix.
+        main_rows, pending_rows = [], []
+        for vector_id in allowed:
+            location = self.locations.get(vector_id)
+            if location is not None:
+                (main_rows if location[0] == "main" else pending_rows).append(location[1])
+        segments = []
+        if main_rows:
+            rows = np.array(sorted(main_rows))
+            segments.append((self.codes[rows], self.full[rows], [self.ids[i] for i in rows],
+                             np.ones(len(rows), dtype=bool)))
+        if pending_rows:
+            rows = np.array(sorted(pending_rows))
+            segments.append((np.concatenate(self.pending_codes)[rows], np.concatenate(self.pending_full)[rows],
+                             [self.pending_ids[i] for i in rows], np.ones(len(rows), dtype=bool)))
+        return segments
+
+    @_locked
+    def search(self, vector, k=20, allowed=None):
+        # `allowed`, a collection of vector ids, restricts the search to them.
+        segments = []
+        if allowed is not None:
+            segments = self._allowed_segments(allowed)
+        else:
+            if self.codes is not None:
+                segments.append((self.codes, self.full, self.ids, self.alive))
+            if self.pending_ids:
+                segments.append((
+                    np.concatenate(self.pending_codes),
+                    np.concatenate(self.pending_full),
+                    self.pending_ids,
+                    np.array(self.pending_alive, dtype=bool)
+                ))
+        if not segments:
+            return []
+
+        query_full = _normalize(vector)
+        if self.mode == "binary":
+            query = np.packbits(truncate(query_full, self.dims) > 0)
+        else:
+            # Undo the per-dimension scaling of the codes in the query.
+            query = truncate(query_full, self.dims) / np.asarray(self.scale, dtype=np.float32)
+
+        candidates = []
+        n_candidates = k * self.rescore
+        for codes, full, ids, alive in segments:
+            scores = self._first_pass(codes, query)
+            scores[~alive] = -np.inf
+            n = min(n_candidates, int(alive.sum()))
+            if n == 0:
+                continue
+            top = np.argpartition(-scores, n - 1)[:n] if n < len(scores) else np.arange(len(scores))
+            top = top[np.isfinite(scores[top])]
+            top.sort()
+            rescored = np.asarray(full[top]) @ query_full
+            candidates.extend(zip(rescored.tolist(), (ids[i] for i in top)))
+
+        candidates.sort(key=lambda c: -c[0])
+        return [(vector_id, score) for score, vector_id in candidates[:k]]
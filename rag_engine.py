@@ -1,169 +1,885 @@
 import os
 import sys
+import time
 import asyncio
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
-from langchain_ollama import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough, RunnableParallel
+from langchain_core.runnables import RunnablePassthrough, RunnableParallel, RunnableLambda
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.output_parsers import StrOutputParser
 
-from preprocess import process_document
+from preprocess import process_document, iter_document
+from loaders import ParsePool
+from enrichment_cache import EnrichmentCache
+from indexer import IndexManifest, StreamingIndexer, CHILD_VECTORS, child_id, parent_id, vector_ids
+from llm_scheduler import LLMScheduler
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from quantized_index import QuantizedIndex
+from answer_cache import AnswerCache
+from reranker import ScoreCache, create_reranker, mmr, rerank
+from scope import SCOPE_FIELDS, normalize_scope, scope_filter, scope_key
+from sharded_store import ShardedVectorStore, SHARDS_FILE
+from embedding_cache import EMBEDDING_MODEL, EmbeddingCache, CachedEmbeddings, cache_namespace
+from embedding_workers import EmbeddingPool, create_embeddings
+from context_builder import build_context
+from source_scanner import SourceScanner, parse_globs, DEFAULT_INCLUDE, DEFAULT_EXCLUDE
+from metrics import metrics, log_to
 
 load_dotenv()
 
-from langchain_google_genai import ChatGoogleGenerativeAI
+# Defers loading the embedding model until a vector is actually needed, so
+# the vector store can be opened without paying for the model up front.
+class _LazyEmbeddings(Embeddings):
+    def __init__(self, load):
+        self._load = load
+
+    def embed_documents(self, texts):
+        return self._load().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self._load().embed_query(text)
 
 class MdRag:
-    def __init__(self, source_dir="llm_sources", temperature=0.5, persist_dir="./chroma_db"):
+    def __init__(self, source_dir="llm_sources", temperature=0.5, persist_dir="./chroma_db", max_concurrency=None,
+                 k=5, fetch_k=20, background_sync=False, extra_source_dirs=None, include=None, exclude=None,
+                 vector_mode=None, llm=None, embeddings=None, vectorstore=None, reranker=None, shard_by_subtree=None):
 
         self.source_dir = source_dir
+        if extra_source_dirs is None:
+            extra_source_dirs = [d for d in os.getenv("SOURCE_DIRS", "").split(os.pathsep) if d]
+        self.scanner = SourceScanner(
+            [source_dir] + list(extra_source_dirs),
+            include=include or parse_globs(os.getenv("SOURCE_INCLUDE"), DEFAULT_INCLUDE),
+            exclude=exclude or parse_globs(os.getenv("SOURCE_EXCLUDE"), DEFAULT_EXCLUDE)
+        )
         self.temperature = temperature
         self.persist_dir = persist_dir
+        self.k = k
+        self.fetch_k = max(fetch_k, k)
         
-        self.vectorstore = None
-        self.chain = None
-        
-        api_key = os.getenv("GOOGLE_API_KEY")
-        
-        if api_key:
-            model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
-            print(f"Using Gemini Model: {model_name}")
-            self.llm = ChatGoogleGenerativeAI(
-                model=model_name,
-                temperature=self.temperature,
-                google_api_key=api_key
-            )
+        # Heavy components (LLM client, embedding model, vector store) are
+        # created on first use and then kept for the life of the instance,
+        # across any number of syncs. Passing them in skips that, e.g. to run
+        # against stand-ins offline.
+        self._llm = llm
+        self._embeddings = embeddings
+        self._ingest_embeddings = None
+        self._vectorstore = vectorstore
+        self._owns_vectorstore = vectorstore is None
+        self._chain = None
+        self._components_lock = threading.RLock()
+
+        self.provider = "gemini" if os.getenv("GOOGLE_API_KEY") else "ollama"
+        if self.provider == "gemini":
+            default_concurrency = os.getenv("GEMINI_MAX_CONCURRENCY", "16")
         else:
-            model_name = os.getenv("OLLAMA_MODEL", "gemma3:4b")
-            base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-            print(f"Using Ollama Model: {model_name} at {base_url}")
-            self.llm = ChatOllama(
-                model=model_name,
-                temperature=self.temperature,
-                base_url=base_url
+            default_concurrency = os.getenv("OLLAMA_MAX_CONCURRENCY", "4")
+
+        # One budget shared by every summary and enrichment call in a sync.
+        self.max_concurrency = max_concurrency or int(default_concurrency)
+        self.requests_per_minute = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")) or None
+        self.tokens_per_minute = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0")) or None
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "4"))
+        # Chunks enriched per JSON call; 0 makes two calls per chunk.
+        self.enrich_batch_size = int(os.getenv("ENRICH_BATCH_SIZE", "0")) or None
+
+        self.embed_batch_size = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+        # Extra processes used to embed chunks during a sync; 0 embeds in
+        # this process. Queries always use the in-process model.
+        self.embed_workers = int(os.getenv("EMBED_WORKERS", "0"))
+        self.embed_threads_per_worker = int(os.getenv("EMBED_THREADS_PER_WORKER", "0")) or None
+        # Processes that split large source files during a sync (see
+        # loaders.py); 0 splits them in a thread of this process.
+        self.parse_workers = int(os.getenv("PARSE_WORKERS", str(min(4, (os.cpu_count() or 1) - 1))))
+        self.parse_pool = ParsePool(workers=self.parse_workers)
+        self.embedding_cache = EmbeddingCache(os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings"))
+        # Prefix of the cache keys; by default derived from the embeddings
+        # in use (see embedding_cache.cache_namespace).
+        self.embedding_namespace = os.getenv("EMBEDDING_CACHE_NAMESPACE") or None
+        self.context_tokens = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+        self.lexical_index = BM25Index.load(self.persist_dir)
+
+        # "chroma" searches Chroma's full-precision vectors. "int8" and
+        # "binary" search a truncated, quantized copy and rescore the best
+        # candidates at full precision (see quantized_index.py).
+        self.vector_mode = vector_mode or os.getenv("VECTOR_STORE_MODE", "chroma")
+        self.dense_index = None
+        if self.vector_mode != "chroma":
+            self.dense_index = QuantizedIndex.load(
+                self.persist_dir,
+                dims=int(os.getenv("EMBED_DIMS", "256")),
+                mode=self.vector_mode,
+                rescore=int(os.getenv("RESCORE_FACTOR", "10"))
             )
-        
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="nomic-ai/nomic-embed-text-v1.5",
-            model_kwargs={
-                'device': 'cpu', 
-                'trust_remote_code': True
-            }
+
+        # Second retrieval stage (see reranker.py). The fused top fetch_k are
+        # reordered by MMR over their stored vectors (MMR_LAMBDA; 1 keeps the
+        # fused order), then the first RERANK_TOP are rescored by the
+        # reranker, if any, and the top k are kept. All of it runs within
+        # RETRIEVAL_BUDGET_MS of the query starting (0: no limit); whatever
+        # the budget cuts short falls back to the order before it.
+        self.mmr_lambda = float(os.getenv("MMR_LAMBDA", "0.7"))
+        self.reranker = reranker or create_reranker(os.getenv("RERANKER", ""))
+        self.rerank_top = int(os.getenv("RERANK_TOP", "0")) or 2 * self.k
+        self.rerank_cache = ScoreCache(max_entries=int(os.getenv("RERANK_CACHE_MAX_ENTRIES", "50000")))
+        self.retrieval_budget = float(os.getenv("RETRIEVAL_BUDGET_MS", "0")) / 1000
+
+        # With SHARD_BY_SUBTREE, each top-level source directory gets its own
+        # Chroma collection, so queries scoped to a subtree search only its
+        # vectors. Scopes are resolved to the matching ids once and reused
+        # until the index changes.
+        if shard_by_subtree is None:
+            shard_by_subtree = os.getenv("SHARD_BY_SUBTREE", "").lower() in ("1", "true", "yes")
+        self.shard_by_subtree = shard_by_subtree
+        self._scope_cache = {}
+        self._scope_lock = threading.Lock()
+
+        self.answer_cache = AnswerCache(
+            path=os.getenv("ANSWER_CACHE_PATH", "cache/answers.sqlite"),
+            threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+            ttl=float(os.getenv("ANSWER_CACHE_TTL", "86400")),
+            max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
         )
-        
-        if os.path.exists(self.persist_dir) and os.listdir(self.persist_dir):
-            print(f"Loading existing vector database from {self.persist_dir}...")
-            self.vectorstore = Chroma(
-                persist_directory=self.persist_dir,
-                embedding_function=self.embeddings
+
+        self.enrichment_cache = EnrichmentCache(
+            path=os.getenv("ENRICHMENT_CACHE_PATH", "cache/enrichment.sqlite"),
+            max_entries=int(os.getenv("ENRICHMENT_CACHE_MAX_ENTRIES", "200000"))
+        )
+
+        # Stage timings and counters (see metrics.py). METRICS_LOG appends
+        # every update as a JSON line to that file, or to stdout for "-".
+        self.metrics = metrics
+        if os.getenv("METRICS_LOG"):
+            log_to(os.getenv("METRICS_LOG"))
+
+        self.sync_status = {"running": False, "phase": "idle", "files_total": 0, "files_done": 0,
+                            "chunks_indexed": 0, "error": None, "finished_at": None}
+        self._sync_lock = threading.Lock()
+        self._sync_thread = None
+
+        if background_sync:
+            self.start_sync()
+        else:
+            self.sync()
+
+    @property
+    def llm(self):
+        with self._components_lock:
+            if self._llm is None:
+                if self.provider == "gemini":
+                    from langchain_google_genai import ChatGoogleGenerativeAI
+                    model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
+                    print(f"Using Gemini Model: {model_name}")
+                    self._llm = ChatGoogleGenerativeAI(
+                        model=model_name,
+                        temperature=self.temperature,
+                        google_api_key=os.getenv("GOOGLE_API_KEY")
+                    )
+                else:
+                    from langchain_ollama import ChatOllama
+                    model_name = os.getenv("OLLAMA_MODEL", "gemma3:4b")
+                    base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+                    print(f"Using Ollama Model: {model_name} at {base_url}")
+                    self._llm = ChatOllama(
+                        model=model_name,
+                        temperature=self.temperature,
+                        base_url=base_url
+                    )
+            return self._llm
+
+    @property
+    def embeddings(self):
+        with self._components_lock:
+            if self._embeddings is None:
+                print("Loading embedding model...")
+                self._embeddings = create_embeddings()
+            return self._embeddings
+
+    @property
+    def ingest_embeddings(self):
+        # Chunk embeddings go through the content-hash cache first, so
+        # unchanged or repeated text is never embedded twice.
+        with self._components_lock:
+            if self._ingest_embeddings is None:
+                base = self.embeddings if not self.embed_workers else EmbeddingPool(
+                    lambda: self.embeddings,
+                    workers=self.embed_workers,
+                    threads_per_worker=self.embed_threads_per_worker
+                )
+                # The default model is named without loading it here.
+                namespace = self.embedding_namespace or (
+                    cache_namespace(self._embeddings) if self._embeddings is not None else EMBEDDING_MODEL
+                )
+                self._ingest_embeddings = CachedEmbeddings(base, self.embedding_cache, namespace)
+            return self._ingest_embeddings
+
+    @property
+    def vectorstore(self):
+        with self._components_lock:
+            if self._vectorstore is None:
+                if os.path.exists(self.persist_dir) and os.listdir(self.persist_dir):
+                    print(f"Loading existing vector database from {self.persist_dir}...")
+                self._vectorstore = self._open_vectorstore(self.shard_by_subtree)
+            return self._vectorstore
+
+    def _open_vectorstore(self, sharded):
+        from langchain_chroma import Chroma
+        embedding_function = _LazyEmbeddings(lambda: self.embeddings)
+        if not sharded:
+            return Chroma(persist_directory=self.persist_dir, embedding_function=embedding_function)
+        return ShardedVectorStore(
+            lambda name: Chroma(collection_name=name, persist_directory=self.persist_dir,
+                                embedding_function=embedding_function),
+            persist_dir=self.persist_dir
+        )
+
+    @property
+    def chain(self):
+        with self._components_lock:
+            if self._chain is None:
+                self._build_chain()
+            return self._chain
+
+    def sync(self, changed=None, renamed=None):
+        # `changed` limits the sync to these source-relative paths (deleted
+        # ones are purged) instead of scanning everything; `renamed` is a list
+        # of (old, new) paths whose vectors are re-keyed rather than rebuilt.
+        with self._sync_lock:
+            self.sync_status.update(running=True, phase="scanning", files_total=0, files_done=0,
+                                    chunks_indexed=0, error=None)
+            try:
+                with self.metrics.span("sync"):
+                    self._ingest_and_index(changed, renamed)
+            except Exception as e:
+                self.sync_status["error"] = str(e)
+                raise
+            finally:
+                if self._ingest_embeddings is not None and isinstance(self._ingest_embeddings.embeddings, EmbeddingPool):
+                    # Free the workers' model copies between syncs.
+                    self._ingest_embeddings.embeddings.close()
+                self.parse_pool.close()
+                self.enrichment_cache.flush()
+                self.sync_status.update(running=False, phase="idle", finished_at=time.time())
+
+    def start_sync(self):
+        # Runs a sync in a background thread while queries keep being served
+        # from the current index. Returns False if a sync is already running.
+        if self._sync_thread is not None and self._sync_thread.is_alive():
+            return False
+
+        def run():
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Background sync failed: {e}")
+            # Warm the embedding model so the first query does not pay for it.
+            self.embeddings
+
+        self._sync_thread = threading.Thread(target=run, name="mdrag-sync", daemon=True)
+        self._sync_thread.start()
+        return True
+
+    def is_syncing(self):
+        return self.sync_status["running"]
+
+    @classmethod
+    async def acreate(cls, **kwargs):
+        # Construction loads models and runs a sync; keep it off the caller's loop.
+        return await asyncio.to_thread(cls, **kwargs)
+
+    def _ingest_and_index(self, changed=None, renamed=None):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self._ingest_and_index_async(changed, renamed))
+            return
+        # asyncio.run cannot nest inside a running loop (Jupyter, async
+        # servers), so run the sync on a fresh loop in a worker thread.
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pool.submit(asyncio.run, self._ingest_and_index_async(changed, renamed)).result()
+
+    def is_source_file(self, key):
+        return self.scanner.matches(key)
+
+    def _file_stat(self, key):
+        st = os.stat(self.scanner.path_for(key))
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    def _chunk_key(self, metadata, text):
+        headers = tuple(metadata.get(f"Header {i}") for i in range(1, 7))
+        return headers, metadata.get("original_content", text)
+
+    async def _rename_file(self, manifest, old_name, new_name):
+        # Chunk ids include the file path, so a rename changes every id.
+        # Re-split the file without the LLM to learn the new ids, then move
+        # each stored vector (embedding and enrichment included) to its new id.
+        entry = manifest.entries.get(old_name)
+        new_path = self.scanner.path_for(new_name)
+        if not entry or not os.path.isfile(new_path) or not self.is_source_file(new_name):
+            return False
+        old_path = self.scanner.path_for(old_name)
+
+        docs = await process_document(new_path, subtree=self.scanner.subtree(new_name), parse_pool=self.parse_pool)
+        new_docs_by_key = {}
+        for doc in docs:
+            key = self._chunk_key(doc.metadata, doc.page_content)
+            new_docs_by_key.setdefault(key, []).append(doc)
+
+        stored = self.vectorstore.get(
+            ids=vector_ids(entry["chunks"]), include=["embeddings", "documents", "metadatas"]
+        )
+        rows = list(zip(stored["ids"], stored["embeddings"], stored["documents"], stored["metadatas"]))
+        new_ids = {}
+        new_scopes = {}
+        ids, embeddings, documents, metadatas = [], [], [], []
+        for vector_id, embedding, text, metadata in rows:
+            metadata = metadata or {}
+            if "parent_id" in metadata:
+                continue
+            matches = new_docs_by_key.get(self._chunk_key(metadata, text))
+            if not matches:
+                continue
+            new_doc = matches.pop(0)
+            new_id = new_doc.metadata["chunk_id"]
+            new_ids[vector_id] = new_id
+            # The move may change the subtree (and with it the shard).
+            new_scopes[new_id] = {f: new_doc.metadata[f] for f in SCOPE_FIELDS if f in new_doc.metadata}
+            ids.append(new_id)
+            embeddings.append(embedding)
+            documents.append(text.replace(f"Location: {old_path}", f"Location: {new_path}", 1))
+            metadatas.append(dict(metadata, chunk_id=new_id, **new_scopes[new_id]))
+        chunk_count = len(ids)
+
+        # A file already indexed under the new name (moved over, or checked
+        # out) is replaced. Its vectors go first: unchanged chunks get the
+        # same ids back below.
+        replaced = manifest.entries.get(new_name)
+        if replaced:
+            replaced_ids = replaced["chunks"] + replaced.get("pending", [])
+            self.vectorstore.delete(ids=vector_ids(replaced_ids))
+            self._on_chunks_deleted(replaced_ids)
+
+        # Child vectors follow their parent chunk to its new id.
+        for vector_id, embedding, text, metadata in rows:
+            metadata = metadata or {}
+            parent = new_ids.get(metadata.get("parent_id"))
+            if parent is None:
+                continue
+            ids.append(child_id(parent, metadata["kind"]))
+            embeddings.append(embedding)
+            documents.append(text)
+            metadatas.append(dict(metadata, parent_id=parent, **new_scopes[parent]))
+
+        if ids:
+            self.vectorstore._collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+            if self.dense_index is not None:
+                self.dense_index.add(ids, embeddings)
+        stale_ids = entry["chunks"] + entry.get("pending", [])
+        self.vectorstore.delete(ids=vector_ids(stale_ids))
+        self._on_chunks_deleted(stale_ids)
+        for chunk_id, text, metadata in zip(ids[:chunk_count], documents, metadatas):
+            self.lexical_index.add(chunk_id, metadata.get("original_content", text))
+
+        # Anything that did not match (the file was also edited) is left for
+        # the regular pass, which will only enrich the unmatched chunks.
+        from preprocess import calculate_file_hash
+        complete = chunk_count == len(docs)
+        manifest.record(old_name, None)
+        manifest.record(new_name, {
+            "hash": await asyncio.to_thread(calculate_file_hash, new_path) if complete else None,
+            "chunks": ids[:chunk_count],
+            "stat": self._file_stat(new_name)
+        })
+        print(f"Renamed {old_name} -> {new_name} ({chunk_count} chunks re-keyed).")
+        return True
+
+    def _reset_indexes(self):
+        self.lexical_index.clear()
+        if self.dense_index is not None:
+            self.dense_index.clear()
+        self.answer_cache.clear()
+
+    def _load_manifest(self):
+        manifest = IndexManifest(self.persist_dir)
+        found = manifest.load()
+        sharded_on_disk = os.path.exists(os.path.join(self.persist_dir, SHARDS_FILE))
+        if self._owns_vectorstore and manifest.entries and sharded_on_disk != self.shard_by_subtree:
+            # The vectors live in the other layout. Drop them and re-index;
+            # the embedding and enrichment caches make this cheap.
+            print(f"Index was built {'with' if sharded_on_disk else 'without'} per-subtree collections. Re-indexing...")
+            self._open_vectorstore(sharded_on_disk).reset_collection()
+            if sharded_on_disk:
+                os.remove(os.path.join(self.persist_dir, SHARDS_FILE))
+            for filename in list(manifest.entries):
+                manifest.record(filename, None)
+            manifest.compact()
+            self._reset_indexes()
+        # Vectors written without a manifest have no known ids, so they can
+        # never be cleaned up incrementally. Start from an empty collection.
+        elif not found and self.vectorstore.get(limit=1)["ids"]:
+            print("Found vectors without a manifest. Resetting collection...")
+            self.vectorstore.reset_collection()
+            self._reset_indexes()
+        self._backfill_scope(manifest)
+        self._requeue_plain_text(manifest)
+        self._sync_lexical_index(manifest)
+        if self.dense_index is not None:
+            self._sync_dense_index(manifest)
+        return manifest
+
+    def _backfill_scope(self, manifest):
+        # Chunks indexed before scope metadata existed keep their ids (and so
+        # are never re-processed); add the fields to their stored vectors once.
+        sample = next((entry["chunks"][0] for entry in manifest.entries.values() if entry["chunks"]), None)
+        if sample is None:
+            return
+        stored = self.vectorstore.get(ids=[sample], include=["metadatas"])
+        if not stored["ids"] or "depth" in (stored["metadatas"][0] or {}):
+            return
+        print("Adding scope metadata to indexed chunks...")
+        for filename, entry in manifest.entries.items():
+            rows = self.vectorstore.get(ids=vector_ids(entry["chunks"]), include=["embeddings", "documents", "metadatas"])
+            if not len(rows["ids"]):
+                continue
+            scope = {
+                "source": self.scanner.path_for(filename),
+                "subtree": self.scanner.subtree(filename),
+                "file_type": os.path.splitext(filename)[1].lstrip(".").lower()
+            }
+            metadatas = [dict(metadata or {}, **scope) for metadata in rows["metadatas"]]
+            depths = {
+                vector_id: sum(1 for i in range(1, 7) if f"Header {i}" in metadata)
+                for vector_id, metadata in zip(rows["ids"], metadatas) if "parent_id" not in metadata
+            }
+            for vector_id, metadata in zip(rows["ids"], metadatas):
+                metadata["depth"] = depths.get(metadata.get("parent_id", vector_id), 0)
+            self.vectorstore._collection.upsert(
+                ids=list(rows["ids"]), embeddings=list(rows["embeddings"]), documents=list(rows["documents"]),
+                metadatas=metadatas
             )
-        
-        self._ingest_and_index()
-        
-        self._build_chain()
 
-    def _ingest_and_index(self):
-        asyncio.run(self._ingest_and_index_async())
+    def _requeue_plain_text(self, manifest):
+        # Plain-text files used to be indexed without enrichment. Queue them
+        # to be processed once more: their chunk ids are unchanged, so the
+        # next sync re-enriches and overwrites the stored vectors in place.
+        # The manifest remembers that this ran, so later loads skip the scan.
+        if "txt-enrichment" in manifest.migrations:
+            return
+        entries = [
+            (filename, entry) for filename, entry in manifest.entries.items()
+            if entry["chunks"] and entry["hash"] and os.path.splitext(filename)[1].lower() == ".txt"
+        ]
+        if entries:
+            stored = self.vectorstore.get(ids=[entries[0][1]["chunks"][0]], include=["metadatas"])
+            if stored["ids"] and "original_content" not in (stored["metadatas"][0] or {}):
+                print(f"Queueing {len(entries)} plain-text files for enrichment...")
+                for filename, entry in entries:
+                    manifest.record(filename, {
+                        "hash": None, "chunks": [], "pending": entry["chunks"] + entry.get("pending", []),
+                        "stat": entry.get("stat")
+                    })
+        manifest.mark_migrated("txt-enrichment")
+
+    def _sync_lexical_index(self, manifest):
+        # The lexical index is saved once per sync, so after an interrupted
+        # sync (or on first upgrade) it can lag the manifest. Reconcile it
+        # from the chunks already stored in Chroma.
+        expected = set()
+        for entry in manifest.entries.values():
+            expected.update(entry["chunks"])
+        present = self.lexical_index.chunk_ids()
 
-    async def _ingest_and_index_async(self):
-        print(f"Scanning {self.source_dir}...")
-        
-        all_docs = []
+        for chunk_id in present - expected:
+            self.lexical_index.remove(chunk_id)
+
+        missing = list(expected - present)
+        if missing:
+            print(f"Adding {len(missing)} chunks to the lexical index...")
+        for i in range(0, len(missing), 500):
+            batch = self.vectorstore.get(ids=missing[i:i + 500], include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+                self.lexical_index.add(chunk_id, (metadata or {}).get("original_content", text))
+        self.lexical_index.save()
+
+    def _sync_dense_index(self, manifest):
+        # Same reconciliation for the quantized copy of the vectors, whose
+        # embeddings are read back from Chroma instead of recomputed.
+        chunk_ids = [chunk_id for entry in manifest.entries.values() for chunk_id in entry["chunks"]]
+        expected = set(vector_ids(chunk_ids))
+        present = self.dense_index.vector_ids()
+
+        for vector_id in present - expected:
+            self.dense_index.remove(vector_id)
+
+        missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in present]
+        if missing:
+            print(f"Adding {len(missing)} chunks to the {self.vector_mode} dense index...")
+        for i in range(0, len(missing), 500):
+            batch = self.vectorstore.get(ids=vector_ids(missing[i:i + 500]), include=["embeddings"])
+            if len(batch["ids"]):
+                self.dense_index.add(batch["ids"], batch["embeddings"])
+        self.dense_index.save()
+
+    def _save_indexes(self):
+        self._clear_scope_cache()
+        self.lexical_index.save()
+        if self.dense_index is not None:
+            self.dense_index.save()
+
+    async def _ingest_and_index_async(self, changed=None, renamed=None):
+        print(f"Scanning {', '.join(self.scanner.roots)}...")
         
         if not os.path.exists(self.source_dir):
             os.makedirs(self.source_dir)
             print(f"Created directory {self.source_dir}")
-            return
 
-        files = [f for f in os.listdir(self.source_dir) if f.endswith(('.md', '.txt'))]
-        
-        if not files:
-            print("No files found to ingest.")
-            return
+        manifest = self._load_manifest()
 
-        hashes_file = os.path.join(self.source_dir, "file_hashes.json")
-        existing_hashes = {}
-        if os.path.exists(hashes_file):
-            try:
-                with open(hashes_file, "r") as f:
-                    existing_hashes = json.load(f)
-            except Exception:
-                print("Could not load existing hashes. Re-indexing all.")
+        for old_name, new_name in renamed or []:
+            if not await self._rename_file(manifest, old_name, new_name):
+                # Not a rename we can re-key; treat as a delete plus an add.
+                changed = None if changed is None else set(changed) | {old_name, new_name}
 
-        new_hashes = existing_hashes.copy()
-        files_to_process = []
+        if changed is None:
+            stats = await asyncio.to_thread(self.scanner.scan)
+        else:
+            stats = {}
+            for f in changed:
+                if self.is_source_file(f) and os.path.isfile(self.scanner.path_for(f)):
+                    stats[f] = tuple(self._file_stat(f))
+        removed_files = [
+            f for f in (manifest.entries if changed is None else changed)
+            if f in manifest.entries and f not in stats
+        ]
 
         from preprocess import calculate_file_hash
-        
-        for filename in files:
-            file_path = os.path.join(self.source_dir, filename)
-            current_hash = calculate_file_hash(file_path)
-            
-            if filename in existing_hashes and existing_hashes[filename] == current_hash:
-                print(f"Skipping {filename} (unchanged).")
+
+        # A file whose size, mtime and inode match the manifest is unchanged
+        # and is never opened. The rest are hashed in a thread pool; a file
+        # that was only touched gets its new stat recorded and is skipped.
+        stat_changed = []
+        for filename, stat in stats.items():
+            entry = manifest.entries.get(filename)
+            if not (entry and entry["hash"] and tuple(entry.get("stat") or ()) == stat):
+                stat_changed.append(filename)
+        hashes = await asyncio.gather(*(
+            asyncio.to_thread(calculate_file_hash, self.scanner.path_for(f)) for f in stat_changed
+        ))
+
+        files_to_process = []
+        current_hashes = {}
+        for filename, current_hash in zip(stat_changed, hashes):
+            entry = manifest.entries.get(filename)
+            if entry and entry["hash"] == current_hash:
+                manifest.record(filename, dict(entry, stat=list(stats[filename])))
             else:
                 files_to_process.append(filename)
-                new_hashes[filename] = current_hash
+                current_hashes[filename] = current_hash
+        print(
+            f"Found {len(stats)} source files: {len(stats) - len(files_to_process)} unchanged "
+            f"({len(stats) - len(stat_changed)} by stat), {len(files_to_process)} to process."
+        )
 
-        if not files_to_process:
+        if not files_to_process and not removed_files:
             print("No files changed. Knowledge base is up to date.")
+            manifest.compact()
+            self._save_indexes()
             return
 
-        print(f"Processing {len(files_to_process)} changed files...")
+        for filename in removed_files:
+            entry = manifest.entries[filename]
+            stale_ids = entry["chunks"] + entry.get("pending", [])
+            print(f"Removing {filename} ({len(stale_ids)} chunks)...")
+            if stale_ids:
+                self.vectorstore.delete(ids=vector_ids(stale_ids))
+                self._on_chunks_deleted(stale_ids)
+            manifest.record(filename, None)
 
-        for filename in files_to_process:
-            file_path = os.path.join(self.source_dir, filename)
-            print(f"Processing {file_path}...")
-            
-            try:
-                docs = await process_document(file_path, llm=self.llm)
-                all_docs.extend(docs)
-                print(f"  - Generated {len(docs)} chunks.")
-            except Exception as e:
-                print(f"  - Error processing {filename}: {e}")
+        self.sync_status.update(phase="processing", files_total=len(files_to_process))
+        print(f"Processing {len(files_to_process)} changed files (max {self.max_concurrency} concurrent LLM calls)...")
 
-        if not all_docs:
-            print("No chunks generated from changed files.")
+        scheduler = LLMScheduler(
+            max_concurrency=self.max_concurrency,
+            requests_per_minute=self.requests_per_minute,
+            tokens_per_minute=self.tokens_per_minute,
+            max_retries=self.max_retries
+        )
+        # Bound the number of files held in memory while they wait for the LLM.
+        # A producer blocked on the full queue keeps its slot, so a slow
+        # indexing stage stops new files from being read. Files arrive as
+        # batches of docs (one for most files, many for a streamed one),
+        # then an end message carrying the error and dead-letter count.
+        file_slots = asyncio.Semaphore(max(2, self.max_concurrency))
+        finished = asyncio.Queue(maxsize=2)
 
-            if files_to_process:
-                 with open(hashes_file, "w") as f:
-                    json.dump(new_hashes, f)
-            return
+        async def produce(filename):
+            file_path = self.scanner.path_for(filename)
+            entry = manifest.entries.get(filename, {})
+            old_ids = set(entry.get("chunks", []))
+            pending_ids = entry.get("pending", [])
+            async with file_slots:
+                print(f"Processing {file_path}...")
+                error = None
+                try:
+                    async for docs in iter_document(
+                        file_path,
+                        llm=self.llm,
+                        existing_ids=old_ids,
+                        cache=self.enrichment_cache,
+                        scheduler=scheduler,
+                        enrich_batch=self.enrich_batch_size,
+                        subtree=self.scanner.subtree(filename),
+                        parse_pool=self.parse_pool
+                    ):
+                        await finished.put((filename, old_ids, pending_ids, docs, None))
+                except Exception as e:
+                    print(f"  - Error processing {filename}: {e}")
+                    error = e
+                failed = len(scheduler.dead_letters_for(file_path))
+                await finished.put((filename, old_ids, pending_ids, None, (error, failed)))
+
+        producers = [asyncio.create_task(produce(f)) for f in files_to_process]
+
+        # Index chunks as soon as each file is enriched instead of waiting for
+        # the whole corpus; embedding runs in a worker thread so enrichment of
+        # the remaining files continues meanwhile.
+        indexer = StreamingIndexer(
+            self.vectorstore,
+            self.ingest_embeddings,
+            manifest,
+            batch_size=self.embed_batch_size,
+            lexical_index=self.lexical_index,
+            on_delete=self._on_chunks_deleted,
+            dense_index=self.dense_index
+        )
+        open_files = {}
+        ended = 0
+        while ended < len(producers):
+            filename, old_ids, pending_ids, docs, end = await finished.get()
+            file_state = open_files.get(filename)
+            if file_state is None and (docs is not None or end[0] is None):
+                file_state = open_files[filename] = await asyncio.to_thread(
+                    indexer.begin_file, filename, old_ids, pending_ids, list(stats[filename])
+                )
+            if docs is not None:
+                await asyncio.to_thread(indexer.add_docs, file_state, docs)
+                self.sync_status["chunks_indexed"] = indexer.added
+                continue
+            ended += 1
+            self.sync_status["files_done"] += 1
+            error, failed = end
+            file_state = open_files.pop(filename, None)
+            if file_state is None:
+                continue
+            # Index what was enriched, but leave the file hash unset so the
+            # dead-lettered chunks are picked up again by the next sync. A
+            # file that failed part way through stays pending as a whole.
+            file_hash = None if failed else current_hashes[filename]
+            await asyncio.to_thread(indexer.end_file, file_state, file_hash, error is None)
+            if error is None:
+                print(f"  - {filename}: {len(file_state['chunks'])} chunks queued for indexing.")
+            if failed:
+                print(f"  - {filename}: {failed} chunks failed enrichment; will retry on next sync.")
+
+        self.sync_status["phase"] = "indexing"
+        await asyncio.to_thread(indexer.flush)
+        self.sync_status["chunks_indexed"] = indexer.added
+        await asyncio.gather(*producers)
 
-        print(f"\nTotal new chunks to ingest: {len(all_docs)}")
+        manifest.compact()
+        self._save_indexes()
+        self._save_dead_letters(scheduler.dead_letters)
+        llm_stats = scheduler.stats()
+        print(
+            f"LLM calls: {llm_stats['calls']}, retries: {llm_stats['retries']}, "
+            f"throttled: {llm_stats['throttled']}, dead letters: {llm_stats['dead_letters']}."
+        )
+        stats = self.enrichment_cache.stats()
+        print(f"Enrichment cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries.")
+        stats = self.embedding_cache.stats()
+        print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries.")
+        print(f"\nIndexed {indexer.added} new chunks, removed {indexer.deleted} stale chunks.")
+        print(f"Vector store persisted to {self.persist_dir}")
+
+    def _clear_scope_cache(self):
+        with self._scope_lock:
+            self._scope_cache.clear()
+
+    def _on_chunks_deleted(self, chunk_ids):
+        self._clear_scope_cache()
+        for chunk_id in chunk_ids:
+            self.lexical_index.remove(chunk_id)
+        if self.dense_index is not None:
+            for vector_id in vector_ids(chunk_ids):
+                self.dense_index.remove(vector_id)
+        invalidated = self.answer_cache.invalidate_chunks(chunk_ids)
+        if invalidated:
+            print(f"  - Invalidated {invalidated} cached answers citing changed chunks.")
+
+    def _save_dead_letters(self, dead_letters):
+        dead_letters_file = os.path.join(self.persist_dir, "dead_letters.json")
+        if dead_letters:
+            with open(dead_letters_file, "w") as f:
+                json.dump(dead_letters, f, indent=2)
+        elif os.path.exists(dead_letters_file):
+            os.remove(dead_letters_file)
 
-        if self.vectorstore:
-            print("Adding to existing vector store...")
-            self.vectorstore.add_documents(all_docs)
+    def _scope_ids(self, scope):
+        # (vector ids, chunk ids) matching a normalized scope. Resolved with
+        # one metadata query (on the scope's shards only, when sharded) and
+        # cached until the next sync finishes or chunks are deleted.
+        key = scope_key(scope)
+        with self._scope_lock:
+            cached = self._scope_cache.get(key)
+        if cached is None:
+            start = time.perf_counter()
+            kwargs = {"where": scope_filter(scope), "include": []}
+            if self.shard_by_subtree and "subtree" in scope:
+                kwargs["subtrees"] = scope["subtree"]
+            found = self.vectorstore.get(**kwargs)["ids"]
+            cached = (frozenset(found), frozenset(parent_id(vector_id) for vector_id in found))
+            self.metrics.observe("scope_resolve", time.perf_counter() - start)
+            with self._scope_lock:
+                if len(self._scope_cache) >= 256:
+                    self._scope_cache.clear()
+                self._scope_cache[key] = cached
+        return cached
+
+    def _retrieve(self, question, embedding=None, scope=None):
+        # `scope` (see scope.py) restricts every search to matching chunks
+        # before ranking, rather than filtering the top results afterwards.
+        timings = {}
+        scope = normalize_scope(scope)
+        if scope and "source" in scope:
+            # Accept source-relative paths (manifest keys) as well as paths.
+            scope["source"] = sorted({self.scanner.path_for(self.scanner.key_for(s) or s) for s in scope["source"]})
+
+        start = retrieval_start = time.perf_counter()
+        allowed_vectors = allowed_chunks = None
+        if scope:
+            allowed_vectors, allowed_chunks = self._scope_ids(scope)
+            timings["scope_ms"] = (time.perf_counter() - start) * 1000
+            if not allowed_chunks:
+                return {"docs": [], "timings": timings}
+
+        start = time.perf_counter()
+        if embedding is None:
+            embedding = self.embeddings.embed_query(question)
+        # Each chunk has up to one vector per kind; over-fetch so that
+        # fetch_k distinct chunks remain after collapsing to parents.
+        n_hits = self.fetch_k * (1 + len(CHILD_VECTORS))
+        if self.dense_index is not None:
+            # Only ids come back; the chunks are loaded from Chroma below.
+            hits = [
+                (parent_id(vector_id), None)
+                for vector_id, _ in self.dense_index.search(embedding, k=n_hits, allowed=allowed_vectors)
+            ]
         else:
-            print("Creating new vector store...")
-            self.vectorstore = Chroma.from_documents(
-                documents=all_docs,
-                embedding=self.embeddings,
-                persist_directory=self.persist_dir
+            search_kwargs = {}
+            if scope:
+                search_kwargs["filter"] = scope_filter(scope)
+                if self.shard_by_subtree and "subtree" in scope:
+                    search_kwargs["subtrees"] = scope["subtree"]
+            hits = [
+                (doc.metadata.get("parent_id") or doc.metadata.get("chunk_id"),
+                 None if "parent_id" in doc.metadata else doc)
+                for doc in self.vectorstore.similarity_search_by_vector(embedding, k=n_hits, **search_kwargs)
+            ]
+        dense_ids = []
+        seen = set()
+        docs_by_id = {}
+        for chunk_id, doc in hits:
+            if chunk_id in seen:
+                continue
+            seen.add(chunk_id)
+            dense_ids.append(chunk_id)
+            if doc is not None:
+                docs_by_id[chunk_id] = doc
+        dense_ids = dense_ids[:self.fetch_k]
+        timings["dense_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        lexical_hits = self.lexical_index.search(question, k=self.fetch_k, allowed=allowed_chunks)
+        timings["lexical_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        fused = reciprocal_rank_fusion([
+            dense_ids,
+            [chunk_id for chunk_id, _ in lexical_hits]
+        ], with_scores=True)
+        # Without a second stage only the top k are needed. A budget already
+        # spent by the searches leaves the fused order as it is.
+        deadline = retrieval_start + self.retrieval_budget if self.retrieval_budget else None
+        second_stage = self.mmr_lambda < 1 or self.reranker is not None
+        if second_stage and deadline is not None and time.perf_counter() > deadline:
+            self.metrics.incr("retrieval_budget_exceeded")
+            second_stage = False
+        fused = fused[:self.fetch_k if second_stage else self.k]
+        fused_ids = [chunk_id for chunk_id, _ in fused]
+
+        # Candidates are compared by the vectors already stored for them;
+        # nothing is re-embedded.
+        vectors = {}
+        if second_stage and self.dense_index is not None:
+            vectors = self.dense_index.vectors(fused_ids)
+        from_chroma = second_stage and self.dense_index is None
+        missing = [chunk_id for chunk_id in fused_ids if from_chroma or chunk_id not in docs_by_id]
+        if missing:
+            include = ["documents", "metadatas"] + (["embeddings"] if from_chroma else [])
+            fetched = self.vectorstore.get(ids=missing, include=include)
+            for chunk_id, text, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"]):
+                docs_by_id.setdefault(chunk_id, Document(page_content=text, metadata=metadata or {}))
+            if from_chroma and fetched.get("embeddings") is not None:
+                vectors.update(zip(fetched["ids"], fetched["embeddings"]))
+        fused = [(chunk_id, score) for chunk_id, score in fused if chunk_id in docs_by_id]
+        timings["fusion_ms"] = (time.perf_counter() - start) * 1000
+
+        if second_stage and self.mmr_lambda < 1 and len(fused) > 1:
+            start = time.perf_counter()
+            top_score = fused[0][1]
+            order = mmr(
+                [score / top_score for _, score in fused],
+                [vectors.get(chunk_id) for chunk_id, _ in fused],
+                k=len(fused),
+                lambda_mult=self.mmr_lambda,
+                deadline=deadline
             )
-        
-        print(f"Vector store persisted to {self.persist_dir}")
-        
-        with open(hashes_file, "w") as f:
-            json.dump(new_hashes, f)
+            fused = [fused[i] for i in order]
+            timings["mmr_ms"] = (time.perf_counter() - start) * 1000
+
+        ranked_ids = [chunk_id for chunk_id, _ in fused]
+        if second_stage and self.reranker is not None and ranked_ids:
+            start = time.perf_counter()
+            candidates = [
+                (chunk_id, docs_by_id[chunk_id].metadata.get("original_content", docs_by_id[chunk_id].page_content))
+                for chunk_id in ranked_ids
+            ]
+            candidates = rerank(self.reranker, self.rerank_cache, question, candidates, self.rerank_top, deadline)
+            ranked_ids = [chunk_id for chunk_id, _ in candidates]
+            timings["rerank_ms"] = (time.perf_counter() - start) * 1000
+
+        docs = [docs_by_id[chunk_id] for chunk_id in ranked_ids[:self.k]]
+
+        for name, ms in timings.items():
+            self.metrics.observe("retrieval", ms / 1000, stage=name[:-len("_ms")])
+        return {"docs": docs, "timings": timings}
 
     def _build_chain(self):
-        retriever = self.vectorstore.as_retriever(search_kwargs={"k": 5})
+        retriever = RunnableLambda(lambda x: self._retrieve(x["input"], x.get("embedding"), x.get("scope")))
 
         system_prompt = (
             "You are an expert support assistant. Use the following context to answer the user's question.\n\n"
             "<context>\n"
             "{context}\n"
             "</context>\n\n"
-            "Note: Content inside <context> includes location metadata and potential questions above '---CONTENT---'. "
-            "Use this metadata to understand document structure and relevance, but answer only using the text below '---CONTENT---'. "
+            "Each passage inside <context> starts with its location in brackets, followed by the source text. "
             "Be concise, helpful, and only give relevant information. "
-            "If the answer is not in the content section, say you don't know."
+            "If the answer is not in the context, say you don't know."
         )
 
         prompt = ChatPromptTemplate.from_messages([
@@ -171,29 +887,178 @@ class MdRag:
             ("human", "{input}")
         ])
 
-        self.chain = (
-            RunnableParallel({"context": retriever, "input": RunnablePassthrough()})
+        self.answer_chain = prompt | self.llm | StrOutputParser()
+
+        self._chain = (
+            RunnableParallel({"retrieval": retriever, "input": lambda x: x["input"]})
+            | RunnablePassthrough.assign(context=lambda x: x["retrieval"]["docs"])
             | {
-                "answer": (
-                    {
-                        "context": (lambda x: "\n\n".join(d.page_content for d in x["context"])),
-                        "input": lambda x: x["input"]
-                    }
-                    | prompt
-                    | self.llm
-                    | StrOutputParser()
-                ),
-                "sources": lambda x: x["context"]
+                "answer": RunnableLambda(self._answer, afunc=self._aanswer),
+                "sources": lambda x: x["context"],
+                "timings": lambda x: x["retrieval"]["timings"]
             }
         )
 
-    def query(self, question):
+    def _answer(self, x):
+        inputs = {"context": self._format_context(x["context"]), "input": x["input"]}
+        with self.metrics.span("generation"):
+            return self.answer_chain.invoke(inputs)
+
+    async def _aanswer(self, x):
+        inputs = {"context": self._format_context(x["context"]), "input": x["input"]}
+        with self.metrics.span("generation"):
+            return await self.answer_chain.ainvoke(inputs)
+
+    def _format_context(self, docs):
+        with self.metrics.span("prompt_assembly"):
+            return build_context(docs, self.context_tokens)
+
+    def _lookup_cache(self, question):
+        cached = self.answer_cache.get_exact(question)
+        if cached is not None:
+            return cached, None
+        embedding = self.embeddings.embed_query(question)
+        return self.answer_cache.get_semantic(embedding), embedding
+
+    def _is_connection_error(self, error):
+        error_str = str(error)
+        return "Connection refused" in error_str or "Network is unreachable" in error_str or "Errno 101" in error_str
+
+    def _log_timings(self, timings):
+        print("Retrieval timings (ms): " + ", ".join(f"{name}={ms:.1f}" for name, ms in timings.items()))
+
+    # Scoped queries (`scope`, see scope.py) bypass the answer cache, whose
+    # answers were drawn from the whole index.
+    def query(self, question, scope=None):
+        if not self.chain:
+            return "System not initialized or file processing failed."
+        start = time.perf_counter()
+        try:
+            cached, embedding = self._lookup_cache(question) if not scope else (None, None)
+            if cached is not None:
+                print(f"Answer cache hit ({cached['cached']}).")
+                self.metrics.observe("query", time.perf_counter() - start, result="cached")
+                return cached
+
+            response = self.chain.invoke({"input": question, "embedding": embedding, "scope": scope})
+            self._log_timings(response["timings"])
+            if not scope:
+                self.answer_cache.put(question, embedding, response)
+            self.metrics.observe("query", time.perf_counter() - start, result="answered")
+            return response
+        except Exception as e:
+            if self._is_connection_error(e):
+                return ("Error connecting to LLM")
+            raise e
+
+    async def aquery(self, question, embed=None, scope=None):
         if not self.chain:
             return "System not initialized or file processing failed."
+        start = time.perf_counter()
         try:
-            return self.chain.invoke(question)
+            cached = None if scope else await asyncio.to_thread(self.answer_cache.get_exact, question)
+            if cached is None:
+                if embed:
+                    embedding = await embed(question)
+                else:
+                    embedding = await asyncio.to_thread(self.embeddings.embed_query, question)
+                if not scope:
+                    cached = await asyncio.to_thread(self.answer_cache.get_semantic, embedding)
+            if cached is not None:
+                print(f"Answer cache hit ({cached['cached']}).")
+                self.metrics.observe("query", time.perf_counter() - start, result="cached")
+                return cached
+
+            response = await self.chain.ainvoke({"input": question, "embedding": embedding, "scope": scope})
+            self._log_timings(response["timings"])
+            if not scope:
+                await asyncio.to_thread(self.answer_cache.put, question, embedding, response)
+            self.metrics.observe("query", time.perf_counter() - start, result="answered")
+            return response
         except Exception as e:
-            error_str = str(e)
-            if "Connection refused" in error_str or "Network is unreachable" in error_str or "Errno 101" in error_str:
+            if self._is_connection_error(e):
                 return ("Error connecting to LLM")
-            raise e
\ No newline at end of file
+            raise e
+
+    # Streaming variants yield ("sources", docs) first, then ("token", text)
+    # for each piece of the answer as it is generated. A connection failure
+    # is reported as a final ("error", message) event.
+    def stream_query(self, question, scope=None):
+        if not self.chain:
+            yield "error", "System not initialized or file processing failed."
+            return
+
+        start = time.perf_counter()
+        cached, embedding = self._lookup_cache(question) if not scope else (None, None)
+        if cached is not None:
+            print(f"Answer cache hit ({cached['cached']}).")
+            self.metrics.observe("query", time.perf_counter() - start, result="cached")
+            yield "sources", cached["sources"]
+            yield "token", cached["answer"]
+            return
+
+        retrieval = self._retrieve(question, embedding, scope)
+        self._log_timings(retrieval["timings"])
+        yield "sources", retrieval["docs"]
+
+        tokens = []
+        try:
+            inputs = {"context": self._format_context(retrieval["docs"]), "input": question}
+            generation_start = time.perf_counter()
+            for token in self.answer_chain.stream(inputs):
+                if not tokens:
+                    self.metrics.observe("time_to_first_token", time.perf_counter() - generation_start)
+                tokens.append(token)
+                yield "token", token
+        except Exception as e:
+            if self._is_connection_error(e):
+                yield "error", "Error connecting to LLM"
+                return
+            raise e
+        # Generation time includes the time the consumer took between tokens.
+        self.metrics.observe("generation", time.perf_counter() - generation_start)
+        self.metrics.observe("query", time.perf_counter() - start, result="answered")
+
+        if not scope:
+            self.answer_cache.put(question, embedding, {"answer": "".join(tokens), "sources": retrieval["docs"]})
+
+    async def astream_query(self, question, scope=None):
+        if not self.chain:
+            yield "error", "System not initialized or file processing failed."
+            return
+
+        start = time.perf_counter()
+        cached, embedding = await asyncio.to_thread(self._lookup_cache, question) if not scope else (None, None)
+        if cached is not None:
+            print(f"Answer cache hit ({cached['cached']}).")
+            self.metrics.observe("query", time.perf_counter() - start, result="cached")
+            yield "sources", cached["sources"]
+            yield "token", cached["answer"]
+            return
+
+        retrieval = await asyncio.to_thread(self._retrieve, question, embedding, scope)
+        self._log_timings(retrieval["timings"])
+        yield "sources", retrieval["docs"]
+
+        tokens = []
+        try:
+            inputs = {"context": self._format_context(retrieval["docs"]), "input": question}
+            generation_start = time.perf_counter()
+            async for token in self.answer_chain.astream(inputs):
+                if not tokens:
+                    self.metrics.observe("time_to_first_token", time.perf_counter() - generation_start)
+                tokens.append(token)
+                yield "token", token
+        except Exception as e:
+            if self._is_connection_error(e):
+                yield "error", "Error connecting to LLM"
+                return
+            raise e
+        # Generation time includes the time the consumer took between tokens.
+        self.metrics.observe("generation", time.perf_counter() - generation_start)
+        self.metrics.observe("query", time.perf_counter() - start, result="answered")
+
+        if not scope:
+            await asyncio.to_thread(
+                self.answer_cache.put, question, embedding, {"answer": "".join(tokens), "sources": retrieval["docs"]}
+            )
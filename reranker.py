@@ -0,0 +1,148 @@
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from bm25_index import tokenize
+from answer_cache import normalize_question
+from metrics import metrics
+
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+def mmr(relevance, vectors, k, lambda_mult=0.7, deadline=None):
+    # Maximal marginal relevance: repeatedly picks the candidate with the
+    # best trade-off between its relevance and its highest cosine similarity
+    # to anything already picked. Returns candidate indices in pick order.
+    # A candidate whose vector is None is never considered redundant. Past
+    # `deadline` (a perf_counter time), the remaining picks follow the input
+    # order, which is by relevance.
+    relevance = np.asarray(relevance, dtype=np.float32)
+    dim = next((len(v) for v in vectors if v is not None), 0)
+    if not len(relevance) or not dim:
+        return list(range(min(k, len(relevance))))
+    matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+    for i, vector in enumerate(vectors):
+        if vector is not None:
+            matrix[i] = vector
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1.0, norms)
+
+    similarity = matrix @ matrix.T
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    remaining = np.ones(len(relevance), dtype=bool)
+    picked = []
+    for _ in range(min(k, len(relevance))):
+        if deadline is not None and picked and time.perf_counter() > deadline:
+            metrics.incr("mmr_budget_exceeded")
+            picked.extend(np.flatnonzero(remaining)[:k - len(picked)].tolist())
+            break
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~remaining] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        remaining[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return picked
+
+# Local stand-in for a cross-encoder: the share of the query's terms (as
+# tokenized for BM25) that appear in the passage. Costs nothing to load, so
+# the rerank stage can be exercised without a model.
+class LexicalReranker:
+    name = "lexical"
+
+    def score(self, query, passages):
+        terms = set(tokenize(query))
+        if not terms:
+            return [0.0] * len(passages)
+        return [len(terms & set(tokenize(p))) / len(terms) for p in passages]
+
+# Scores (query, passage) pairs with a sentence-transformers CrossEncoder.
+# The model is loaded on first use.
+class CrossEncoderReranker:
+    def __init__(self, model=CROSS_ENCODER_MODEL, batch_size=16):
+        self.name = model
+        self.batch_size = batch_size
+        self._model = None
+        self._lock = threading.Lock()
+
+    def score(self, query, passages):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                self._model = CrossEncoder(self.name)
+        scores = self._model.predict([(query, p) for p in passages], batch_size=self.batch_size)
+        return [float(s) for s in scores]
+
+def create_reranker(kind):
+    # "" or "none" disables reranking; "lexical" is the local stand-in; any
+    # other value names a cross-encoder model ("cross-encoder" for the default).
+    if not kind or kind == "none":
+        return None
+    if kind == "lexical":
+        return LexicalReranker()
+    return CrossEncoderReranker(CROSS_ENCODER_MODEL if kind == "cross-encoder" else kind)
+
+# Least recently used (query, chunk) -> score map in memory. Chunk ids are
+# content-addressed, so an edited chunk gets a new id and its old scores
+# simply age out.
+class ScoreCache:
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            score = self._scores.get(key)
+            if score is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._scores.move_to_end(key)
+        metrics.incr("cache_lookups", cache="rerank", result="miss" if score is None else "hit")
+        return score
+
+    def put(self, key, score):
+        with self._lock:
+            self._scores[key] = score
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+    def __len__(self):
+        return len(self._scores)
+
+# Reorders the first `top_n` candidates (already in MMR order) by reranker
+# score. Candidates are scored `batch_size` at a time, most promising first,
+# and scoring stops once the next batch would run past `deadline` (a
+# time.perf_counter() value); candidates left unscored keep their place
+# behind the scored ones.
+def rerank(reranker, cache, query, candidates, top_n, deadline=None, batch_size=8):
+    query_key = (reranker.name, normalize_question(query))
+    pool = candidates[:top_n]
+    scores = {}
+    pending = []
+    for chunk_id, text in pool:
+        score = cache.get((query_key, chunk_id))
+        if score is None:
+            pending.append((chunk_id, text))
+        else:
+            scores[chunk_id] = score
+
+    batch_seconds = 0.0
+    for start in range(0, len(pending), batch_size):
+        if deadline is not None and time.perf_counter() + batch_seconds > deadline:
+            metrics.incr("rerank_budget_exceeded")
+            break
+        batch = pending[start:start + batch_size]
+        batch_start = time.perf_counter()
+        for (chunk_id, _), score in zip(batch, reranker.score(query, [text for _, text in batch])):
+            scores[chunk_id] = score
+            cache.put((query_key, chunk_id), score)
+        batch_seconds = time.perf_counter() - batch_start
+
+    scored = sorted((c for c in pool if c[0] in scores), key=lambda c: -scores[c[0]])
+    return scored + [c for c in candidates if c[0] not in scores]
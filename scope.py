@@ -0,0 +1,56 @@
+import re
+import hashlib
+
+# Chunk metadata a query can be scoped by. Every vector of a chunk, child
+# vectors included, carries these so the filter applies to all of them.
+SCOPE_FIELDS = ("source", "subtree", "file_type", "depth")
+
+_SCOPE_KEYS = ("source", "subtree", "file_type", "depth", "max_depth")
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set, frozenset)) else [value]
+
+def normalize_scope(scope):
+    # Accepts {"subtree": "guides"}, {"source": ["a.md", "b.md"]},
+    # {"file_type": "md", "max_depth": 2} and combinations (all must hold).
+    # Returns a canonical dict, or None for an empty scope.
+    if not scope:
+        return None
+    unknown = set(scope) - set(_SCOPE_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown scope keys {sorted(unknown)}; expected some of {list(_SCOPE_KEYS)}.")
+    normalized = {}
+    for key in ("source", "subtree", "file_type", "depth"):
+        if scope.get(key) is not None:
+            values = sorted(set(_as_list(scope[key])), key=str)
+            if key == "file_type":
+                values = sorted({str(v).lstrip(".").lower() for v in values})
+            if key == "depth":
+                values = sorted(int(v) for v in values)
+            normalized[key] = values
+    if scope.get("max_depth") is not None:
+        normalized["max_depth"] = int(scope["max_depth"])
+    return normalized or None
+
+def scope_filter(scope):
+    # Chroma `where` clause for a normalized scope.
+    if not scope:
+        return None
+    clauses = []
+    for key in ("source", "subtree", "file_type", "depth"):
+        if key in scope:
+            values = scope[key]
+            clauses.append({key: values[0]} if len(values) == 1 else {key: {"$in": values}})
+    if "max_depth" in scope:
+        clauses.append({"depth": {"$lte": scope["max_depth"]}})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def scope_key(scope):
+    return repr(sorted(scope.items())) if scope else ""
+
+def shard_name(subtree):
+    # Chroma collection names allow [a-zA-Z0-9._-] and must start and end
+    # with a letter or digit; the hash keeps distinct subtrees apart.
+    slug = re.sub(r"[^a-zA-Z0-9]+", "_", subtree).strip("_")[:40]
+    digest = hashlib.md5(subtree.encode("utf-8")).hexdigest()[:8]
+    return f"mdrag_{slug}_{digest}" if slug else f"mdrag_{digest}"
@@ -0,0 +1,204 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+from rag_engine import MdRag
+from embedding_batcher import EmbeddingBatcher
+from scope import normalize_scope
+
+MAX_BODY_BYTES = 1024 * 1024
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+def _serialize_response(response):
+    if not isinstance(response, dict):
+        return {"error": response}
+    return {
+        "answer": response["answer"],
+        "sources": [
+            {
+                "chunk_id": doc.metadata.get("chunk_id"),
+                "source": doc.metadata.get("source"),
+                "content": doc.metadata.get("original_content", doc.page_content),
+            }
+            for doc in response["sources"]
+        ],
+        "cached": response.get("cached"),
+        "timings": response.get("timings", {}),
+    }
+
+# Minimal HTTP/JSON front end that shares one MdRag across all clients.
+# Requests wait in a bounded queue served by a fixed pool of workers; when
+# the queue is full new requests are rejected with 503 and Retry-After
+# instead of piling up. Query embeddings from concurrent requests are
+# coalesced by an EmbeddingBatcher.
+class RagServer:
+    def __init__(self, rag, workers=8, queue_size=64, embed_batch_size=32, embed_wait_ms=5):
+        self.rag = rag
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.batcher = EmbeddingBatcher(rag.embeddings, max_batch=embed_batch_size, max_wait_ms=embed_wait_ms)
+        self.served = 0
+        self.rejected = 0
+        self._worker_tasks = []
+
+    async def start(self, host, port):
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        print(f"Serving on http://{host}:{port} ({self.workers} workers, queue size {self.queue.maxsize})")
+        return server
+
+    async def _worker(self):
+        while True:
+            question, scope, future = await self.queue.get()
+            try:
+                if not future.cancelled():
+                    future.set_result(await self.rag.aquery(question, embed=self.batcher.embed, scope=scope))
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            status, payload = await self._handle_request(reader)
+        except Exception as e:
+            print(f"Error handling request: {e}")
+            status, payload = 500, {"error": str(e)}
+
+        if isinstance(payload, str):
+            body = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = json.dumps(payload).encode("utf-8")
+            content_type = "application/json"
+        headers = [
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            "Connection: close",
+        ]
+        if status == 503:
+            headers.append("Retry-After: 1")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            return 400, {"error": "Empty request"}
+        parts = request_line.split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            return 400, {"error": "Malformed request line"}
+        method, target, _ = parts
+        # Route on the path alone, so "/query?x=1" is still /query.
+        path = urlsplit(target).path
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if path == "/health":
+            return 200, {
+                "status": "ok",
+                "queued": self.queue.qsize(),
+                "served": self.served,
+                "rejected": self.rejected,
+                "embedding_batches": self.batcher.batches,
+                "embedding_requests": self.batcher.requests,
+                "answer_cache": self.rag.answer_cache.stats(),
+            }
+        if path == "/metrics":
+            # Prometheus text format, for scraping.
+            return 200, self.rag.metrics.prometheus()
+        if path != "/query":
+            return 404, {"error": f"Unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "Use POST"}
+
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            length = -1
+        if length < 0:
+            return 400, {"error": "Invalid Content-Length"}
+        if length > MAX_BODY_BYTES:
+            return 413, {"error": "Request body too large"}
+        try:
+            data = json.loads(await reader.readexactly(length))
+            question = data["question"].strip()
+        except (ValueError, KeyError, AttributeError, asyncio.IncompleteReadError):
+            return 400, {"error": 'Expected a JSON body like {"question": "..."}'}
+        if not question:
+            return 400, {"error": "Question is empty"}
+        try:
+            scope = normalize_scope(data.get("scope"))
+        except (ValueError, TypeError, AttributeError) as e:
+            return 400, {"error": f"Invalid scope: {e}"}
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((question, scope, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return 503, {"error": "Server busy, retry later"}
+
+        start = time.perf_counter()
+        response = await future
+        self.served += 1
+        payload = _serialize_response(response)
+        payload["latency_ms"] = (time.perf_counter() - start) * 1000
+        return (200 if "answer" in payload else 503), payload
+
+async def _main(args):
+    rag = await MdRag.acreate(source_dir=args.source_dir, persist_dir=args.persist_dir, temperature=args.temperature)
+    server = RagServer(
+        rag,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        embed_batch_size=args.embed_batch_size,
+        embed_wait_ms=args.embed_wait_ms
+    )
+    http_server = await server.start(args.host, args.port)
+    async with http_server:
+        await http_server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve MdRag queries over HTTP/JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--source-dir", default="llm_sources")
+    parser.add_argument("--persist-dir", default="./chroma_db")
+    parser.add_argument("--temperature", type=float, default=0.3)
+    parser.add_argument("--workers", type=int, default=8, help="Queries answered concurrently.")
+    parser.add_argument("--queue-size", type=int, default=64, help="Waiting queries before returning 503.")
+    parser.add_argument("--embed-batch-size", type=int, default=32)
+    parser.add_argument("--embed-wait-ms", type=float, default=5)
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        print("Shutting down.")
+
+if __name__ == "__main__":
+    sys.exit(main())
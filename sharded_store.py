@@ -0,0 +1,102 @@
+import os
+import json
+import threading
+
+from scope import shard_name
+
+SHARDS_FILE = "shards.json"
+
+class _ShardedCollection:
+    def __init__(self, store):
+        self._store = store
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        # Each vector goes to the collection of its chunk's subtree.
+        groups = {}
+        for row in zip(ids, embeddings, documents, metadatas):
+            groups.setdefault((row[3] or {}).get("subtree", ""), []).append(row)
+        for subtree, rows in groups.items():
+            shard_ids, shard_embeddings, shard_documents, shard_metadatas = (list(c) for c in zip(*rows))
+            self._store.shard(subtree)._collection.upsert(
+                ids=shard_ids, embeddings=shard_embeddings, documents=shard_documents, metadatas=shard_metadatas
+            )
+
+    def count(self):
+        return sum(shard._collection.count() for shard in self._store.shards())
+
+# One vector collection per source subtree, behind the subset of the
+# langchain_chroma.Chroma interface that MdRag uses. Writes are routed by
+# the "subtree" metadata of each vector; reads, deletes and searches fan
+# out over every shard, or only over `subtrees` where given, so a query
+# scoped to one subtree never touches the other collections. `open_shard`
+# opens the store for a collection name; the subtrees seen so far are
+# recorded in shards.json under `persist_dir`.
+class ShardedVectorStore:
+    def __init__(self, open_shard, persist_dir=None):
+        self._open_shard = open_shard
+        self.path = os.path.join(persist_dir, SHARDS_FILE) if persist_dir else None
+        self._lock = threading.RLock()
+        self._shards = {}
+        self._collection = _ShardedCollection(self)
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                for subtree in json.load(f):
+                    self._shards[subtree] = self._open_shard(shard_name(subtree))
+
+    def shard(self, subtree):
+        with self._lock:
+            store = self._shards.get(subtree)
+            if store is None:
+                store = self._shards[subtree] = self._open_shard(shard_name(subtree))
+                self._save()
+            return store
+
+    def shards(self, subtrees=None):
+        with self._lock:
+            if subtrees is None:
+                return list(self._shards.values())
+            return [self._shards[s] for s in subtrees if s in self._shards]
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(sorted(self._shards), f)
+        os.replace(tmp_file, self.path)
+
+    def get(self, ids=None, limit=None, include=None, where=None, subtrees=None):
+        merged = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+        kwargs = {"where": where} if where else {}
+        if include is not None:
+            kwargs["include"] = include
+        for shard in self.shards(subtrees):
+            remaining = None if limit is None else limit - len(merged["ids"])
+            if remaining is not None and remaining <= 0:
+                break
+            result = shard.get(ids=ids, limit=remaining, **kwargs)
+            for key in merged:
+                if result.get(key) is not None:
+                    merged[key].extend(result[key])
+        return merged
+
+    def delete(self, ids=None):
+        for shard in self.shards():
+            shard.delete(ids=ids)
+
+    def reset_collection(self):
+        for shard in self.shards():
+            shard.reset_collection()
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, subtrees=None):
+        shards = self.shards(subtrees)
+        if len(shards) == 1:
+            return shards[0].similarity_search_by_vector(embedding, k=k, filter=filter)
+        # Distances from collections with the same embedding function and
+        # space are comparable, so the best k overall are the best of each.
+        hits = []
+        for shard in shards:
+            hits.extend(shard.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter))
+        hits.sort(key=lambda hit: hit[1])
+        return [doc for doc, _ in hits[:k]]
@@ -0,0 +1,112 @@
+import os
+import re
+from fnmatch import translate
+
+DEFAULT_INCLUDE = ("*.md", "*.txt", "*.rst")
+DEFAULT_EXCLUDE = (".*", "node_modules", "__pycache__")
+
+def _compile_globs(patterns):
+    # One regex for the whole list; fnmatch per pattern dominates the cost
+    # of scanning tens of thousands of files.
+    if not patterns:
+        return re.compile(r"(?!)")
+    return re.compile("|".join(f"(?:{translate(p)})" for p in patterns))
+
+def parse_globs(value, default):
+    if not value:
+        return default
+    return tuple(p.strip() for p in value.split(",") if p.strip())
+
+# Finds source files under one or more root directories. Files under the
+# first (primary) root are keyed by their path relative to it, which keeps
+# manifests written before multi-root support valid; files under any other
+# root are keyed by their full path. Include/exclude globs are matched
+# against the root-relative path and, for excludes, also against each path
+# component, so "node_modules" prunes that directory at any depth.
+class SourceScanner:
+    def __init__(self, roots, include=DEFAULT_INCLUDE, exclude=DEFAULT_EXCLUDE):
+        self.roots = [os.path.normpath(root) for root in roots]
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self._abs_roots = [os.path.abspath(root) for root in self.roots]
+        self._include = _compile_globs(self.include)
+        self._exclude = _compile_globs(self.exclude)
+
+    @property
+    def primary(self):
+        return self.roots[0]
+
+    def _split(self, key):
+        for root in self.roots[1:]:
+            if key.startswith(root + os.sep):
+                return root, key[len(root) + 1:]
+        return self.primary, key
+
+    def path_for(self, key):
+        root, rel = self._split(key)
+        return os.path.join(root, rel)
+
+    def subtree(self, key):
+        # The top-level directory a file sits under ("" for files directly
+        # in the primary root). Under an extra root it is prefixed with the
+        # root, so the same directory name in two roots stays distinct.
+        root, rel = self._split(key)
+        parts = rel.split(os.sep)
+        top = parts[0] if len(parts) > 1 else ""
+        if root == self.primary:
+            return top
+        return os.path.join(root, top) if top else root
+
+    def key_for(self, path):
+        # Maps a filesystem path (absolute or relative to the cwd) back to its
+        # manifest key, or None if it is outside every root.
+        path = os.path.abspath(path)
+        # Check the most specific root first in case roots are nested.
+        for index in sorted(range(len(self.roots)), key=lambda i: -len(self._abs_roots[i])):
+            abs_root = self._abs_roots[index]
+            if path == abs_root or not path.startswith(abs_root + os.sep):
+                continue
+            rel = path[len(abs_root) + 1:]
+            return rel if index == 0 else os.path.join(self.roots[index], rel)
+        return None
+
+    def _excluded(self, rel):
+        return bool(self._exclude.match(rel)) or any(self._exclude.match(part) for part in rel.split(os.sep))
+
+    def matches(self, key):
+        _, rel = self._split(key)
+        return bool(self._include.match(rel)) and not self._excluded(rel)
+
+    def scan(self):
+        # Returns {key: (size, mtime_ns, inode)} for every matching file. Only
+        # directory entries are stat'ed; nothing is opened or read.
+        found = {}
+        include, exclude = self._include.match, self._exclude.match
+        other_roots = set(self._abs_roots)
+        for index, root in enumerate(self.roots):
+            if not os.path.isdir(root):
+                continue
+            prefix = "" if index == 0 else root + os.sep
+            other_roots.discard(self._abs_roots[index])
+            stack = [(root, "")]
+            while stack:
+                directory, rel_dir = stack.pop()
+                try:
+                    entries = os.scandir(directory)
+                except OSError as e:
+                    print(f"Cannot read {directory}: {e}")
+                    continue
+                with entries:
+                    for entry in entries:
+                        rel = rel_dir + entry.name
+                        if exclude(entry.name) or exclude(rel):
+                            continue
+                        if entry.is_dir():
+                            # Nested roots are scanned (and keyed) on their own.
+                            if os.path.abspath(entry.path) not in other_roots:
+                                stack.append((entry.path, rel + os.sep))
+                        elif entry.is_file() and include(rel):
+                            st = entry.stat()
+                            found[prefix + rel] = (st.st_size, st.st_mtime_ns, st.st_ino)
+            other_roots.add(self._abs_roots[index])
+        return found
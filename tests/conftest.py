@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+from fakes import FakeChatModel, FakeEmbeddings, InMemoryVectorStore
+
+@pytest.fixture
+def make_rag(tmp_path, monkeypatch):
+    # MdRag over tmp_path/sources with the offline fakes and every cache
+    # kept inside tmp_path. Calling it again reopens the same index.
+    for name, path in (("EMBEDDING_CACHE_PATH", "cache/embeddings"), ("ENRICHMENT_CACHE_PATH", "cache/enrichment.sqlite"),
+                       ("ANSWER_CACHE_PATH", "cache/answers.sqlite")):
+        monkeypatch.setenv(name, str(tmp_path / path))
+    monkeypatch.setenv("PARSE_WORKERS", "0")
+    monkeypatch.setenv("EMBED_WORKERS", "0")
+    (tmp_path / "sources").mkdir()
+    store = InMemoryVectorStore()
+
+    def make(**kwargs):
+        from rag_engine import MdRag
+        kwargs.setdefault("vectorstore", store)
+        return MdRag(
+            source_dir=str(tmp_path / "sources"), persist_dir=str(tmp_path / "index"), extra_source_dirs=[],
+            llm=FakeChatModel(latency=0), embeddings=FakeEmbeddings(dim=64), **kwargs
+        )
+    return make
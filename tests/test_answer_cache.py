@@ -0,0 +1,22 @@
+from langchain_core.documents import Document
+
+from answer_cache import AnswerCache
+
+def _response(answer, *chunk_ids):
+    return {"answer": answer, "sources": [Document(page_content=c, metadata={"chunk_id": c}) for c in chunk_ids]}
+
+def test_invalidation_drops_only_answers_citing_the_chunks(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite"))
+    cache.put("Where is the port set?", [1.0, 0.0], _response("In server.yaml.", "c1", "c2"))
+    cache.put("How do I rotate keys?", [0.0, 1.0], _response("Run rotate.", "c3"))
+
+    assert cache.get_exact("where is the port set")["answer"] == "In server.yaml."
+    assert cache.get_semantic([0.99, 0.01])["cached"] == "semantic"
+
+    assert cache.invalidate_chunks(["c2"]) == 1
+    assert cache.get_exact("Where is the port set?") is None
+    assert cache.get_semantic([0.99, 0.01]) is None
+    assert cache.get_exact("How do I rotate keys?")["answer"] == "Run rotate."
+
+    reopened = AnswerCache(str(tmp_path / "answers.sqlite"))
+    assert reopened.stats()["entries"] == 1
@@ -0,0 +1,66 @@
+import random
+
+import numpy as np
+import pytest
+
+import bm25_index
+from bm25_index import BM25Index
+from lexical_search import synthetic_chunks, make_queries, QUERY_SHAPES
+
+@pytest.fixture
+def small_thresholds(monkeypatch):
+    # Small enough that a few thousand chunks reach MaxScore's cut-off, the
+    # common-term path and its block fallback.
+    monkeypatch.setattr(bm25_index, "PRUNE_MIN_POSTINGS", 64)
+    monkeypatch.setattr(bm25_index, "IMPACT_STEPS", (16, 64, 256))
+    monkeypatch.setattr(bm25_index, "BLOCK_SIZE", 16)
+
+def _build(path=None):
+    rng = np.random.default_rng(0)
+    texts = synthetic_chunks(3000, 40, 2000, rng)
+    index = BM25Index(path, merge_threshold=100000)
+    for i, text in enumerate(texts[:2500]):
+        index.add(str(i), text)
+    index.merge()
+    # Tombstones in the merged segment and a delta on top of it.
+    for i in random.Random(0).sample(range(2500), 300):
+        index.remove(str(i))
+    for i, text in enumerate(texts[2500:], start=2500):
+        index.add(str(i), text)
+    return index
+
+def _assert_same(index, query, k, allowed=None):
+    index.prune = False
+    full = index.search(query, k, allowed)
+    index.prune = True
+    pruned = index.search(query, k, allowed)
+    assert len(pruned) == len(full)
+    # Same scores up to float32 rounding; tied chunks may come in any order.
+    assert np.allclose(sorted(s for _, s in pruned), sorted(s for _, s in full), rtol=1e-5, atol=1e-5)
+    if allowed is not None:
+        assert all(chunk_id in allowed for chunk_id, _ in pruned)
+
+@pytest.mark.parametrize("shape", list(QUERY_SHAPES))
+def test_pruned_search_matches_full_scoring(small_thresholds, shape):
+    index = _build()
+    assert index.common
+    rng = np.random.default_rng(1)
+    allowed = {str(i) for i in random.Random(1).sample(range(3000), 800)}
+    for query in make_queries(shape, 30, 2000, rng):
+        for k in (1, 5, 20):
+            _assert_same(index, query, k)
+            _assert_same(index, query, k, allowed)
+
+def test_common_terms_survive_save_and_load(small_thresholds, tmp_path):
+    index = _build(str(tmp_path / "bm25"))
+    index.save()
+    loaded = BM25Index.load(str(tmp_path))
+    assert set(loaded.common) == set(index.common)
+    for query in make_queries("common", 10, 2000, np.random.default_rng(2)):
+        assert [c for c, _ in loaded.search(query, 10)] == [c for c, _ in index.search(query, 10)]
+
+def test_removed_chunks_are_never_returned(small_thresholds):
+    index = _build()
+    removed = {str(i) for i in range(2500) if str(i) not in index}
+    for query in make_queries("common", 10, 2000, np.random.default_rng(3)):
+        assert not removed & {c for c, _ in index.search(query, 50)}
@@ -0,0 +1,38 @@
+import zlib
+import multiprocessing
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+def _append(path, writer, batches):
+    cache = EmbeddingCache(path)
+    for batch in range(batches):
+        keys = [f"{writer}-{batch}-{i}" for i in range(8)]
+        cache.put_many(keys, [np.full(4, zlib.crc32(key.encode()) % 1000, dtype=np.float32) for key in keys])
+    cache.close()
+
+def test_processes_sharing_a_cache_never_swap_vectors(tmp_path):
+    path = str(tmp_path / "embeddings")
+    reader = EmbeddingCache(path)
+    context = multiprocessing.get_context("spawn")
+    writers = [context.Process(target=_append, args=(path, w, 50)) for w in range(3)]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join()
+        assert process.exitcode == 0
+
+    keys = [f"{w}-{b}-{i}" for w in range(3) for b in range(50) for i in range(8)]
+    found = reader.get_many(keys)
+    assert len(found) == len(keys)
+    for key in keys:
+        assert found[key][0] == zlib.crc32(key.encode()) % 1000
+
+def test_rows_past_the_end_of_the_file_are_misses(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings"))
+    cache.put_many(["a", "b"], np.ones((2, 4), dtype=np.float32))
+    with open(cache.vectors_path, "r+b") as f:
+        f.truncate(4 * 4)
+    cache._rows = 0
+    assert set(cache.get_many(["a", "b"])) == {"a"}
@@ -0,0 +1,31 @@
+import sqlite3
+
+from enrichment_cache import EnrichmentCache
+
+def _last_used(path, key):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT last_used FROM enrichments WHERE key = ?", (key,)).fetchone()[0]
+
+def test_hits_are_written_on_flush(tmp_path):
+    path = str(tmp_path / "enrichment.sqlite")
+    cache = EnrichmentCache(path)
+    cache.put("a", {"summary": "x"})
+    stored = _last_used(path, "a")
+
+    assert cache.get("a") == {"summary": "x"}
+    assert _last_used(path, "a") == stored
+    cache.flush()
+    assert _last_used(path, "a") > stored
+    cache.close()
+
+def test_eviction_sees_pending_hits(tmp_path):
+    cache = EnrichmentCache(str(tmp_path / "enrichment.sqlite"), max_entries=3)
+    for key in "abc":
+        cache.put(key, {"summary": key})
+    # "a" is the oldest entry, but its hit makes "b" the least recently used.
+    assert cache.get_many(["a", "missing"]) == [{"summary": "a"}, None]
+    cache.put("d", {"summary": "d"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"summary": "a"}
+    cache.close()
@@ -0,0 +1,20 @@
+from evaluate import load_questions
+from scope import normalize_scope
+
+def test_csv_scope_is_parsed(tmp_path):
+    path = tmp_path / "questions.csv"
+    path.write_text(
+        "question,expected_sources,scope\n"
+        'How do I rotate keys?,billing/keys.md,"{""subtree"": ""billing"", ""max_depth"": 2}"\n'
+        "Where are the limits?,,subtree=billing;file_type=md|rst;max_depth=2\n"
+        "Which port is used?,,\n",
+        encoding="utf-8"
+    )
+    items = load_questions(str(path))
+
+    assert items[0]["scope"] == {"subtree": "billing", "max_depth": 2}
+    assert items[1]["scope"] == {"subtree": "billing", "file_type": ["md", "rst"], "max_depth": "2"}
+    assert items[2]["scope"] is None
+    assert normalize_scope(items[1]["scope"]) == {
+        "subtree": ["billing"], "file_type": ["md", "rst"], "max_depth": 2
+    }
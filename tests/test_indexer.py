@@ -0,0 +1,72 @@
+from langchain_core.documents import Document
+
+from fakes import FakeEmbeddings, InMemoryVectorStore
+from indexer import IndexManifest, StreamingIndexer
+
+def _docs(*chunk_ids):
+    return [
+        Document(page_content=f"text {chunk_id}", metadata={"chunk_id": chunk_id, "questions": f"q {chunk_id}"})
+        for chunk_id in chunk_ids
+    ]
+
+def test_journal_replays_over_manifest(tmp_path):
+    manifest = IndexManifest(str(tmp_path))
+    manifest.record("a.md", {"hash": "h1", "chunks": ["a1"]})
+    manifest.compact()
+    manifest.record("b.md", {"hash": None, "chunks": [], "pending": ["b1"]})
+    manifest.add_pending("b.md", ["b2"])
+    manifest.record("a.md", None)
+    manifest.mark_migrated("txt-enrichment")
+    with open(manifest.journal_path, "a") as f:
+        f.write('{"file": "c.md", "ent')
+
+    loaded = IndexManifest(str(tmp_path))
+    assert loaded.load()
+    assert loaded.entries == {"b.md": {"hash": None, "chunks": [], "pending": ["b1", "b2"]}}
+    assert loaded.migrations == {"txt-enrichment"}
+
+    loaded.compact()
+    compacted = IndexManifest(str(tmp_path))
+    compacted.load()
+    assert compacted.entries == loaded.entries
+    assert compacted.migrations == {"txt-enrichment"}
+
+def test_streamed_file_is_checkpointed_when_its_last_batch_is_written(tmp_path):
+    store = InMemoryVectorStore()
+    manifest = IndexManifest(str(tmp_path))
+    indexer = StreamingIndexer(store, FakeEmbeddings(dim=16), manifest, batch_size=2)
+
+    state = indexer.begin_file("a.md", old_ids=[])
+    indexer.add_docs(state, _docs("a1", "a2", "a3"))
+    assert manifest.entries["a.md"]["hash"] is None
+    assert manifest.entries["a.md"]["pending"] == ["a1", "a2", "a3"]
+    indexer.add_docs(state, _docs("a4"))
+    indexer.end_file(state, "h1")
+    # Everything was written in full batches, so the file is done already.
+    assert manifest.entries["a.md"] == {"hash": "h1", "chunks": ["a1", "a2", "a3", "a4"]}
+    # Each chunk has its own vector and one for its questions.
+    assert sorted(store.get()["ids"]) == sorted(f"a{i}{kind}" for i in range(1, 5) for kind in ("", "#questions"))
+
+    reloaded = IndexManifest(str(tmp_path))
+    reloaded.load()
+    assert reloaded.entries == manifest.entries
+
+def test_pending_ids_of_an_interrupted_file_are_cleaned_up(tmp_path):
+    store = InMemoryVectorStore()
+    manifest = IndexManifest(str(tmp_path))
+    deleted = []
+    indexer = StreamingIndexer(store, FakeEmbeddings(dim=16), manifest, batch_size=1, on_delete=deleted.extend)
+    indexer.add_file("a.md", "h1", _docs("a1", "a2"), old_ids=[])
+
+    # A sync that wrote a3 and then failed part way.
+    state = indexer.begin_file("a.md", old_ids=["a1", "a2"])
+    indexer.add_docs(state, _docs("a1", "a3"))
+    indexer.end_file(state, "h2", complete=False)
+    assert manifest.entries["a.md"] == {"hash": None, "chunks": ["a1", "a2"], "pending": ["a3"]}
+
+    # The next sync finds a4 instead of a3; both a2 and the stray a3 go.
+    entry = manifest.entries["a.md"]
+    indexer.add_file("a.md", "h3", _docs("a1", "a4"), old_ids=entry["chunks"], pending_ids=entry["pending"])
+    assert manifest.entries["a.md"] == {"hash": "h3", "chunks": ["a1", "a4"]}
+    assert sorted(deleted) == ["a2", "a3"]
+    assert {parent.split("#")[0] for parent in store.get()["ids"]} == {"a1", "a4"}
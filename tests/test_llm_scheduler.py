@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from llm_scheduler import LLMScheduler
+
+class FlakyLLM:
+    # Fails the first `failures` calls with `error`, then answers.
+    def __init__(self, failures=0, error="429 Too Many Requests"):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError(self.error)
+        return f"answer to {prompt}"
+
+def test_throttling_halves_the_limit_and_successes_grow_it_back():
+    scheduler = LLMScheduler(max_concurrency=8, max_retries=3, base_delay=0.0)
+    llm = FlakyLLM(failures=2)
+
+    assert asyncio.run(scheduler.invoke(llm, "q")) == "answer to q"
+    assert scheduler.throttled == 2
+    assert scheduler.retries == 2
+    # 8 -> 4 -> 2, then one success adds 1 / 2.
+    assert scheduler.limit == pytest.approx(2.5)
+
+    async def succeed(n):
+        for _ in range(n):
+            await scheduler.invoke(llm, "q")
+    asyncio.run(succeed(60))
+    assert scheduler.limit == 8.0
+    assert scheduler.stats()["concurrency_limit"] == 8
+
+def test_other_errors_are_retried_without_shrinking_the_limit():
+    scheduler = LLMScheduler(max_concurrency=4, max_retries=2, base_delay=0.0)
+    llm = FlakyLLM(failures=10, error="invalid request")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(scheduler.invoke(llm, "q"))
+    assert llm.calls == 3
+    assert scheduler.failures == 1
+    assert scheduler.throttled == 0
+    assert scheduler.limit == 4.0
+
+def test_dead_letters_are_kept_per_source():
+    scheduler = LLMScheduler()
+    scheduler.dead_letter("docs/a.md", "a1", RuntimeError("boom"))
+    scheduler.dead_letter("docs/b.md", "b1", RuntimeError("boom"))
+    assert scheduler.dead_letters_for("docs/a.md") == [{"source": "docs/a.md", "chunk_id": "a1", "error": "boom"}]
+    assert scheduler.stats()["dead_letters"] == 2
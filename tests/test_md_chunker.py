@@ -0,0 +1,37 @@
+from md_chunker import iter_markdown_chunks
+
+def _chunks(text, **kwargs):
+    return [doc for _, doc in iter_markdown_chunks(text.splitlines(keepends=True), **kwargs)]
+
+def test_headers_become_metadata_but_not_inside_fences():
+    docs = _chunks(
+        "# Guide\n\nIntro.\n\n## Install\n\n```bash\n# not a header\npip install x\n```\n\nDone.\n"
+    )
+    assert [doc.metadata for doc in docs] == [
+        {"Header 1": "Guide"}, {"Header 1": "Guide", "Header 2": "Install"}
+    ]
+    assert "# not a header" in docs[1].page_content
+
+def test_split_fence_is_closed_and_reopened():
+    body = "\n".join(f"value_{i} = {i}" for i in range(80))
+    docs = _chunks(f"# Config\n\n~~~python\n{body}\n~~~\n", chunk_size=400, chunk_overlap=50)
+    assert len(docs) > 1
+    for doc in docs:
+        lines = doc.page_content.splitlines()
+        assert lines[0] == "~~~python"
+        assert lines[-1] == "~~~"
+        assert sum(line.startswith("~~~") for line in lines) == 2
+    assert [doc.metadata["part"] for doc in docs] == list(range(1, len(docs) + 1))
+    assert {doc.metadata["parts"] for doc in docs} == {len(docs)}
+
+def test_split_table_repeats_its_header_rows():
+    rows = "\n".join(f"| key_{i} | {i} |" for i in range(60))
+    docs = _chunks(f"# Limits\n\n| Name | Value |\n| --- | --- |\n{rows}\n", chunk_size=300, chunk_overlap=0)
+    assert len(docs) > 1
+    seen = []
+    for doc in docs:
+        lines = doc.page_content.splitlines()
+        assert lines[:2] == ["| Name | Value |", "| --- | --- |"]
+        assert all(line.startswith("| ") and line.endswith(" |") for line in lines)
+        seen.extend(lines[2:])
+    assert seen == rows.splitlines()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from quantized_index import QuantizedIndex
+
+def _vectors(n, dim=64, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_rescored_results_are_exact_cosines(mode):
+    vectors = _vectors(2000)
+    ids = [f"v{i}" for i in range(len(vectors))]
+    index = QuantizedIndex(dims=32, mode=mode, rescore=10, merge_threshold=1000)
+    index.add(ids, vectors)
+
+    rng = np.random.default_rng(1)
+    for target in rng.integers(0, len(vectors), 10):
+        query = vectors[target] + 0.1 * _vectors(1, seed=int(target))[0]
+        results = index.search(query, k=5)
+        assert results[0][0] == ids[target]
+        # Scores come from the full-precision vectors, not the codes.
+        exact = vectors @ (query / np.linalg.norm(query))
+        for vector_id, score in results:
+            assert score == pytest.approx(exact[int(vector_id[1:])], abs=1e-5)
+        assert [s for _, s in results] == sorted((s for _, s in results), reverse=True)
+
+def test_rescoring_every_row_matches_brute_force():
+    vectors = _vectors(500)
+    ids = [f"v{i}" for i in range(len(vectors))]
+    index = QuantizedIndex(dims=16, rescore=100)
+    index.add(ids, vectors)
+    query = _vectors(1, seed=7)[0]
+    expected = np.argsort(-(vectors @ query))[:5]
+    assert [vector_id for vector_id, _ in index.search(query, k=5)] == [ids[i] for i in expected]
+
+def test_removed_and_replaced_rows_survive_save_and_load(tmp_path):
+    vectors = _vectors(300)
+    ids = [f"v{i}" for i in range(len(vectors))]
+    index = QuantizedIndex(str(tmp_path / "dense"), dims=32)
+    index.add(ids, vectors)
+    index.remove("v0")
+    index.add(["v1"], vectors[2:3])
+    index.save()
+
+    loaded = QuantizedIndex.load(str(tmp_path), dims=32)
+    assert len(loaded) == 299
+    assert "v0" not in loaded
+    assert all(vector_id != "v0" for vector_id, _ in loaded.search(vectors[0], k=10))
+    top = [vector_id for vector_id, _ in loaded.search(vectors[2], k=2)]
+    assert set(top) == {"v1", "v2"}
@@ -0,0 +1,14 @@
+import time
+
+import numpy as np
+
+from reranker import mmr
+
+def test_mmr_skips_near_duplicates():
+    vectors = [np.array([1.0, 0.0]), np.array([1.0, 0.01]), np.array([0.0, 1.0])]
+    assert mmr([1.0, 0.99, 0.8], vectors, k=3, lambda_mult=0.7) == [0, 2, 1]
+    assert mmr([1.0, 0.99, 0.8], vectors, k=3, lambda_mult=1.0) == [0, 1, 2]
+
+def test_mmr_past_its_deadline_keeps_the_input_order():
+    vectors = [np.array([1.0, 0.0]), np.array([1.0, 0.01]), np.array([0.0, 1.0])]
+    assert mmr([1.0, 0.99, 0.8], vectors, k=3, deadline=time.perf_counter() - 1) == [0, 1, 2]
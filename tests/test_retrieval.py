@@ -0,0 +1,16 @@
+from test_sync import _doc
+
+def test_spent_budget_keeps_the_fused_order(make_rag, tmp_path):
+    for i in range(4):
+        (tmp_path / "sources" / f"doc{i}.md").write_text(_doc(f"Topic{i}", 30))
+    rag = make_rag()
+    assert rag.mmr_lambda == 0.7
+
+    diversified = rag._retrieve("topic1 topic10w1 topic20w2")
+    assert "mmr_ms" in diversified["timings"]
+    assert len(diversified["docs"]) == rag.k
+
+    rag.retrieval_budget = 1e-9
+    budgeted = rag._retrieve("topic1 topic10w1 topic20w2")
+    assert "mmr_ms" not in budgeted["timings"]
+    assert len(budgeted["docs"]) == rag.k
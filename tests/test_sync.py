@@ -0,0 +1,129 @@
+import os
+
+import pytest
+
+from fakes import InMemoryVectorStore
+from indexer import IndexManifest, vector_ids
+
+def _doc(title, words):
+    return f"# {title}\n\n" + "\n\n".join(
+        f"## Part {i}\n\n" + " ".join(f"{title.lower()}{i}w{j}" for j in range(words)) for i in range(3)
+    ) + "\n"
+
+def _check_consistent(rag):
+    # Every stored vector, BM25 document and dense row belongs to a chunk
+    # the manifest lists, and the other way round.
+    manifest = IndexManifest(rag.persist_dir)
+    manifest.load()
+    chunks = [c for entry in manifest.entries.values() for c in entry["chunks"]]
+    assert all(entry["hash"] for entry in manifest.entries.values())
+    stored = set(rag.vectorstore.get()["ids"])
+    assert stored == set(vector_ids(chunks))
+    assert rag.lexical_index.chunk_ids() == set(chunks)
+    return manifest
+
+def test_rename_over_indexed_file_replaces_it(make_rag, tmp_path):
+    sources = tmp_path / "sources"
+    (sources / "a.md").write_text(_doc("Alpha", 40))
+    (sources / "b.md").write_text(_doc("Beta", 40))
+    rag = make_rag()
+    before = _check_consistent(rag)
+    a_chunks = len(before.entries["a.md"]["chunks"])
+
+    os.replace(sources / "a.md", sources / "b.md")
+    rag.sync(changed=["a.md", "b.md"], renamed=[("a.md", "b.md")])
+    manifest = _check_consistent(rag)
+    assert set(manifest.entries) == {"b.md"}
+    assert len(manifest.entries["b.md"]["chunks"]) == a_chunks
+    assert not rag.lexical_index.search("beta0w1")
+
+    rag.sync()
+    _check_consistent(rag)
+
+def test_edit_replaces_only_changed_chunks(make_rag, tmp_path):
+    path = tmp_path / "sources" / "a.md"
+    path.write_text(_doc("Alpha", 40))
+    rag = make_rag()
+    before = _check_consistent(rag)
+
+    path.write_text(path.read_text().replace("alpha1w5 ", "edited1w5 "))
+    rag.sync()
+    after = _check_consistent(rag)
+    old, new = set(before.entries["a.md"]["chunks"]), set(after.entries["a.md"]["chunks"])
+    assert len(old - new) == len(new - old) == 1
+    assert rag.lexical_index.search("edited1w5")
+    assert not rag.lexical_index.search("alpha1w5")
+
+def test_delete_removes_every_vector(make_rag, tmp_path):
+    sources = tmp_path / "sources"
+    (sources / "a.md").write_text(_doc("Alpha", 40))
+    (sources / "b.md").write_text(_doc("Beta", 40))
+    rag = make_rag()
+
+    (sources / "b.md").unlink()
+    rag.sync()
+    assert set(_check_consistent(rag).entries) == {"a.md"}
+    assert not rag.lexical_index.search("beta0w1")
+
+def test_rename_rekeys_vectors_without_enriching_again(make_rag, tmp_path):
+    sources = tmp_path / "sources"
+    (sources / "a.md").write_text(_doc("Alpha", 40))
+    rag = make_rag()
+    chunks = len(_check_consistent(rag).entries["a.md"]["chunks"])
+    calls = rag.llm.occupancy.calls
+
+    os.replace(sources / "a.md", sources / "c.md")
+    rag.sync(changed=["a.md", "c.md"], renamed=[("a.md", "c.md")])
+    manifest = _check_consistent(rag)
+    assert set(manifest.entries) == {"c.md"}
+    assert len(manifest.entries["c.md"]["chunks"]) == chunks
+    assert rag.llm.occupancy.calls == calls
+    assert all(m["source"].endswith("c.md") for m in rag.vectorstore.get()["metadatas"] if "parent_id" not in m)
+
+def test_interrupted_sync_is_cleaned_up_by_the_next(make_rag, tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBED_BATCH_SIZE", "2")
+    sources = tmp_path / "sources"
+    (sources / "a.md").write_text(_doc("Alpha", 40))
+    (sources / "b.md").write_text(_doc("Beta", 40))
+    store = InMemoryVectorStore()
+    upsert = store._collection.upsert
+    batches = []
+
+    def fail_after_two_batches(*args, **kwargs):
+        batches.append(1)
+        if len(batches) > 2:
+            raise RuntimeError("disk full")
+        upsert(*args, **kwargs)
+
+    store._collection.upsert = fail_after_two_batches
+    with pytest.raises(RuntimeError):
+        make_rag(vectorstore=store)
+    assert store.get()["ids"]
+
+    # The chunks written so far are stale by the time the next sync runs.
+    for name in ("a.md", "b.md"):
+        (sources / name).write_text((sources / name).read_text().replace("w1 ", "x1 "))
+    store._collection.upsert = upsert
+    rag = make_rag(vectorstore=store)
+    manifest = _check_consistent(rag)
+    assert set(manifest.entries) == {"a.md", "b.md"}
+    assert not any(entry.get("pending") for entry in manifest.entries.values())
+
+def test_changed_chunks_invalidate_cached_answers(make_rag, tmp_path):
+    path = tmp_path / "sources" / "a.md"
+    path.write_text(_doc("Alpha", 40))
+    rag = make_rag()
+    question = "What is alpha1w5?"
+    response = rag.query(question)
+    assert response["sources"]
+    assert rag.answer_cache.get_exact(question) is not None
+
+    cited = {doc.metadata["chunk_id"] for doc in response["sources"]}
+    text = path.read_text()
+    for doc in response["sources"]:
+        words = doc.metadata.get("original_content", doc.page_content).split()
+        text = text.replace(words[-1], "changed")
+    path.write_text(text)
+    rag.sync()
+    assert cited - set(_check_consistent(rag).entries["a.md"]["chunks"])
+    assert rag.answer_cache.get_exact(question) is None
@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+import threading
+
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+# Collapses bursts of filesystem events into one set of changed paths and a
+# map of renames (new path -> original path), so a docs deploy that touches
+# many files triggers a single incremental sync.
+class _ChangeCollector(FileSystemEventHandler):
+    def __init__(self, key_for):
+        self.key_for = key_for
+        self.lock = threading.Lock()
+        self.changed = set()
+        self.renames = {}
+        self.last_event = 0.0
+
+    def _add(self, path):
+        with self.lock:
+            self.changed.add(path)
+            self.last_event = time.monotonic()
+
+    def on_created(self, event):
+        if event.is_directory:
+            return
+        path = self.key_for(event.src_path)
+        if path is not None:
+            self._add(path)
+
+    def on_modified(self, event):
+        self.on_created(event)
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            return
+        path = self.key_for(event.src_path)
+        if path is None:
+            return
+        with self.lock:
+            origin = self.renames.pop(path, None)
+            if origin is not None:
+                # Renamed and then deleted: the original file is gone.
+                self.changed.add(origin)
+            self.changed.add(path)
+            self.last_event = time.monotonic()
+
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        src = self.key_for(event.src_path)
+        dest = self.key_for(event.dest_path)
+        if src is None or dest is None:
+            # Moved into or out of the watched roots: a plain add or delete.
+            for path in (src, dest):
+                if path is not None:
+                    self._add(path)
+            return
+        with self.lock:
+            if src in self.renames:
+                self.renames[dest] = self.renames.pop(src)
+            elif src in self.changed:
+                # Editors often save by renaming a temp file over the target.
+                self.changed.discard(src)
+            else:
+                self.renames[dest] = src
+            self.changed.add(dest)
+            self.last_event = time.monotonic()
+
+    def drain(self, debounce):
+        with self.lock:
+            if not (self.changed or self.renames):
+                return None
+            if time.monotonic() - self.last_event < debounce:
+                return None
+            renamed = [(old, new) for new, old in self.renames.items()]
+            changed = self.changed | {old for old, _ in renamed}
+            self.changed = set()
+            self.renames = {}
+            return changed, renamed
+
+# Watches every source root and feeds only the affected files into
+# MdRag.sync once events have been quiet for `debounce` seconds.
+class SourceWatcher:
+    def __init__(self, rag, debounce=2.0):
+        self.rag = rag
+        self.debounce = debounce
+        self.collector = _ChangeCollector(rag.scanner.key_for)
+        self._observer = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        os.makedirs(self.rag.source_dir, exist_ok=True)
+        self._observer = Observer()
+        roots = [root for root in self.rag.scanner.roots if os.path.isdir(root)]
+        for root in roots:
+            self._observer.schedule(self.collector, root, recursive=True)
+        self._observer.start()
+        self._thread = threading.Thread(target=self._run, name="mdrag-watcher", daemon=True)
+        self._thread.start()
+        print(f"Watching {', '.join(roots)} for changes...")
+
+    def stop(self):
+        self._stop.set()
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(min(self.debounce / 4, 0.5)):
+            batch = self.collector.drain(self.debounce)
+            if batch is None:
+                continue
+            changed, renamed = batch
+            changed = {p for p in changed if self.rag.is_source_file(p)}
+            renamed = [(old, new) for old, new in renamed if self.rag.is_source_file(old)]
+            if not changed and not renamed:
+                continue
+            print(f"Detected changes in {len(changed)} files ({len(renamed)} renames).")
+            try:
+                self.rag.sync(changed=changed, renamed=renamed)
+            except Exception as e:
+                print(f"Incremental sync failed: {e}")
+
+def main():
+    from rag_engine import MdRag
+
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else "llm_sources"
+    rag = MdRag(source_dir=source_dir)
+    watcher = SourceWatcher(rag, debounce=float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2")))
+    watcher.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+if __name__ == "__main__":
+    main()